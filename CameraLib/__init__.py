@@ -1 +1 @@
-﻿__all__ = ['baseCamera', 'cameraOpencv', 'cameraPi', 'faceTracking']
+﻿__all__ = ['baseCamera', 'cameraOpencv', 'cameraPi', 'faceTracking', 'frameCache', 'cameraManager', 'stageStats', 'faceDetectorPool', 'trackAssociation', 'cameraFrame', 'mjpegReader', 'overlay', 'metrics', 'cameraSimulated', 'videoRecorder', 'replayBuffer', 'motionDetector', 'trackerBackends', 'frameTrace', 'derivedStreams', 'changeFilter', 'detectionScheduler']
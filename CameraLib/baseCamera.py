@@ -1,6 +1,6 @@
 import time
 import threading
-import cv2
+import concurrent.futures
 try:
     from greenlet import getcurrent as get_ident
 except ImportError:
@@ -9,149 +9,424 @@ except ImportError:
     except ImportError:
         from _thread import get_ident
 from IotLib.log import Log
+from .stageStats import StageStats
+from .cameraFrame import CameraFrame
+from .overlay import Overlay
+from .frameTrace import getTracer
+from .derivedStreams import DerivedStreams
+from .frameCache import JpegFrameCache
+from . import metrics
 
-class CameraEvent(object):
-    """An Event-like class that signals all active clients when a new frame is available."""
+class FrameBus(object):
+    """ publishes frames with a monotonically increasing sequence number to any number of subscribers
+    subscribers keep the sequence number of the last frame they consumed and ask for a newer one so the bus does not
+    track subscribers at all - threads, greenlets, asyncio tasks (via executors) and thread pools can all consume frames.
+    the bus owns a reference to the published frame: a frame with release() (CameraFrame) is released when it is replaced,
+    subscribers pass acquire=True to get their own reference and must release it when done.
+    """
     def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # this is a new client
-            # add an entry for it in the self.events dict
-            # each entry has two elements, a threading.Event() and a timestamp
-            Log.info('add camera event with thread id: %s' % ident)
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
-        """Invoked by the camera thread when a new frame is available."""
-        now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():
-                # if this client's event is not set, then set it
-                # also update the last set timestamp to now
-                event[0].set()
-                event[1] = now
-            else:
-                # if the client's event is already set, it means the client
-                # did not process a previous frame
-                # if the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            Log.info('remove camera event with thread id: %s' % remove)
-            del self.events[remove]
-
-    def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        thraedId = get_ident()
-        self.events[thraedId][0].clear()
+        self.seq = 0            # sequence number of the latest frame, 0 before the first frame
+        self.value = None       # the latest frame
+        self._condition = threading.Condition()
+
+    def publish(self, value, seq=None):
+        """ publish a new frame and wake up all waiting subscribers. returns the sequence number of the frame
+        seq - the sequence number to publish the frame with (must be larger than the current seq), None for the next number
+        """
+        with self._condition:
+            previous = self.value
+            self.seq = self.seq + 1 if seq is None else seq
+            self.value = value
+            self._condition.notify_all()
+            seq = self.seq
+        if previous is not None and hasattr(previous, 'release'):
+            previous.release()
+        return seq
+
+    def get_frame(self, after_seq=0, timeout=None, acquire=False):
+        """ wait for a frame newer than after_seq and return (seq, frame, skipped)
+        after_seq - the sequence number of the last frame consumed by the caller, 0 to get the latest frame
+        timeout - max seconds to wait, None to wait forever
+        acquire - whether to acquire a reference of the frame for the caller
+        skipped is the number of frames published after after_seq that the caller never saw.
+        returns (after_seq, None, 0) on timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.seq > after_seq, timeout):
+                return (after_seq, None, 0)
+            skipped = self.seq - after_seq - 1 if after_seq > 0 else 0
+            if acquire:
+                self.value.acquire()
+            return (self.seq, self.value, skipped)
+
+    def latest(self, acquire=False):
+        """ return (seq, frame) of the latest frame without waiting """
+        with self._condition:
+            if acquire and self.value is not None:
+                self.value.acquire()
+            return (self.seq, self.value)
 
 
 class BaseCamera(object):
-    """ base camera class that supports static image frames with muti-threaded clients access
+    """ base camera class that supports image frames with muti-threaded clients access
+    each instance has its own capture thread, frame bus and optional face tracker so multiple cameras can run in one process
+    the pipeline has two stages:
+    - capture thread publishes raw frames to bus at sensor rate
+    - tracking thread (with face tracker) picks the newest raw frame whenever it is free and publishes the tracked
+      frame and tracking data to trackingBus with the sequence number of the raw frame. it runs only while the tracked
+      stream of streams (DerivedStreams) has subscribers, tracking=True reads get the raw frames otherwise
+    the crosshair, face boxes and stamp are composited by overlay once per frame into a separate image for all clients,
+    the published frames stay pristine (overlay=False gets them for analytics).
+    idle policy - what the capture thread does after idleSeconds without client access:
+    - IdleStop: stop the thread and close the device (the next client pays for opening the device)
+    - IdleStandby: keep the device open and publish frames at standbyFps till a client starts the camera again. the
+      frames in between are still pulled from the device (frames() may skip decoding them while draining is set) so
+      the driver queue stays empty and the first frame after resume is fresh
+    - IdleAlwaysOn: keep capturing at full rate
     """
-    # todo: break this into two classes - CameraBase and CameraClient to remove the limitation of static image frames
-    thread = None  # background thread that reads frames from camera
-    frame = None  # current frame is stored here by background thread
-    trackingFrame = None  # current frame with face tracking is stored here by background thread
-    last_access = 0  # time of last client access to the camera
-    faceTracker = None  # face tracking object
-    event = CameraEvent()
+    # idle policies
+    IdleStop = 'stop'
+    IdleStandby = 'standby'
+    IdleAlwaysOn = 'always'
 
     def __init__(self, width=1280, height=720, crosshair=False):
         """ construct an instance of camera
         crosshair - whether to draw crosshair in the center of each frame
         """
-        self.crosshair = crosshair
+        self.overlay = Overlay(crosshair=crosshair)  # overlay compositing stage shared by all clients
         self.width = width
         self.height = height
-        pass
+        self.name = self.__class__.__name__
+        self.thread = None  # background thread that reads frames from camera
+        self.frame = None  # current frame (CameraFrame) is stored here by background thread
+        self.trackingFrame = None  # current (pristine) frame tracked by tracking thread
+        self.trackingThread = None  # background thread that runs face tracking
+        self.last_access = 0  # time of last client access to the camera
+        self.faceTracker = None  # face tracking object
+        self.replay = None  # ReplayBuffer with the recent encoded frames (instant replay) or None
+        self._jpegCache = None  # JpegFrameCache shared by the consumers of the frames, created on first use
+        self.bus = FrameBus()  # publishes CameraFrame to clients
+        self.trackingBus = FrameBus()  # publishes (trackingFrame, captureTime, trackingData, boxes) with the seq of the raw frame
+                                       # (trackingData is the FaceTracker.trackingSnapshot() of the frame)
+        self.streams = DerivedStreams(self)  # raw, tracked, gray, thumbnail and faceCrop streams computed only while subscribed
+        self.idlePolicy = BaseCamera.IdleStop  # what to do after idleSeconds without client access
+        self.idleSeconds = 10  # seconds without client access to go idle
+        self.standbyFps = 1.0  # frame rate in standby
+        self.standby = False  # whether the capture thread is in standby
+        self.draining = False  # whether the capture thread drops the next frame in standby (frames() may yield None for it)
+        self._ready = None  # future resolved with the seq of the first frame after start or resume from standby
+        self._wakeTime = 0  # time of the last start or resume, _ready is resolved with a frame captured at or after it
+        self.captureStats = StageStats('capture')
+        self.trackingStats = StageStats('tracking')
+        self._startLock = threading.Lock()
+
+    @property
+    def crosshair(self):
+        """ whether to draw crosshair in the center of each frame """
+        return self.overlay.layers['crosshair'].enabled
+
+    @crosshair.setter
+    def crosshair(self, value):
+        self.overlay.setEnabled('crosshair', value)
+
+    @property
+    def jpegCache(self):
+        """ the JpegFrameCache shared by the streaming clients, the replay buffer and the recorder of the camera """
+        with self._startLock:
+            if self._jpegCache is None:
+                self._jpegCache = JpegFrameCache(name=self.name)
+            return self._jpegCache
+
+    @property
+    def tracer(self):
+        """ the FrameTracer with the metadata and stage latencies of the recent frames """
+        return getTracer(self.name)
 
     def resolution(self):
         """ the resolution of the camera returns (width, height) """
         return (self.width, self.height)
 
+    def setIdlePolicy(self, idlePolicy, idleSeconds=10, standbyFps=1.0):
+        """ set the idle policy (IdleStop, IdleStandby or IdleAlwaysOn), the seconds to go idle and the standby frame rate """
+        if idlePolicy not in (BaseCamera.IdleStop, BaseCamera.IdleStandby, BaseCamera.IdleAlwaysOn):
+            raise ValueError('Invalid idle policy: %s' %str(idlePolicy))
+        if standbyFps <= 0:
+            raise ValueError('Invalid standby fps: %s' %str(standbyFps))
+        self.idlePolicy = idlePolicy
+        self.idleSeconds = idleSeconds
+        self.standbyFps = standbyFps
+
+    def configure(self, config, prefix='camera'):
+        """ apply the settings common to all cameras defined in config (idle policy) """
+        idlePolicy = config.getOrAdd(prefix + '.idlePolicy', BaseCamera.IdleStop)
+        idleSeconds = config.getOrAddFloat(prefix + '.idleSeconds', 10)
+        standbyFps = config.getOrAddFloat(prefix + '.standbyFps', 1.0)
+        self.setIdlePolicy(idlePolicy, idleSeconds, standbyFps)
+        return self
+
     def start(self, faceTracker=None):
-        """Start the background camera thread if it isn't running yet."""
-        BaseCamera.faceTracker = faceTracker    # allows enable face tracking after the first non-face tracking instance
-        if BaseCamera.thread is None:
-            BaseCamera.last_access = time.time()
-
-            # start background frame thread
-            BaseCamera.thread = threading.Thread(target=self._thread)
-            BaseCamera.thread.start()
-            # wait until frames are available
-            while self.get_frame() is None:
-                time.sleep(0)
+        """ start the background camera thread if it isn't running yet or resume it from standby
+        returns a concurrent.futures.Future resolved with the sequence number of the first frame, e.g.
+        camera.start().result(timeout=5) waits for the camera to be ready
+        """
+        self.faceTracker = faceTracker    # allows enable face tracking after the first non-face tracking client
+        with self._startLock:
+            self.last_access = time.time()
+            if self.thread is None:
+                # start background frame thread
+                self._wakeTime = self.last_access
+                self._ready = concurrent.futures.Future()
+                self.thread = threading.Thread(target=self._thread, name='Camera-%s' %self.name)
+                self.thread.start()
+            elif self.standby:
+                # resume from standby on the next frame
+                if self._ready is None or self._ready.done():
+                    self._wakeTime = self.last_access
+                    self._ready = concurrent.futures.Future()
+                self.draining = False
+            ready = self._ready
+        self._startTracking()
+        return ready
 
-    def get_frame(self, tracking=False):
-        """Return the current camera frame, wait till the frame is ready."""
-        BaseCamera.last_access = time.time()
+    def _startTracking(self):
+        """ start the face tracking thread if the camera is running with a face tracker and the tracked stream is subscribed """
+        with self._startLock:
+            if (self.thread is not None and self.faceTracker != None and self.trackingThread is None and
+                self.streams.get('tracked').subscribers > 0):
+                self.trackingThread = threading.Thread(target=self._trackingThread, name='Tracking-%s' %self.name)
+                self.trackingThread.start()
 
-        # wait for a signal from the camera thread
-        BaseCamera.event.wait()
-        BaseCamera.event.clear()
+    def _tracking(self):
+        """ whether the face tracking frames are being published """
+        return self.faceTracker != None and self.trackingThread is not None
 
-        return self.current_frame(tracking)
+    def is_tracking(self):
+        """ whether tracking=True reads get the face tracking frames now (the tracked stream is subscribed), the raw
+        frames otherwise. streaming clients key their encoded frames with it so a raw frame is never cached as tracked.
+        """
+        return self._tracking()
 
-    def current_frame(self, tracking=False):
+    def get_frame(self, tracking=False, overlay=True):
+        """Return the next camera frame, wait till the frame is ready."""
+        return self.wait_frame(self.current_seq(tracking), tracking, overlay=overlay)[1]
+
+    def wait_frame(self, after_seq=0, tracking=False, timeout=None, overlay=True):
+        """ wait for a frame newer than after_seq and return (seq, frame, skipped)
+        after_seq - the sequence number of the last frame received by the caller, 0 to get the latest frame
+        tracking - whether to return the face tracking frame
+        timeout - max seconds to wait, None to wait forever
+        overlay - whether to return the frame with the overlay or the pristine frame (must not be modified)
+        skipped is the number of frames the caller missed since after_seq. frame is None on timeout.
+        """
+        self.last_access = time.time()
+        if tracking and self._tracking():
+            seq, value, skipped = self.trackingBus.get_frame(after_seq, timeout)
+            if value is None:
+                return (seq, None, 0)
+            return (seq, self._render(seq, value[0], True, value[1], value[3], overlay), skipped)
+        seq, frame, skipped = self.bus.get_frame(after_seq, timeout, acquire=True)
+        if frame is None:
+            return (seq, None, 0)
+        try:
+            return (seq, self._render(seq, frame.bgr(), False, frame.timestamp, None, overlay), skipped)
+        finally:
+            frame.release()
+
+    def wait_stream_frame(self, after_seq=0, tracking=False, timeout=None):
+        """ wait for a frame newer than after_seq to stream and return (seq, frame, skipped)
+        same as wait_frame except that frame is the CameraFrame itself when it has the jpeg from the camera and can be
+        streamed as captured (no overlay, not the face tracking frame) so it is neither decoded nor re-encoded.
+        """
+        if self.overlay.active(False) or (tracking and self._tracking()):
+            return self.wait_frame(after_seq, tracking, timeout)
+        self.last_access = time.time()
+        seq, frame, skipped = self.bus.get_frame(after_seq, timeout, acquire=True)
+        if frame is None:
+            return (seq, None, 0)
+        try:
+            if frame.hasJpeg():
+                return (seq, frame, skipped)
+            return (seq, frame.bgr(), skipped)
+        finally:
+            frame.release()
+
+    def current_frame(self, tracking=False, overlay=True):
         """Return the current camera frame immediately without wait """
-        BaseCamera.last_access = time.time()
-        frame = BaseCamera.frame
-        if tracking and BaseCamera.faceTracker != None:
-            frame = BaseCamera.trackingFrame
-        if self.crosshair:
-            # draw cross hair in the center
-            h, w, c = frame.shape
-            xc = (int)(w/2)
-            yc = (int)(h/2)
-            pix = 16
-            cv2.line(frame, (xc - pix, yc), (xc + pix, yc), (0, 255, 0), 1)
-            cv2.line(frame, (xc, yc - pix), (xc, yc + pix), (0, 255, 0), 1)
-        return frame
+        self.last_access = time.time()
+        if tracking and self._tracking():
+            seq, value = self.trackingBus.latest()
+            if value is None:
+                return None
+            return self._render(seq, value[0], True, value[1], value[3], overlay)
+        seq, frame = self.bus.latest(acquire=True)
+        if frame is None:
+            return None
+        try:
+            return self._render(seq, frame.bgr(), False, frame.timestamp, None, overlay)
+        finally:
+            frame.release()
+
+    def current_seq(self, tracking=False):
+        """ return the sequence number of the current frame """
+        return self._select_bus(tracking).seq
+
+    def _select_bus(self, tracking):
+        """ select the raw frame bus or the tracking frame bus """
+        if tracking and self._tracking():
+            return self.trackingBus
+        return self.bus
+
+    def _render(self, seq, img, tracking, timestamp, boxes, overlay):
+        """ get the frame with the overlay rendered once per frame, the pristine frame if overlay is False """
+        if not overlay or not self.overlay.active(tracking):
+            return img
+        context = {'timestamp': timestamp, 'fps': self.captureStats.values()['fps'], 'boxes': boxes}
+        startTime = time.time()
+        output = self.overlay.render(seq, img, tracking, context)
+        self.tracer.stage(seq, 'overlay', startTime, time.time())
+        return output
 
     def current_trackingvalues(self):
-        """ return the current FaceTrackingData values """
-        if BaseCamera.faceTracker != None:
-            return BaseCamera.faceTracker.getTrackedFaces().values
+        """ return the tracking data values (FaceSnapshot) of the latest tracked frame """
+        trackingData = self.current_trackingdata()
+        if trackingData != None:
+            return trackingData.values()
         return None
 
     def current_trackingdata(self):
-        """ return the current dictionary of FaceTrackingData (key: id, value: FaceTrackingData) """
-        if BaseCamera.faceTracker != None:
-            return BaseCamera.faceTracker.getTrackedFaces()
+        """ return the tracking data of the latest tracked frame - a dictionary of FaceSnapshot (key: id)
+        (FaceTrackingData of a duck typed face tracker)
+        """
+        faceTracker = self.faceTracker
+        if faceTracker != None:
+            seq, value = self.trackingBus.latest()
+            if value is not None:
+                return value[2]
+            if hasattr(faceTracker, 'trackingSnapshot'):
+                return faceTracker.trackingSnapshot()
+            return faceTracker.getTrackedFaces()
         return None
 
-    @staticmethod
-    def frames():
-        """"Generator that returns frames from the camera."""
+    def stage_stats(self):
+        """ return the per-stage fps and latency counters as a dictionary """
+        stats = {'capture': self.captureStats.values(), 'tracking': self.trackingStats.values(), 'streams': self.streams.values()}
+        faceTracker = self.faceTracker
+        if faceTracker != None and hasattr(faceTracker, 'costPerFrame'):
+            stats['faceTracker'] = faceTracker.costPerFrame()
+        return stats
+
+    def frames(self):
+        """"Generator that returns frames (bgr images or CameraFrame) from the camera."""
         raise RuntimeError('Must be implemented by subclasses.')
 
-    @classmethod
-    def _thread(cls):
+    def _thread(self):
         """Camera background thread."""
-        Log.info('Starting camera thread %s' % get_ident())
-        frames_iterator = cls.frames()
-        for frame in frames_iterator:
-            BaseCamera.frame = frame
-            if BaseCamera.faceTracker != None:
-                BaseCamera.trackingFrame = frame.copy()
-                BaseCamera.faceTracker.detectOrTrack(BaseCamera.trackingFrame)
-
-            BaseCamera.event.set()  # send signal to clients
-            time.sleep(0)
-
-            # if there hasn't been any clients asking for frames in
-            # the last 10 seconds then stop the thread
-            if time.time() - BaseCamera.last_access > 10:
+        Log.info('Starting camera thread %s for %s' %(get_ident(), self.name))
+        captureFrames = metrics.captureFrames.labels(self.name)
+        captureInterval = metrics.captureInterval.labels(self.name)
+        lastTime = time.time()
+        tracer = self.tracer
+        nextStandbyTime = 0
+        try:
+            frames_iterator = self.frames()
+            for frame in frames_iterator:
+                captureTime = time.time()
+                if frame is None or self.draining:
+                    # a standby frame drained from the device without publishing it
+                    if isinstance(frame, CameraFrame):
+                        frame.release()
+                else:
+                    if not isinstance(frame, CameraFrame):
+                        frame = CameraFrame(bgr=frame, timestamp=captureTime)
+                    self.frame = frame
+                    seq = self.bus.publish(frame)  # send signal to clients
+                    tracer.begin(seq, frame.timestamp)
+                    ready = self._ready
+                    if ready is not None and not ready.done() and frame.timestamp >= self._wakeTime:
+                        ready.set_result(seq)
+                    self.captureStats.record(captureTime - lastTime)
+                    captureFrames.inc()
+                    captureInterval.observe(captureTime - lastTime)
+                    lastTime = captureTime
+                    nextStandbyTime = captureTime + 1.0 / self.standbyFps
+                time.sleep(0)
+
+                # go idle if there hasn't been any clients asking for frames in the last idleSeconds
+                if time.time() - self.last_access <= self.idleSeconds or self.idlePolicy == BaseCamera.IdleAlwaysOn:
+                    if self.standby:
+                        self.standby = False
+                        Log.info('Resuming camera %s from standby' %self.name)
+                    self.draining = False
+                    continue
+                if self.idlePolicy == BaseCamera.IdleStandby:
+                    if not self.standby:
+                        self.standby = True
+                        Log.info('Camera %s in standby at %.1f fps' %(self.name, self.standbyFps))
+                    # keep pulling the frames so the device queue does not fill up with old frames, publish one every
+                    # 1 / standbyFps seconds. start() clears draining to publish the next frame.
+                    now = time.time()
+                    self.draining = now < nextStandbyTime and now - self.last_access > self.idleSeconds
+                    continue
                 frames_iterator.close()
-                Log.info('Stopping camera thread due to inactivity %s' % get_ident())
+                Log.info('Stopping camera thread due to inactivity %s for %s' %(get_ident(), self.name))
                 break
-        BaseCamera.thread = None
-        BaseCamera.faceTracker = None
+        except Exception as e:
+            Log.error('Exception in camera thread %s: %s' %(self.name, str(e)))
+            ready = self._ready
+            if ready is not None and not ready.done():
+                ready.set_exception(e)
+        finally:
+            with self._startLock:
+                self.thread = None
+                self.standby = False
+                self.draining = False
+                self.faceTracker = None
+
+    def _trackingThread(self):
+        """ face tracking background thread - tracks the newest raw frame whenever it is free
+        runs while the camera is running with a face tracker and the tracked stream has subscribers
+        """
+        Log.info('Starting tracking thread %s for %s' %(get_ident(), self.name))
+        seq = 0
+        tracer = self.tracer
+        tracked = self.streams.get('tracked')
+        try:
+            while True:
+                with self._startLock:
+                    faceTracker = self.faceTracker
+                    if self.thread is None or faceTracker is None or tracked.subscribers == 0:
+                        break
+                seq, frame, skipped = self.bus.get_frame(seq, timeout=1, acquire=True)
+                if frame is None:
+                    continue
+                startTime = time.time()
+                try:
+                    trackingFrame = frame.bgr()
+                    # detect with the zero copy gray image when the camera captures yuv
+                    grayImg = frame.gray() if frame.hasGray() else None
+                    if hasattr(faceTracker, 'trackedBoxes'):
+                        # the face boxes are drawn by the overlay so the frame stays pristine
+                        faceTracker.track(trackingFrame, grayImg)
+                        boxes = faceTracker.trackedBoxes()
+                        # the positions and qualities of this frame, the tracker keeps updating its FaceTrackingData
+                        trackingData = faceTracker.trackingSnapshot()
+                    else:
+                        # a duck typed tracker draws the boxes into its own copy of the frame
+                        trackingFrame = trackingFrame.copy()
+                        faceTracker.detectOrTrack(trackingFrame)
+                        boxes = None
+                        trackingData = dict(faceTracker.getTrackedFaces())
+                except Exception as e:
+                    # a failed frame is not published, the tracked clients get the next one
+                    Log.error('Exception in tracking thread %s: %s' %(self.name, str(e)))
+                    continue
+                finally:
+                    frame.release()
+                self.trackingFrame = trackingFrame
+                tracer.stage(seq, 'tracking', startTime, time.time())
+                self.trackingBus.publish((trackingFrame, frame.timestamp, trackingData, boxes), seq=seq)
+                self.trackingStats.record(time.time() - frame.timestamp)
+        finally:
+            with self._startLock:
+                self.trackingThread = None
+        Log.info('Stopping tracking thread %s for %s' %(get_ident(), self.name))
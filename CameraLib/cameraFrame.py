@@ -0,0 +1,134 @@
+import time
+import threading
+import numpy as np
+import cv2
+from IotLib.log import Log
+
+class FramePool(object):
+    """ pool of preallocated frame buffers (1-D uint8 arrays) recycled between captures """
+    def __init__(self, size, count=4):
+        """ construct a FramePool
+        size - the size of each buffer in bytes
+        count - the number of buffers to preallocate (the pool keeps at most this many free buffers)
+        """
+        self.size = size
+        self.count = count
+        self.allocated = count      # total number of buffers allocated
+        self._free = [np.empty(size, dtype=np.uint8) for i in range(count)]
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ get a free buffer, allocate a new one when all buffers are in use """
+        with self._lock:
+            if len(self._free) > 0:
+                return self._free.pop()
+            self.allocated += 1
+        Log.debug('FramePool allocated buffer %i' %self.allocated)
+        return np.empty(self.size, dtype=np.uint8)
+
+    def release(self, buffer):
+        """ return a buffer to the pool """
+        with self._lock:
+            if len(self._free) < self.count:
+                self._free.append(buffer)
+
+class CameraFrame(object):
+    """ a captured frame in bgr, yuv420 (I420) or jpeg format with lazily computed bgr and gray images
+    - gray() of a yuv frame is a zero copy view of the Y plane
+    - bgr() of a yuv or jpeg frame is converted (decoded) once on the first call and cached
+    - jpeg() of a jpeg frame is the compressed frame from the camera that can be streamed without decode and re-encode
+    - a frame from a FramePool buffer is reference counted, acquire() before using it from another thread and release()
+      when done. the buffer returns to the pool when the last reference is released.
+    """
+    def __init__(self, bgr=None, yuv=None, width=0, height=0, pool=None, timestamp=None, jpeg=None):
+        """ construct a CameraFrame from a bgr image, a yuv420 buffer or jpeg bytes
+        yuv - 1-D buffer with the Y plane followed by U and V planes padded to (32, 16) aligned width and height
+        width, height - the size of the yuv or jpeg frame
+        jpeg - the jpeg (mjpeg) bytes of the frame
+        pool - the FramePool that owns the yuv buffer
+        timestamp - the capture time, now if None
+        """
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._bgr = bgr
+        self._yuv = yuv
+        self._jpeg = jpeg
+        self._gray = None
+        self._pool = pool
+        self._refCount = 1
+        self._lock = threading.Lock()
+        if bgr is not None:
+            self.height, self.width = bgr.shape[0], bgr.shape[1]
+        else:
+            self.width = width
+            self.height = height
+        # the padded width and height of the yuv buffer
+        self._yuvWidth = (self.width + 31) // 32 * 32
+        self._yuvHeight = (self.height + 15) // 16 * 16
+
+    @staticmethod
+    def yuvSize(width, height):
+        """ the size of a yuv420 buffer for frames of width x height """
+        return ((width + 31) // 32 * 32) * ((height + 15) // 16 * 16) * 3 // 2
+
+    def bgr(self):
+        """ the frame as bgr image """
+        if self._bgr is None:
+            with self._lock:
+                if self._bgr is None and self._jpeg is not None:
+                    self._bgr = self._decode(cv2.IMREAD_COLOR)
+                elif self._bgr is None:
+                    yuv = self._yuv.reshape(self._yuvHeight * 3 // 2, self._yuvWidth)
+                    bgr = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+                    if self._yuvWidth != self.width or self._yuvHeight != self.height:
+                        bgr = np.ascontiguousarray(bgr[:self.height, :self.width])
+                    self._bgr = bgr
+        return self._bgr
+
+    def gray(self):
+        """ the frame as gray image - a view of the Y plane for yuv frames """
+        if self._gray is None:
+            if self._yuv is not None:
+                self._gray = self._yuv[:self._yuvWidth * self._yuvHeight].reshape(self._yuvHeight, self._yuvWidth)[:self.height, :self.width]
+            elif self._bgr is None and self._jpeg is not None:
+                # decode the luma only, cheaper than decoding color and converting
+                self._gray = self._decode(cv2.IMREAD_GRAYSCALE)
+            else:
+                self._gray = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def jpeg(self):
+        """ the jpeg bytes from the camera, None if the camera did not capture jpeg """
+        return self._jpeg
+
+    def hasJpeg(self):
+        """ whether the frame has jpeg bytes from the camera """
+        return self._jpeg is not None
+
+    def _decode(self, flags):
+        """ decode the jpeg bytes, update width and height with the actual size of the image """
+        img = cv2.imdecode(np.frombuffer(self._jpeg, dtype=np.uint8), flags)
+        if img is None:
+            raise ValueError('Invalid jpeg frame')
+        self.height, self.width = img.shape[0], img.shape[1]
+        return img
+
+    def hasGray(self):
+        """ whether gray() is available without conversion """
+        return self._gray is not None or self._yuv is not None
+
+    def acquire(self):
+        """ add a reference to the frame """
+        with self._lock:
+            self._refCount += 1
+        return self
+
+    def release(self):
+        """ remove a reference, the buffer returns to the pool when the last reference is released """
+        with self._lock:
+            self._refCount -= 1
+            if self._refCount > 0 or self._pool is None or self._yuv is None:
+                return
+            buffer = self._yuv
+            self._yuv = None
+            self._gray = None
+        self._pool.release(buffer)
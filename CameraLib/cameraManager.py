@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from IotLib.log import Log
+from IotLib.pyUtils import splitAndTrim
+
+class CameraManager(object):
+    """ owns N named cameras, each with its own capture thread, frame bus and optional face tracker """
+    def __init__(self):
+        self.cameras = OrderedDict()    # key: camera name, value: camera derived from BaseCamera
+        self.faceTrackers = {}          # key: camera name, value: face tracker or None
+
+    def add(self, name, camera, faceTracker=None):
+        """ add a camera with the specified name and optional face tracker """
+        camera.name = name
+        self.cameras[name] = camera
+        self.faceTrackers[name] = faceTracker
+        return camera
+
+    def get(self, name=None):
+        """ get the camera by name, the first camera if name is None """
+        if name is None:
+            return next(iter(self.cameras.values()), None)
+        return self.cameras.get(name, None)
+
+    def names(self):
+        """ the names of all cameras """
+        return list(self.cameras.keys())
+
+    def faceTracker(self, name):
+        """ get the face tracker for the named camera """
+        return self.faceTrackers.get(name, None)
+
+    def setFaceTracker(self, name, faceTracker):
+        """ set the face tracker for the named camera """
+        self.faceTrackers[name] = faceTracker
+
+    def start(self, name=None):
+        """ start the named camera (or all cameras if name is None) with its face tracker """
+        names = self.names() if name is None else [name]
+        for cameraName in names:
+            self.cameras[cameraName].start(self.faceTrackers.get(cameraName, None))
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __iter__(self):
+        return iter(self.cameras.items())
+
+    @staticmethod
+    def createCameras(config, cameraClass):
+        """ create a CameraManager with cameras defined in config
+        camera.names lists the names of the cameras, e.g. camera.names=front,rear
+        the settings for each camera use the prefix camera.<name> (camera.front.width=640).
+        a single camera named 'default' uses the prefix camera to stay compatible with existing config files.
+        cameraClass - the Camera class to create cameras with (must implement createCamera(config, prefix))
+        """
+        manager = CameraManager()
+        names = splitAndTrim(config.getOrAdd('camera.names', 'default'), ',')
+        for name in names:
+            name = name.strip()
+            prefix = 'camera' if len(names) == 1 and name == 'default' else 'camera.' + name
+            camera = cameraClass.createCamera(config, prefix=prefix)
+            manager.add(name, camera)
+            Log.info('Created camera %s (%i x %i)' %(name, camera.width, camera.height))
+        return manager
@@ -1,42 +1,285 @@
 import os
+import time
+import threading
+from collections import deque
 import cv2
 from .baseCamera import BaseCamera
+from .cameraFrame import CameraFrame
+from .mjpegReader import MjpegReader
+from IotLib.log import Log
 
 
 class Camera(BaseCamera):
-    video_source = 0
-    width = 1280
-    height =720
+    # capture modes
+    CaptureRead = 'read'
+    CaptureLatest = 'latest'
 
-    def __init__(self, width=1280, height=720, crosshair=False):
-        if os.environ.get('OPENCV_CAMERA_SOURCE'):
-            Camera.set_video_source(int(os.environ['OPENCV_CAMERA_SOURCE']))
-        Camera.width = width
-        Camera.height = height
+    def __init__(self, width=1280, height=720, crosshair=False, source=0, captureFormat='bgr', fps=30, captureMode='read', bufferSize=0):
+        """ initialize an OpenCV camera with specified width and height
+        source - the video source (device index or file path) for cv2.VideoCapture
+        captureFormat - 'bgr' captures decoded bgr images, 'mjpeg' passes the compressed frames of a MJPG (UVC) camera
+                        or a .mjpeg/.mjpg file through to streaming clients and decodes only when pixels are needed
+        fps - the frame rate to play a mjpeg file at (and a video file without a frame rate)
+        captureMode - 'read' reads every frame the driver queued in order,
+                      'latest' drains the driver queue with grab() in a background thread and retrieve()s only the newest
+                      frame when the camera thread is ready for it, so the frames stay fresh when the consumers are slow
+        bufferSize - number of driver buffers (CAP_PROP_BUFFERSIZE), 0 for the driver default
+        a video file source is played as a sensor in real time with a driver queue of bufferSize (default 4) buffers
+        each frame carries its capture time (the sensor time of the frame for a video file)
+        """
         super(Camera, self).__init__(width, height, crosshair=crosshair)
+        self.video_source = source
+        self.captureFormat = captureFormat
+        self.fps = fps
+        self.captureMode = captureMode
+        self.bufferSize = bufferSize
+        self.grabbedFrames = 0      # frames taken from the driver
+        self.retrievedFrames = 0    # frames decoded and published
+        if os.environ.get('OPENCV_CAMERA_SOURCE'):
+            self.set_video_source(int(os.environ['OPENCV_CAMERA_SOURCE']))
 
-    @staticmethod
-    def set_video_source(source):
-        Camera.video_source = source
+    def set_video_source(self, source):
+        self.video_source = source
 
-    @staticmethod
-    def frames():
-        camera = cv2.VideoCapture(Camera.video_source)
+    def frames(self):
+        if self.captureFormat == 'mjpeg' and self._isMjpegFile():
+            return self._mjpegFileFrames()
+        return self._captureFrames()
+
+    def _captureFrames(self):
+        """ read frames with cv2.VideoCapture """
+        camera = cv2.VideoCapture(self.video_source)
         if not camera.isOpened():
             raise RuntimeError('Could not start camera.')
 
-        camera.set(cv2.CAP_PROP_FRAME_WIDTH, Camera.width)
-        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, Camera.height)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.bufferSize > 0:
+            camera.set(cv2.CAP_PROP_BUFFERSIZE, self.bufferSize)
+        if self._isFile():
+            fileFps = camera.get(cv2.CAP_PROP_FPS)
+            camera = _FileSensor(camera, fileFps if fileFps > 0 else self.fps, self.bufferSize if self.bufferSize > 0 else 4)
+        passthrough = False
+        if self.captureFormat == 'mjpeg':
+            # ask the camera for MJPG and get the compressed frames without decode
+            camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            passthrough = camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            if not passthrough:
+                Log.info('Camera %s does not support mjpeg passthrough, capturing bgr' %self.name)
+        grabber = None
+        try:
+            if self.captureMode == Camera.CaptureLatest:
+                grabber = _LatestGrabber(camera, self)
+                grabber.start()
+            while True:
+                if grabber is not None:
+                    if self.draining:
+                        # standby - let the grabber drain the driver queue without decoding the frames
+                        grabber.skip()
+                        yield None
+                        continue
+                    # the newest frame grabbed after the camera thread asked for it
+                    timestamp, img = grabber.next()
+                else:
+                    # read current frame, in standby take it from the driver without decoding it
+                    camera.grab()
+                    timestamp = _captureTime(camera)
+                    self.grabbedFrames += 1
+                    if self.draining:
+                        yield None
+                        continue
+                    _, img = camera.retrieve()
+                self.retrievedFrames += 1
+                if img is None:
+                    yield img
+                elif passthrough and (img.ndim == 1 or img.shape[0] == 1):
+                    # the raw buffer of a MJPG frame
+                    yield CameraFrame(jpeg=img.tobytes(), width=self.width, height=self.height, timestamp=timestamp)
+                else:
+                    yield CameraFrame(bgr=img, timestamp=timestamp)
+        finally:
+            if grabber is not None:
+                grabber.stop()
+            camera.release()
+
+    def _isFile(self):
+        """ whether the video source is a file """
+        return isinstance(self.video_source, str) and os.path.isfile(self.video_source)
+
+    def _isMjpegFile(self):
+        """ whether the video source is a raw mjpeg file """
+        source = self.video_source
+        return isinstance(source, str) and source.lower().endswith(('.mjpeg', '.mjpg')) and os.path.isfile(source)
+
+    def _mjpegFileFrames(self):
+        """ play the jpeg frames of a mjpeg file in a loop at fps """
+        interval = 1.0 / self.fps
+        nextTime = time.time()
         while True:
-            # read current frame
-            _, img = camera.read()
-            yield img
+            count = 0
+            for jpeg in MjpegReader(self.video_source):
+                count += 1
+                nextTime += interval
+                delay = nextTime - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    nextTime = time.time()
+                yield CameraFrame(jpeg=jpeg, width=self.width, height=self.height)
+            if count == 0:
+                raise RuntimeError('No jpeg frames in %s' %self.video_source)
 
     @staticmethod
-    def createCamera(config):
-        """ create a Camera using settings defined in config """
-        width = config.getOrAddInt('camera.width', 1280)
-        height = config.getOrAddInt('camera.height', 720)
-        crosshair = config.getOrAddBool('camera.drawCrosshair', 'true')
-        camera = Camera(width=width, height=height, crosshair=crosshair)
+    def createCamera(config, prefix='camera'):
+        """ create a Camera using settings defined in config
+        prefix - the prefix of the config keys such as camera or camera.front
+        """
+        width = config.getOrAddInt(prefix + '.width', 1280)
+        height = config.getOrAddInt(prefix + '.height', 720)
+        crosshair = config.getOrAddBool(prefix + '.drawCrosshair', 'true')
+        source = config.getOrAdd(prefix + '.source', '0')
+        if source.isdigit():
+            source = int(source)
+        captureFormat = config.getOrAdd(prefix + '.captureFormat', 'bgr')
+        fps = config.getOrAddInt(prefix + '.fps', 30)
+        captureMode = config.getOrAdd(prefix + '.captureMode', Camera.CaptureRead)
+        bufferSize = config.getOrAddInt(prefix + '.bufferSize', 0)
+        camera = Camera(width=width, height=height, crosshair=crosshair, source=source, captureFormat=captureFormat, fps=fps,
+                        captureMode=captureMode, bufferSize=bufferSize)
+        camera.configure(config, prefix)
         return camera
+
+class _LatestGrabber(object):
+    """ drains the driver queue of a capture with grab() in a background thread
+    a frame is retrieve()d (decoded) only when next() asks for it, so the capture is only used by the grabber thread
+    """
+    def __init__(self, capture, camera, maxFailures=100):
+        self.capture = capture
+        self.camera = camera
+        self.maxFailures = maxFailures  # grab failures in a row to give up
+        self._condition = threading.Condition()
+        self._wanted = False
+        self._result = None
+        self._error = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='Grabber-%s' %self.camera.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next(self, timeout=5):
+        """ get (capture time, image) of the next frame grabbed """
+        with self._condition:
+            self._wanted = True
+            self._result = None
+            while self._result is None:
+                if self._error is not None:
+                    raise RuntimeError(self._error)
+                if not self._condition.wait(timeout):
+                    raise RuntimeError('No frame from camera %s in %.1f seconds' %(self.camera.name, timeout))
+            return self._result
+
+    def skip(self, timeout=5):
+        """ wait for the next frame grabbed without retrieving it """
+        with self._condition:
+            grabbed = self.camera.grabbedFrames
+            while self.camera.grabbedFrames == grabbed:
+                if self._error is not None:
+                    raise RuntimeError(self._error)
+                if not self._condition.wait(timeout):
+                    raise RuntimeError('No frame from camera %s in %.1f seconds' %(self.camera.name, timeout))
+
+    def _run(self):
+        failures = 0
+        while self._running:
+            if not self.capture.grab():
+                failures += 1
+                if failures >= self.maxFailures:
+                    with self._condition:
+                        self._error = 'Camera %s stopped delivering frames' %self.camera.name
+                        self._condition.notify_all()
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            timestamp = _captureTime(self.capture)
+            with self._condition:
+                self.camera.grabbedFrames += 1
+                self._condition.notify_all()
+                if self._wanted:
+                    _, img = self.capture.retrieve()
+                    self._result = (timestamp, img)
+                    self._wanted = False
+                    self._condition.notify_all()
+
+class _FileSensor(object):
+    """ plays a video file as a camera sensor - the frames are captured in real time at fps into a driver queue of buffers
+    like V4L2: when all buffers are full the newly captured frames are lost and the queued frames get older
+    """
+    def __init__(self, capture, fps, buffers):
+        self.capture = capture
+        self.interval = 1.0 / fps
+        self.buffers = buffers
+        self.timestamp = None           # the capture time of the last grabbed frame
+        self._start = time.time()
+        self._ticks = 0                 # frames captured by the sensor
+        self._queue = deque()           # (capture time, image) of the queued frames
+        self._current = None
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def grab(self):
+        self._capture()
+        while len(self._queue) == 0:
+            time.sleep(max(0, self._start + self._ticks * self.interval - time.time()))
+            self._capture()
+        self.timestamp, self._current = self._queue.popleft()
+        return True
+
+    def retrieve(self):
+        return (self._current is not None, self._current)
+
+    def read(self):
+        self.grab()
+        return self.retrieve()
+
+    def release(self):
+        self.capture.release()
+
+    def _capture(self):
+        """ capture the frames due by now into the free buffers, skip the file past the lost frames """
+        due = int((time.time() - self._start) / self.interval) + 1
+        while self._ticks < due:
+            timestamp = self._start + self._ticks * self.interval
+            if len(self._queue) < self.buffers:
+                self._queue.append((timestamp, self._readFrame()))
+            elif not self.capture.grab():
+                self._rewind()
+            self._ticks += 1
+
+    def _readFrame(self):
+        ok, img = self.capture.read()
+        if not ok:
+            self._rewind()
+            ok, img = self.capture.read()
+        return img
+
+    def _rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+def _captureTime(capture):
+    """ the capture time of the last grabbed frame - the sensor time of a file, now for a camera """
+    timestamp = getattr(capture, 'timestamp', None)
+    return timestamp if timestamp is not None else time.time()
@@ -1,33 +1,131 @@
 import io
 import time
+import queue
+import numpy as np
 import picamera
 from picamera.array import PiRGBArray
 from .baseCamera import BaseCamera
+from .cameraFrame import CameraFrame, FramePool
 from IotLib.log import Log
 
-class Camera(BaseCamera):
-    width = 1280
-    height = 720
+class _FrameOutput(object):
+    """ base of the picamera outputs that queue each complete frame as a CameraFrame """
+    def __init__(self, camera, width, height, frameQueue):
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.frameQueue = frameQueue
+        self.droppedFrames = 0
+
+    def queueFrame(self, frame):
+        """ queue a complete frame, drop the oldest frame if the consumer is behind """
+        if self.frameQueue.full():
+            try:
+                self.frameQueue.get_nowait().release()
+                self.droppedFrames += 1
+            except queue.Empty:
+                pass
+        self.frameQueue.put_nowait(frame)
+
+    def flush(self):
+        pass
+
+class _YuvOutput(_FrameOutput):
+    """ picamera output that copies each yuv420 frame into a pooled buffer and queues it as a CameraFrame """
+    def __init__(self, camera, width, height, pool, frameQueue):
+        super(_YuvOutput, self).__init__(camera, width, height, frameQueue)
+        self.pool = pool
+        self._buffer = None
+        self._offset = 0
+
+    def write(self, data):
+        if self._buffer is None:
+            self._buffer = self.pool.acquire()
+            self._offset = 0
+        size = min(len(data), self.pool.size - self._offset)
+        self._buffer[self._offset:self._offset + size] = np.frombuffer(data, dtype=np.uint8, count=size)
+        self._offset += size
+        if self.camera.frame.complete:
+            frame = CameraFrame(yuv=self._buffer, width=self.width, height=self.height, pool=self.pool)
+            self._buffer = None
+            self.queueFrame(frame)
+        return len(data)
+
+class _MjpegOutput(_FrameOutput):
+    """ picamera output that queues each jpeg frame from the GPU encoder as a CameraFrame """
+    def __init__(self, camera, width, height, frameQueue):
+        super(_MjpegOutput, self).__init__(camera, width, height, frameQueue)
+        self._buffer = io.BytesIO()
+
+    def write(self, data):
+        self._buffer.write(data)
+        if self.camera.frame.complete:
+            self.queueFrame(CameraFrame(jpeg=self._buffer.getvalue(), width=self.width, height=self.height))
+            self._buffer = io.BytesIO()
+        return len(data)
 
-    def __init__(self, width=1280, height=720, crosshair=False):
-        """ initialize a PiCam with specified width and height """
-        Camera.width = width
-        Camera.height = height
+class Camera(BaseCamera):
+    def __init__(self, width=1280, height=720, crosshair=False, cameraNum=0, captureFormat='bgr', poolSize=4):
+        """ initialize a PiCam with specified width and height
+        cameraNum - the camera port number for boards with multiple camera ports (compute module)
+        captureFormat - 'bgr' captures bgr images, 'yuv' captures yuv420 into a pool of preallocated buffers with the
+                        Y plane as zero copy gray image for detection and bgr converted only when a consumer needs color,
+                        'mjpeg' captures jpeg frames from the GPU encoder that are streamed without decode and re-encode
+        poolSize - number of preallocated buffers for yuv capture
+        """
+        super(Camera, self).__init__(width, height, crosshair=crosshair)
+        self.cameraNum = cameraNum
+        self.captureFormat = captureFormat
+        self.poolSize = poolSize
         self.cameraReady = False
         try:
-            with picamera.PiCamera() as camera:
+            with picamera.PiCamera(camera_num=cameraNum) as camera:
                 self.cameraReady = True
-                super(Camera, self).__init__(width, height, crosshair=crosshair)
         except:
-            Log.error("Failed to initialize picamera")
+            Log.error("Failed to initialize picamera %i" %cameraNum)
 
-    @staticmethod
-    def frames():
-        with picamera.PiCamera() as camera:
+    def frames(self):
+        if self.captureFormat == 'yuv':
+            return self._recordedFrames('yuv')
+        if self.captureFormat == 'mjpeg':
+            return self._recordedFrames('mjpeg')
+        return self._bgrFrames()
+
+    def _recordedFrames(self, captureFormat):
+        """ record yuv420 frames into pooled buffers or jpeg frames from the GPU encoder """
+        with picamera.PiCamera(camera_num=self.cameraNum) as camera:
+            # let camera warm up
+            time.sleep(1)
+            camera.resolution = (self.width, self.height)
+            frameQueue = queue.Queue(maxsize=2)
+            pool = None
+            if captureFormat == 'yuv':
+                pool = FramePool(CameraFrame.yuvSize(self.width, self.height), count=self.poolSize)
+                output = _YuvOutput(camera, self.width, self.height, pool, frameQueue)
+            else:
+                output = _MjpegOutput(camera, self.width, self.height, frameQueue)
+            camera.start_recording(output, format=captureFormat)
+            try:
+                while True:
+                    try:
+                        frame = frameQueue.get(timeout=1)
+                    except queue.Empty:
+                        camera.wait_recording(0)    # raises the camera error if recording failed
+                        continue
+                    yield frame
+            finally:
+                camera.stop_recording()
+                Log.info('%s capture dropped %i frames' %(captureFormat, output.droppedFrames))
+                if pool is not None:
+                    Log.info('yuv capture allocated %i buffers' %pool.allocated)
+
+    def _bgrFrames(self):
+        """ capture bgr frames """
+        with picamera.PiCamera(camera_num=self.cameraNum) as camera:
             # let camera warm up
             time.sleep(1)
-            camera.resolution = (Camera.width, Camera.height)
-            rawCapture = PiRGBArray(camera, size=(Camera.width, Camera.height))
+            camera.resolution = (self.width, self.height)
+            rawCapture = PiRGBArray(camera, size=(self.width, self.height))
 
             for _ in camera.capture_continuous(rawCapture, 'bgr', use_video_port=True):
                 img = rawCapture.array
@@ -41,11 +139,16 @@ class Camera(BaseCamera):
         return self.cameraReady
 
     @staticmethod
-    def createCamera(config):
-        """ create a Camera using settings defined in config """
-        width = config.getOrAddInt('camera.width', 1280)
-        height = config.getOrAddInt('camera.height', 720)
-        crosshair = config.getOrAddBool('camera.drawCrosshair', 'true')
-        camera = Camera(width=width, height=height, crosshair=crosshair)
+    def createCamera(config, prefix='camera'):
+        """ create a Camera using settings defined in config
+        prefix - the prefix of the config keys such as camera or camera.front
+        """
+        width = config.getOrAddInt(prefix + '.width', 1280)
+        height = config.getOrAddInt(prefix + '.height', 720)
+        crosshair = config.getOrAddBool(prefix + '.drawCrosshair', 'true')
+        cameraNum = config.getOrAddInt(prefix + '.cameraNum', 0)
+        captureFormat = config.getOrAdd(prefix + '.captureFormat', 'bgr')
+        camera = Camera(width=width, height=height, crosshair=crosshair, cameraNum=cameraNum, captureFormat=captureFormat)
+        camera.configure(config, prefix)
         return camera
 
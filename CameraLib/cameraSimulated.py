@@ -0,0 +1,151 @@
+import os
+import time
+import numpy as np
+import cv2
+from .baseCamera import BaseCamera
+from .cameraFrame import CameraFrame
+from .mjpegReader import MjpegReader
+from IotLib.log import Log
+
+ImageExtensions = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class Camera(BaseCamera):
+    """ camera without hardware for headless benchmarking and testing
+    frames come from one of the sources:
+    - synthetic: procedurally generated frames with face-like patches moving across a textured background
+    - a video file read with cv2.VideoCapture (played in a loop)
+    - a .mjpeg/.mjpg file (played in a loop, the jpeg frames are passed through)
+    - a directory of images (played in a loop in file name order)
+    """
+    def __init__(self, width=640, height=480, crosshair=False, source='synthetic', fps=30, faces=2, seed=0):
+        """ initialize a simulated camera
+        source - 'synthetic', a video file, a mjpeg file or a directory of images
+        fps - frames per second, 0 to produce frames as fast as possible
+        faces - number of face-like patches in synthetic frames
+        seed - random seed of the synthetic background and face movement
+        """
+        super(Camera, self).__init__(width, height, crosshair=crosshair)
+        self.source = source
+        self.fps = fps
+        self.faces = faces
+        self.seed = seed
+        self.groundTruth = []   # boxes (x, y, w, h) of the face-like patches in the last synthetic frame
+
+    def frames(self):
+        if self.source == 'synthetic':
+            frames = self._syntheticFrames()
+        elif os.path.isdir(self.source):
+            frames = self._imageFrames()
+        elif self.source.lower().endswith(('.mjpeg', '.mjpg')):
+            frames = self._mjpegFrames()
+        else:
+            frames = self._videoFrames()
+        return self._throttle(frames)
+
+    def _throttle(self, frames):
+        """ yield the frames at fps (as fast as possible if fps is 0) """
+        interval = 1.0 / self.fps if self.fps > 0 else 0
+        nextTime = time.time()
+        for frame in frames:
+            if interval > 0:
+                nextTime += interval
+                delay = nextTime - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    nextTime = time.time()
+            yield frame
+
+    def _syntheticFrames(self):
+        """ textured background with face-like patches bouncing around """
+        rng = np.random.default_rng(self.seed)
+        background = cv2.GaussianBlur(rng.integers(0, 256, (self.height, self.width, 3), dtype=np.uint8), (0, 0), 8)
+        size = max(24, min(self.width, self.height) // 5)
+        positions = rng.uniform(0, 1, (self.faces, 2)) * (self.width - size, self.height - size)
+        velocities = rng.uniform(-4, 4, (self.faces, 2))
+        limits = np.array([self.width - size, self.height - size], dtype=np.float64)
+        while True:
+            img = background.copy()
+            for x, y in positions.astype(int):
+                _drawFace(img, x, y, size)
+            self.groundTruth = [(int(x), int(y), size, size) for x, y in positions]
+            yield img
+            positions += velocities
+            bounced = (positions < 0) | (positions > limits)
+            velocities[bounced] = -velocities[bounced]
+            positions = np.clip(positions, 0, limits)
+
+    def _videoFrames(self):
+        """ frames of a video file in a loop """
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise RuntimeError('Could not open video file %s' %self.source)
+        try:
+            count = 0
+            while True:
+                ok, img = capture.read()
+                if not ok:
+                    if count == 0:
+                        raise RuntimeError('No frames in %s' %self.source)
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    count = 0
+                    continue
+                count += 1
+                yield self._resize(img)
+        finally:
+            capture.release()
+
+    def _imageFrames(self):
+        """ images of a directory in a loop, the images are decoded once """
+        files = sorted(f for f in os.listdir(self.source) if f.lower().endswith(ImageExtensions))
+        images = [self._resize(cv2.imread(os.path.join(self.source, f))) for f in files]
+        images = [img for img in images if img is not None]
+        if len(images) == 0:
+            raise RuntimeError('No images in %s' %self.source)
+        Log.info('Loaded %i images from %s' %(len(images), self.source))
+        while True:
+            for img in images:
+                yield img
+
+    def _mjpegFrames(self):
+        """ jpeg frames of a mjpeg file in a loop """
+        while True:
+            count = 0
+            for jpeg in MjpegReader(self.source):
+                count += 1
+                yield CameraFrame(jpeg=jpeg, width=self.width, height=self.height)
+            if count == 0:
+                raise RuntimeError('No jpeg frames in %s' %self.source)
+
+    def _resize(self, img):
+        """ resize the image to the resolution of the camera """
+        if img is None or (img.shape[1] == self.width and img.shape[0] == self.height):
+            return img
+        return cv2.resize(img, (self.width, self.height), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def createCamera(config, prefix='camera'):
+        """ create a Camera using settings defined in config
+        prefix - the prefix of the config keys such as camera or camera.front
+        """
+        width = config.getOrAddInt(prefix + '.width', 640)
+        height = config.getOrAddInt(prefix + '.height', 480)
+        crosshair = config.getOrAddBool(prefix + '.drawCrosshair', 'true')
+        source = config.getOrAdd(prefix + '.source', 'synthetic')
+        fps = config.getOrAddInt(prefix + '.fps', 30)
+        faces = config.getOrAddInt(prefix + '.faces', 2)
+        camera = Camera(width=width, height=height, crosshair=crosshair, source=source, fps=fps, faces=faces)
+        camera.configure(config, prefix)
+        return camera
+
+def _drawFace(img, x, y, size):
+    """ draw a face-like patch (skin colored oval with eyes, brows and mouth) with its top left corner at (x, y) """
+    cx = x + size // 2
+    cy = y + size // 2
+    cv2.ellipse(img, (cx, cy), (size * 2 // 5, size // 2), 0, 0, 360, (140, 170, 215), -1)
+    eyeY = cy - size // 8
+    eyeDx = size // 6
+    for ex in (cx - eyeDx, cx + eyeDx):
+        cv2.ellipse(img, (ex, eyeY), (size // 14 + 1, size // 24 + 1), 0, 0, 360, (40, 40, 40), -1)
+        cv2.line(img, (ex - size // 10, eyeY - size // 10), (ex + size // 10, eyeY - size // 10), (50, 60, 80), 2)
+    cv2.ellipse(img, (cx, cy + size // 5), (size // 6, size // 16 + 1), 0, 0, 180, (60, 60, 150), -1)
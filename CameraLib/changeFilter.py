@@ -0,0 +1,107 @@
+import time
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from .cameraFrame import CameraFrame
+from .motionDetector import downscaleGray
+from .stageStats import StageStats
+
+class FrameSignatures(object):
+    """ cheap signatures of the frames of a stream shared by all its clients - gray, blurred frames downscaled to width
+    pixels, computed once per frame. also keeps the totals of the ChangeFilters of the clients for the stats.
+    """
+    def __init__(self, width=64, maxFrames=8):
+        """ construct a FrameSignatures
+        width - width of the signatures (the height keeps the aspect ratio)
+        maxFrames - number of recent frames to keep the signatures of
+        """
+        self.width = width
+        self.maxFrames = maxFrames
+        self.computed = 0           # number of signatures computed
+        self.changedFrames = 0      # frames sent because they changed
+        self.unchangedFrames = 0    # frames skipped because they did not change
+        self.keepAliveFrames = 0    # unchanged frames sent to keep the clients alive
+        self.costStats = StageStats('signature')   # time spent computing signatures
+        self._signatures = OrderedDict()    # key: seq, value: signature
+        self._lock = threading.Lock()
+
+    def signature(self, seq, img):
+        """ get the signature of frame seq, img is the image or the CameraFrame of a passthrough jpeg """
+        with self._lock:
+            signature = self._signatures.get(seq, None)
+        if signature is not None:
+            return signature
+        startTime = time.time()
+        if isinstance(img, CameraFrame):
+            if img.hasJpeg():
+                # decode the luma at 1/8 scale, a fraction of the cost of a full decode
+                img = cv2.imdecode(np.frombuffer(img.jpeg(), dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            else:
+                img = img.gray()
+        signature = downscaleGray(img, self.width)
+        self.costStats.record(time.time() - startTime)
+        with self._lock:
+            self.computed += 1
+            self._signatures[seq] = signature
+            while len(self._signatures) > self.maxFrames:
+                self._signatures.popitem(last=False)
+        return signature
+
+    def record(self, change):
+        """ count the decision of a client's ChangeFilter """
+        with self._lock:
+            if change == ChangeFilter.Changed:
+                self.changedFrames += 1
+            elif change == ChangeFilter.Unchanged:
+                self.unchangedFrames += 1
+            else:
+                self.keepAliveFrames += 1
+
+    def values(self):
+        """ get the counters as a dictionary """
+        frames = self.changedFrames + self.unchangedFrames + self.keepAliveFrames
+        return {'signatures': self.computed, 'changedFrames': self.changedFrames, 'unchangedFrames': self.unchangedFrames,
+                'keepAliveFrames': self.keepAliveFrames,
+                'unchangedRatio': round(self.unchangedFrames / float(frames), 3) if frames > 0 else 0.0,
+                'cost': self.costStats.values()}
+
+class ChangeFilter(object):
+    """ decides for one client whether a frame changed enough since the last frame sent to it to be worth sending
+    the signature of the frame is compared with the signature of the last frame sent (not the previous frame) so slow
+    changes accumulate till they are sent. an unchanged frame is still sent every keepAliveSeconds so the client
+    keeps a recent image and its connection does not time out.
+    """
+    Changed = 'changed'
+    Unchanged = 'unchanged'
+    KeepAlive = 'keepAlive'
+
+    def __init__(self, signatures, threshold=0.001, pixelThreshold=8, keepAliveSeconds=1.0):
+        """ construct a ChangeFilter
+        signatures - the FrameSignatures of the stream
+        threshold - min ratio of the changed pixels of the signature for the frame to count as changed
+        pixelThreshold - min change of a signature pixel (0 - 255) to count as changed
+        keepAliveSeconds - max seconds between frames sent to the client
+        """
+        self.signatures = signatures
+        self.threshold = threshold
+        self.pixelThreshold = pixelThreshold
+        self.keepAliveSeconds = keepAliveSeconds
+        self._reference = None      # signature of the last frame sent
+        self._sentTime = 0
+
+    def check(self, seq, img, now=None):
+        """ check frame seq against the last frame sent, returns Changed, Unchanged (skip the frame) or KeepAlive """
+        now = time.time() if now is None else now
+        signature = self.signatures.signature(seq, img)
+        change = ChangeFilter.Changed
+        if self._reference is not None and self._reference.shape == signature.shape:
+            diff = cv2.absdiff(signature, self._reference)
+            changed = cv2.countNonZero(cv2.threshold(diff, self.pixelThreshold, 255, cv2.THRESH_BINARY)[1])
+            if changed / float(signature.size) <= self.threshold:
+                change = ChangeFilter.KeepAlive if now - self._sentTime >= self.keepAliveSeconds else ChangeFilter.Unchanged
+        if change != ChangeFilter.Unchanged:
+            self._reference = signature
+            self._sentTime = now
+        self.signatures.record(change)
+        return change
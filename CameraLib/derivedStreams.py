@@ -0,0 +1,254 @@
+import time
+import threading
+from collections import OrderedDict
+import cv2
+from .cameraFrame import CameraFrame
+
+class StreamNode(object):
+    """ a node of the derived stream graph of a camera
+    a node is computed only while it has subscribers. the first subscriber subscribes the node to its source (so the
+    whole chain up to the camera comes alive) and starts it, the last subscriber leaving stops it and releases its source.
+    """
+    def __init__(self, name, camera, source=None):
+        self.name = name
+        self.camera = camera
+        self.source = source
+        self.subscribers = 0        # number of subscribers including the subscribed derived nodes
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """ add a subscriber, start the node with the first one """
+        with self._lock:
+            self.subscribers += 1
+            first = self.subscribers == 1
+        if first:
+            if self.source is not None:
+                self.source.subscribe()
+            self._start()
+
+    def unsubscribe(self):
+        """ remove a subscriber, stop the node when the last one leaves """
+        with self._lock:
+            if self.subscribers == 0:
+                return
+            self.subscribers -= 1
+            last = self.subscribers == 0
+        if last:
+            self._stop()
+            if self.source is not None:
+                self.source.unsubscribe()
+
+    def wait_frame(self, after_seq=0, timeout=None):
+        """ wait for a frame newer than after_seq and return (seq, frame, skipped) like BaseCamera.wait_frame """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+    def values(self):
+        """ get the node counters as a dictionary """
+        return {'subscribers': self.subscribers, 'source': self.source.name if self.source is not None else None}
+
+    def _start(self):
+        pass
+
+    def _stop(self):
+        pass
+
+class RawStream(StreamNode):
+    """ the captured frames with the overlay """
+    def wait_frame(self, after_seq=0, timeout=None):
+        return self.camera.wait_frame(after_seq, False, timeout)
+
+class TrackedStream(StreamNode):
+    """ the face tracking frames with the overlay, face tracking runs only while the node has subscribers """
+    def wait_frame(self, after_seq=0, timeout=None):
+        return self.camera.wait_frame(after_seq, True, timeout)
+
+    def _start(self):
+        self.camera._startTracking()
+
+class DerivedStream(StreamNode):
+    """ a stream computed from the pristine frames of its source once per frame, only when a subscriber asks for it
+    the output of the latest frame is cached and shared by all subscribers, concurrent requests wait for the first compute.
+    """
+    def __init__(self, name, camera, source):
+        super(DerivedStream, self).__init__(name, camera, source)
+        self.computed = 0           # number of frames computed
+        self._cache = None          # [seq, threading.Event, output] of the latest frame
+
+    def wait_frame(self, after_seq=0, timeout=None):
+        camera = self.camera
+        camera.last_access = time.time()
+        tracking = self.source.name == 'tracked' and camera._tracking()
+        bus = camera.trackingBus if tracking else camera.bus
+        seq, value, skipped = bus.get_frame(after_seq, timeout, acquire=not tracking)
+        if value is None:
+            return (seq, None, 0)
+        try:
+            return (seq, self._output(seq, value), skipped)
+        finally:
+            if not tracking:
+                value.release()
+
+    def compute(self, value):
+        """ compute the output from the CameraFrame of the raw bus or the value of the tracking bus """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+    def values(self):
+        values = super(DerivedStream, self).values()
+        values['computed'] = self.computed
+        return values
+
+    def _output(self, seq, value):
+        """ the output of frame seq, computed only once per frame """
+        owner = False
+        with self._lock:
+            entry = self._cache
+            if entry is None or entry[0] != seq:
+                entry = [seq, threading.Event(), None]
+                if self._cache is None or self._cache[0] < seq:
+                    self._cache = entry
+                owner = True
+        if owner:
+            try:
+                entry[2] = self.compute(value)
+                self.computed += 1
+            finally:
+                entry[1].set()
+        else:
+            entry[1].wait()
+        return entry[2]
+
+    def _stop(self):
+        with self._lock:
+            self._cache = None
+
+class GrayStream(DerivedStream):
+    """ grayscale frames - the Y plane of yuv captures without conversion """
+    def compute(self, frame):
+        gray = frame.gray()
+        # a view of a pooled yuv buffer must not outlive the frame
+        return gray.copy() if gray.base is not None else gray
+
+class ThumbnailStream(DerivedStream):
+    """ frames downscaled to width pixels """
+    def __init__(self, name, camera, source, width=160):
+        super(ThumbnailStream, self).__init__(name, camera, source)
+        self.width = width
+
+    def compute(self, frame):
+        img = frame.bgr()
+        height = max(1, int(img.shape[0] * self.width / img.shape[1]))
+        return cv2.resize(img, (self.width, height), interpolation=cv2.INTER_AREA)
+
+class FaceCropStream(DerivedStream):
+    """ digital zoom on the primary (largest) tracked face, the whole frame when no face is tracked
+    the crop keeps the aspect ratio of the output and follows the face smoothly. without a face tracker the frames are
+    the raw frames zoomed out.
+    """
+    def __init__(self, name, camera, source, width=320, padding=1.0, smoothing=0.3):
+        """ width - width of the output frames (the height keeps the aspect ratio of the camera)
+        padding - padding around the face relative to the face size
+        smoothing - weight of the new face position in the moving crop (1.0 jumps to the face)
+        """
+        super(FaceCropStream, self).__init__(name, camera, source)
+        self.width = width
+        self.padding = padding
+        self.smoothing = smoothing
+        self._box = None            # current crop box (x, y, w, h)
+
+    def compute(self, value):
+        if isinstance(value, CameraFrame):
+            img, faces = value.bgr(), {}
+        else:
+            img, faces = value[0], value[2] or {}
+        imgHeight, imgWidth = img.shape[0], img.shape[1]
+        outHeight = max(1, int(self.width * imgHeight / imgWidth))
+        target = (0.0, 0.0, float(imgWidth), float(imgHeight))
+        positions = [face.getPosition() for face in list(faces.values())]
+        if len(positions) > 0:
+            x, y, w, h = max(positions, key=lambda p: p[2] * p[3])
+            cx = x + w / 2.0
+            cy = y + h / 2.0
+            # pad the face and widen the box to the output aspect ratio
+            w = w * (1 + 2 * self.padding)
+            h = h * (1 + 2 * self.padding)
+            if w * outHeight > h * self.width:
+                h = w * outHeight / self.width
+            else:
+                w = h * self.width / outHeight
+            w = min(w, imgWidth)
+            h = min(h, imgHeight)
+            target = (cx - w / 2, cy - h / 2, w, h)
+        if self._box is None:
+            self._box = target
+        else:
+            self._box = tuple(old + (new - old) * self.smoothing for old, new in zip(self._box, target))
+        x, y, w, h = self._box
+        x = int(min(max(0, x), imgWidth - w))
+        y = int(min(max(0, y), imgHeight - h))
+        crop = img[y:y + int(h), x:x + int(w)]
+        return cv2.resize(crop, (self.width, outHeight), interpolation=cv2.INTER_LINEAR)
+
+    def _stop(self):
+        super(FaceCropStream, self)._stop()
+        self._box = None
+
+class Subscription(object):
+    """ a subscription to a stream node, closed once (also as a context manager) """
+    def __init__(self, node):
+        self.node = node
+        self._closed = False
+        node.subscribe()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.node.unsubscribe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+class DerivedStreams(object):
+    """ the derived stream graph of a camera - raw and tracked frames plus the streams computed from them:
+    - raw: the captured frames
+    - tracked: the face tracking frames (face tracking runs only while subscribed)
+    - gray: grayscale raw frames
+    - thumbnail: downscaled raw frames
+    - faceCrop: digital zoom on the primary tracked face (subscribes to tracked)
+    consumers subscribe to the stream they read, e.g.
+        with camera.streams.subscribe('gray'):
+            seq, img, skipped = camera.streams.get('gray').wait_frame(seq)
+    so the cpu follows what is actually watched rather than what is configured.
+    """
+    def __init__(self, camera):
+        self.nodes = OrderedDict()
+        raw = self.add(RawStream('raw', camera))
+        tracked = self.add(TrackedStream('tracked', camera, raw))
+        self.add(GrayStream('gray', camera, raw))
+        self.add(ThumbnailStream('thumbnail', camera, raw))
+        self.add(FaceCropStream('faceCrop', camera, tracked))
+
+    def add(self, node):
+        """ add a node to the graph (its source must be in the graph), returns the node """
+        self.nodes[node.name] = node
+        return node
+
+    def get(self, name):
+        """ get the node by name, None if there is no such stream """
+        return self.nodes.get(name, None)
+
+    def subscribe(self, name):
+        """ subscribe to the named stream, returns the Subscription to close when done """
+        node = self.nodes.get(name, None)
+        if node is None:
+            raise ValueError('Unknown stream: %s' %str(name))
+        return Subscription(node)
+
+    def names(self):
+        return list(self.nodes.keys())
+
+    def values(self):
+        """ get the counters of all nodes as a dictionary """
+        return dict((name, node.values()) for name, node in list(self.nodes.items()))
@@ -0,0 +1,109 @@
+from CameraLib import metrics
+
+class DetectionScheduler(object):
+    """ adaptive face detection cadence of a FaceTracker in place of the fixed framesForDetection
+    the interval between detections follows the state of the tracks:
+    - search: no face is tracked, detect every searchInterval frames to find faces quickly
+    - weak: a track is tentative, lost (waiting for re-association) or its quality is within qualityMargin of
+      trackQualityLowBar, detect every weakInterval frames to confirm or correct it before it is dropped
+    - healthy: all tracks are confirmed and good, start at healthyInterval frames and back off by backoff after each
+      detection up to maxInterval frames (new faces are still found within maxInterval frames)
+    with budgetMs > 0 detectOrTrack is kept within budgetMs per frame on average: every frame earns the budget left by
+    its cost and a detection due runs only when the credit covers its estimated cost, otherwise it is deferred. a detection
+    is never deferred beyond maxInterval frames.
+    """
+    Search = 'search'
+    Weak = 'weak'
+    Healthy = 'healthy'
+    Decisions = ('detect', 'defer', 'force', 'wait')
+
+    def __init__(self, searchInterval=3, weakInterval=2, healthyInterval=10, maxInterval=30, backoff=1.5, qualityMargin=2.0,
+                 budgetMs=0, name='faceTracker'):
+        """ construct a DetectionScheduler
+        searchInterval - frames between detections while no face is tracked
+        weakInterval - frames between detections while a track is weak
+        healthyInterval - frames between detections when the tracks become healthy
+        maxInterval - max frames between detections (backoff limit and deferral limit)
+        backoff - factor growing the healthy interval after each detection
+        qualityMargin - a track with quality below trackQualityLowBar + qualityMargin is weak
+        budgetMs - milliseconds per frame for detection and tracking on average, 0 for no budget
+        name - name of the tracker for the metrics (e.g. the camera name)
+        """
+        self.searchInterval = searchInterval
+        self.weakInterval = weakInterval
+        self.healthyInterval = healthyInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.qualityMargin = qualityMargin
+        self.budgetMs = budgetMs
+        self.state = DetectionScheduler.Search
+        self.interval = searchInterval      # current frames between detections
+        self.framesSinceDetection = 0       # frames since the last detection
+        self.creditMs = 0.0                 # budget earned by the frames and not spent yet (negative after an overrun)
+        self.detectMs = 0.0                 # estimated cost of a detection (moving average)
+        self.decisions = dict((decision, 0) for decision in DetectionScheduler.Decisions)
+        self.states = {DetectionScheduler.Search: 0, DetectionScheduler.Weak: 0, DetectionScheduler.Healthy: 0}
+        self._healthyInterval = float(healthyInterval)
+        self._decisionMetrics = dict((decision, metrics.detectionDecisions.labels(name, decision))
+                                     for decision in DetectionScheduler.Decisions)
+        self._intervalMetric = metrics.detectionInterval.labels(name)
+
+    def shouldDetect(self, tracker):
+        """ decide whether to run the detection on the current frame of the FaceTracker (after its trackers are updated) """
+        self.framesSinceDetection += 1
+        self._updateState(tracker)
+        self.states[self.state] += 1
+        self._intervalMetric.set(self.interval)
+        if self.framesSinceDetection < self.interval:
+            return self._decide('wait')
+        if self.budgetMs > 0 and self.creditMs < self.detectMs:
+            if self.framesSinceDetection < self.maxInterval:
+                return self._decide('defer')
+            return self._decide('force')
+        return self._decide('detect')
+
+    def frameDone(self, seconds, detectSeconds=None):
+        """ record the cost of a frame (including the detection when it ran) and earn the budget left by the frame """
+        if detectSeconds is not None:
+            detectMs = detectSeconds * 1000.0
+            self.detectMs = detectMs if self.detectMs == 0 else self.detectMs * 0.8 + detectMs * 0.2
+        if self.budgetMs > 0:
+            # keep at most one detection of credit (no bursts) and at most one detection of debt
+            self.creditMs = min(max(self.creditMs + self.budgetMs - seconds * 1000.0, -self.detectMs), self.detectMs)
+
+    def values(self):
+        """ get the state and the counters of the decisions as a dictionary """
+        return {'state': self.state, 'interval': self.interval, 'budgetMs': self.budgetMs,
+                'creditMs': round(self.creditMs, 2), 'detectMs': round(self.detectMs, 2),
+                'decisions': dict(self.decisions), 'states': dict(self.states)}
+
+    def _updateState(self, tracker):
+        """ update the state and interval from the tracks of the FaceTracker """
+        faces = list(tracker.trackedFaces.values())
+        if len(faces) == 0:
+            state = DetectionScheduler.Search
+        elif len(tracker.lostFaces) > 0 or any(face.state != face.TrackConfirmed or
+                                               face.quality < tracker.trackQualityLowBar + self.qualityMargin for face in faces):
+            state = DetectionScheduler.Weak
+        else:
+            state = DetectionScheduler.Healthy
+        if state != DetectionScheduler.Healthy or self.state != DetectionScheduler.Healthy:
+            self._healthyInterval = float(self.healthyInterval)
+        self.state = state
+        if state == DetectionScheduler.Search:
+            self.interval = self.searchInterval
+        elif state == DetectionScheduler.Weak:
+            self.interval = self.weakInterval
+        else:
+            self.interval = min(int(self._healthyInterval), self.maxInterval)
+
+    def _decide(self, decision):
+        """ count the decision, returns whether to detect """
+        self.decisions[decision] += 1
+        self._decisionMetrics[decision].inc()
+        if decision in ('detect', 'force'):
+            self.framesSinceDetection = 0
+            if self.state == DetectionScheduler.Healthy:
+                self._healthyInterval = min(self._healthyInterval * self.backoff, self.maxInterval)
+            return True
+        return False
@@ -0,0 +1,121 @@
+import queue
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import cv2
+from IotLib.log import Log
+
+def _detectWorker(classifierPath, scaleFactor, minNeighbors, tasks, results):
+    """ worker process - runs cascade face detection on gray frames stored in shared memory """
+    classifier = cv2.CascadeClassifier(classifierPath)
+    attached = {}       # key: slot, value: SharedMemory of the slot
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, shmName, shape, tag = task
+        try:
+            shm = attached.get(slot, None)
+            if shm is None or shm.name != shmName:
+                # the slot was reallocated (new frame size), drop the mapping of the old shared memory
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=shmName)
+                attached[slot] = shm
+            grayImg = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            faces = classifier.detectMultiScale(grayImg, scaleFactor, minNeighbors)
+            faces = [tuple(int(v) for v in face) for face in faces]
+            results.put((slot, tag, faces))
+        except Exception as e:
+            results.put((slot, tag, None))
+    for shm in attached.values():
+        shm.close()
+
+class FaceDetectorPool(object):
+    """ runs cascade face detection in worker processes
+    the gray frames are copied into multiprocessing.shared_memory slots so only a small task tuple is pickled per frame.
+    submit() never blocks - it returns False when all slots are busy. results() returns the finished detections.
+    workers are forked where available (so scripts without a __main__ guard are not re-run by spawn),
+    create the pool before starting camera threads.
+    """
+    def __init__(self, classifierPath, workers=2, scaleFactor=1.1, minNeighbors=5):
+        """ construct a FaceDetectorPool
+        classifierPath - file path of the cascade classifier (each worker loads its own classifier)
+        workers - number of worker processes
+        scaleFactor, minNeighbors - parameters for detectMultiScale
+        """
+        self.workers = workers
+        startMethod = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(startMethod)
+        # share one resource tracker with the workers so the shared memory attached by workers is not reported as leaked
+        resource_tracker.ensure_running()
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._processes = []
+        for i in range(workers):
+            process = self._context.Process(target=_detectWorker, name='FaceDetector-%i' %i,
+                                            args=(classifierPath, scaleFactor, minNeighbors, self._tasks, self._results))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+        self._slots = []        # one shared memory per worker so every worker can be busy
+        self._freeSlots = []
+        self._shape = None
+        Log.info('Started %i face detection workers' %workers)
+
+    def submit(self, grayImg, tag=None):
+        """ submit a gray image for detection, returns False if all workers are busy
+        tag - caller's data returned with the result (e.g. the frame number)
+        """
+        if grayImg.shape != self._shape:
+            if len(self._freeSlots) < len(self._slots):
+                return False    # wait for pending detections before resizing the slots
+            self._allocate(grayImg.shape)
+        if len(self._freeSlots) == 0:
+            return False
+        slot = self._freeSlots.pop()
+        shm = self._slots[slot]
+        np.copyto(np.ndarray(self._shape, dtype=np.uint8, buffer=shm.buf), grayImg)
+        self._tasks.put((slot, shm.name, self._shape, tag))
+        return True
+
+    def results(self):
+        """ get the finished detections as a list of (tag, faces) without blocking. faces is None if detection failed. """
+        finished = []
+        while True:
+            try:
+                slot, tag, faces = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._freeSlots.append(slot)
+            finished.append((tag, faces))
+        return finished
+
+    def pending(self):
+        """ number of detections in flight """
+        return len(self._slots) - len(self._freeSlots)
+
+    def close(self):
+        """ stop the workers and release the shared memory """
+        for process in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=1)
+        self._processes = []
+        self._release()
+
+    def _allocate(self, shape):
+        """ (re)allocate one shared memory slot per worker for gray images of the shape """
+        self._release()
+        size = int(np.prod(shape))
+        self._slots = [shared_memory.SharedMemory(create=True, size=size) for i in range(self.workers)]
+        self._freeSlots = list(range(self.workers))
+        self._shape = tuple(shape)
+
+    def _release(self):
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+        self._freeSlots = []
+        self._shape = None
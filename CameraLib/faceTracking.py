@@ -1,18 +1,27 @@
+import os
 import cv2
-import dlib
 import time
+from concurrent.futures import ThreadPoolExecutor
 from IotLib.log import Log
+from CameraLib.stageStats import StageStats
+from CameraLib import metrics
+from CameraLib.trackAssociation import boxArray, iouMatrix, associate
+from CameraLib.trackerBackends import createTracker
 
 class FaceTracker():
     """ detect & track faces in sequence of images in bgr format (cv2 format)
     - face detection uses cv2's cascade classifier (cv2.CascadeClassifier) and must be initialized with FaceTracker constructor
-    - tracking uses dlib's correlation_tracker
+    - tracking uses a tracker backend per face (trackerBackends), dlib's correlation_tracker by default
 
     FaceTracker also defines the base interface for face tracking. The following functions are mandatory:
     - detectOrTrack
     - trackingData
+    a camera uses track() and trackedBoxes() when available so the boxes are drawn by its overlay and the frame stays pristine.
     """
-    def __init__(self, faceClassifier, framesForDetection = 10, scaleFactor = 1.1, minNeighbors = 5, trackQualityBar = 8, trackQualityLowBar = 5, trackOffset=10, debug = False):
+    def __init__(self, faceClassifier, framesForDetection = 10, scaleFactor = 1.1, minNeighbors = 5, trackQualityBar = 8, trackQualityLowBar = 5, trackOffset=10, debug = False, detectorPool = None,
+                 detectionScale = 1.0, trackingScale = 1.0, roiDetection = False, roiPadding = 0.5, fullDetectionInterval = 3,
+                 iouThreshold = 0.3, confirmHits = 2, maxMisses = 3, lostFrames = 30, name = 'faceTracker', motionDetector = None,
+                 trackerBackend = 'dlib', trackingWorkers = 1, detectionScheduler = None, staleDetectionFrames = 5):
         """ create an instance of FaceTracker to detect/track faces 
         calling parameters:
         faceClassifier              # classifier for face detection
@@ -23,6 +32,27 @@ class FaceTracker():
         trackQualityLowBar = 5      # the quality to remove for tracking
         trackOffset = 10            # the offset to add to the tracking rectangle
         debug = False               # enable debug information
+        detectorPool = None         # FaceDetectorPool to run detection asynchronously in worker processes
+                                    # detection is submitted whenever a worker is free and merged when the result arrives
+        detectionScale = 1.0        # scale of the image for face detection (0.5 detects on a half size image)
+        trackingScale = 1.0         # scale of the image for tracking
+        roiDetection = False        # detect only in padded regions around the tracked faces between full detections
+        roiPadding = 0.5            # padding of the detection regions relative to the face size
+        fullDetectionInterval = 3   # with roiDetection run a full image detection every N detections
+        iouThreshold = 0.3          # min IoU to associate a detected face with a tracked face
+        confirmHits = 2             # number of detections to confirm a tentative track
+        maxMisses = 3               # number of detections in a row missing a confirmed track to mark it lost
+        lostFrames = 30             # number of frames to keep a lost track for re-association before removing it
+        name = 'faceTracker'        # name of the tracker for the metrics (e.g. the camera name)
+        motionDetector = None       # MotionDetector to skip detection and tracking on static frames (the tracked faces are kept)
+        trackerBackend = 'dlib'     # tracker backend of the faces - dlib, mosse, kcf, csrt, mil (opencv) or centroid (detection only)
+        trackingWorkers = 1         # number of threads updating the face trackers concurrently, 0 for the number of cores
+                                    # (dlib and opencv release the GIL in the update)
+        detectionScheduler = None   # DetectionScheduler adapting the detection cadence to the tracks and a per-frame time budget
+                                    # in place of framesForDetection (not used with detectorPool)
+        staleDetectionFrames = 5    # detectorPool results of frames older than this only add or confirm tracks, they do not
+                                    # move (correct or revive) tracks to the old face positions (except the backends
+                                    # following the detections, they move the detections forward by their age)
         """
         self.faceClassifier = faceClassifier
         self.framesForDetection = framesForDetection
@@ -37,142 +67,453 @@ class FaceTracker():
         self.frameCounter = 0              # current frame number
         self.nextFaceID = 0                # sequence ID for face deteced
         self.trackedFaces = {}             # dictionary for the tracked faces' data key=face ID, value=FaceTrackingData 
+        self.lostFaces = {}                # dictionary for the lost faces kept for re-association key=face ID, value=FaceTrackingData
         self.imageShape = ()               # the image shape for tracked faces
+        self.detectorPool = detectorPool
+        self.detectionScale = detectionScale
+        self.trackingScale = trackingScale
+        self.roiDetection = roiDetection
+        self.roiPadding = roiPadding
+        self.fullDetectionInterval = fullDetectionInterval
+        self.detectionCounter = 0          # number of detections run
+        self.detectedFaces = 0             # number of faces found by the last detection
+        self.costStats = StageStats('faceTracker')     # time spent in detectOrTrack per frame
+        self.detectStats = StageStats('detect')         # time spent in face detection
+        self.trackStats = StageStats('track')           # time spent in updating the trackers
+        self.associationStats = StageStats('associate') # time spent in associating detected faces with tracked faces
+        self.iouThreshold = iouThreshold
+        self.confirmHits = confirmHits
+        self.maxMisses = maxMisses
+        self.lostFrames = lostFrames
+        self.name = name
+        self._detectSeconds = metrics.detectSeconds.labels(name)
+        self._trackSeconds = metrics.trackSeconds.labels(name)
+        self._trackedFaces = metrics.trackedFaces.labels(name)
+        self._detectedFaces = metrics.detectedFaces.labels(name)
+        self.motionDetector = motionDetector
+        self.trackerBackend = trackerBackend
+        createTracker(trackerBackend)       # fail early if the backend is not available
+        self.trackingWorkers = trackingWorkers if trackingWorkers > 0 else (os.cpu_count() or 1)
+        self._trackingPool = None          # ThreadPoolExecutor created with the first multi-face update
+        self.skippedFrames = 0             # number of static frames skipped by the motion detector
+        self._processedFrames = 0          # number of frames with detection and tracking
+        self._processedSeconds = 0.0       # time spent in the frames with detection and tracking
+        self._skippedMetric = metrics.skippedFrames.labels(name)
+        self.detectionScheduler = detectionScheduler
+        self.staleDetectionFrames = staleDetectionFrames
+        self.staleDetections = 0           # number of detectorPool results merged as stale
 
-    def detectOrTrack(self, img):
+    def detectOrTrack(self, img, grayImg=None):
         """ this is the main function for FaceTracker to track the faces inside images
+        grayImg - optional gray version of img (e.g. Y plane of a yuv capture) to skip the gray conversion for detection
         detectOrTrack returns the image with boxes around all faces tracked
         """
+        self.track(img, grayImg)
+        return self.drawTrackedFaces(img)
 
-        # 1. update all trackers and remove the ones with lower quality (defined by trackQualityBar)
-        # 2. runs face detection for every framesForDetection frames
-        #    - for each face try to match an existing tracked faces:
-        #      . the face's centerpoint is inside existing tracked box
-        #      . the centerpoint of the tracked box is also inside the face's box
-        #    - if no match add a new tracker with a new face-id
-        fidsToDelete = []
-        for fid in self.trackedFaces.keys():
-            trackingQuality = self.trackedFaces[fid].update(img)
-            if trackingQuality < self.trackQualityLowBar:
-                Log.info("Removing face ID " + str(fid) + ' quality: ' + str(trackingQuality))
-                fidsToDelete.append(fid)
+    def track(self, img, grayImg=None):
+        """ detect and track the faces inside img without drawing on it
+        grayImg - optional gray version of img (e.g. Y plane of a yuv capture) to skip the gray conversion for detection
+        """
 
+        # 1. update all trackers and mark the ones with lower quality (defined by trackQualityLowBar) as lost
+        # 2. runs face detection for every framesForDetection frames (or as decided by the detectionScheduler,
+        #    or whenever a worker of detectorPool is free)
+        #    - associate the detected faces with tracked and lost faces in one pass (IoU or centerpoints inside each other)
+        #    - matched tracks are confirmed after confirmHits detections, lost faces are revived with their old face-id
+        #    - confirmed tracks missed by maxMisses detections are lost, missed tentative tracks are removed
+        #    - if no match add a new tentative tracker with a new face-id
+        startTime = time.time()
+        if self.motionDetector is not None and not self.motionDetector.update(img, grayImg):
+            # static scene - keep the tracked faces of the previous frame
+            self.skippedFrames += 1
+            self._skippedMetric.inc()
+            self.costStats.record(time.time() - startTime)
+            if self.detectionScheduler is not None:
+                self.detectionScheduler.frameDone(time.time() - startTime)
+            return
+        trackImg = self._scaleImage(img, self.trackingScale)
+        fids = list(self.trackedFaces.keys())
+        qualities = self._updateTrackers(trackImg, [self.trackedFaces[fid] for fid in fids])
+        # remove the low quality tracks in one pass after all updates (in face order for the same result as serial updates)
+        fidsToDelete = [fid for fid, quality in zip(fids, qualities) if quality < self.trackQualityLowBar]
         for fid in fidsToDelete:
-            self.trackedFaces.pop(fid , None)
+            self._loseFace(fid, 'quality: ' + str(self.trackedFaces[fid].quality))
+        for fid in [fid for fid, face in self.lostFaces.items() if self.frameCounter - face.lostFrame > self.lostFrames]:
+            Log.info("Removing face ID " + str(fid))
+            self.lostFaces.pop(fid, None)
+        detectTime = time.time()
+        self.trackStats.record(detectTime - startTime)
+        self._trackSeconds.observe(detectTime - startTime)
 
         # determine whether to run face detection
-        if (self.frameCounter % self.framesForDetection) == 0:
-            faces = self.detectFaces(img)
+        detectSeconds = None
+        if self.detectorPool is not None:
+            self._detectAsync(img, trackImg, grayImg)
+            self.detectStats.record(time.time() - detectTime)
+            self._detectSeconds.observe(time.time() - detectTime)
+        elif self._shouldDetect():
+            faces = self.detectFaces(img, grayImg)
             if faces is not None:
-                #if self.debugMode and len(faces) != len(self.trackedFaces):
-                    #Log.info('Found faces: ' + str(len(faces)) + ' Tracking faces: ' + str(len(self.trackedFaces)))
-
-                for (_x,_y,_w,_h) in faces:
-                    # convert to int since dlib requires numpy.int32
-                    x = int(_x)
-                    y = int(_y)
-                    w = int(_w)
-                    h = int(_h)
-                    #calculate the centerpoint
-                    x_center = x + 0.5 * w
-                    y_center = y + 0.5 * h
-
-                    matchedFid = None
-                    # go thru all the trackers and check if the centerpoint of the face is within the box of a tracker
-                    for fid in self.trackedFaces.keys():
-                        t_x, t_y, t_w, t_h = self.trackedFaces[fid].getPosition()
-
-                        #calculate the centerpoint
-                        t_x_center = t_x + 0.5 * t_w
-                        t_y_center = t_y + 0.5 * t_h
-
-                        # check the centerpoint of the face is within the tracker box
-                        # plus the centerpoint of the tracker must be within the detected face box 
-                        if ((t_x <= x_center <= (t_x + t_w)) and 
-                            (t_y <= y_center <= (t_y + t_h)) and 
-                            (x <= t_x_center <= (x + w)) and 
-                            (y <= t_y_center <= (y + h))):
-                            matchedFid = fid
-
-                    if matchedFid is None:
-                        Log.info("Creating new face ID " + str(self.nextFaceID))
-                        # create and store the tracker 
-                        tracker = dlib.correlation_tracker()
-                        pad = self.trackOffset
-                        tracker.start_track(img, dlib.rectangle(x-pad, y-pad, x+w+pad, y+h+pad))
-
-                        self.trackedFaces[self.nextFaceID] = FaceTrackingData(self.nextFaceID, tracker)
-
-                        # increase nextFaceID counter
-                        self.nextFaceID += 1
+                self.detectedFaces = len(faces)
+                self._matchOrAddFaces(trackImg, faces)
+            detectSeconds = time.time() - detectTime
+            self.detectStats.record(detectSeconds)
+            self._detectSeconds.observe(detectSeconds)
 
         # increase the framecounter
         self.frameCounter += 1
+        self._trackedFaces.set(len(self.trackedFaces))
+        self._detectedFaces.set(self.detectedFaces)
+        self.imageShape = img.shape
+        self._processedFrames += 1
+        self._processedSeconds += time.time() - startTime
+        self.costStats.record(time.time() - startTime)
+        if self.detectionScheduler is not None:
+            self.detectionScheduler.frameDone(time.time() - startTime, detectSeconds)
+
+    def _shouldDetect(self):
+        """ whether to run face detection on the current frame """
+        if self.detectionScheduler is not None:
+            return self.detectionScheduler.shouldDetect(self)
+        return (self.frameCounter % self.framesForDetection) == 0
+
+    def _updateTrackers(self, trackImg, faces):
+        """ update the trackers of the faces (concurrently with trackingWorkers > 1), returns the qualities in face order """
+        if self.trackingWorkers <= 1 or len(faces) <= 1:
+            return [face.update(trackImg) for face in faces]
+        if self._trackingPool is None:
+            self._trackingPool = ThreadPoolExecutor(max_workers=self.trackingWorkers, thread_name_prefix='Tracker-%s' %self.name)
+        return list(self._trackingPool.map(lambda face: face.update(trackImg), faces))
+
+    def close(self):
+        """ shut down the tracker update threads """
+        if self._trackingPool is not None:
+            self._trackingPool.shutdown()
+            self._trackingPool = None
 
-        # draw the rectangle around the tracked faces
+    def trackedBoxes(self):
+        """ get the boxes to draw around the tracked faces - list of (label, (x, y, x2, y2), color)
+        label is the face name and quality in debug mode, None otherwise
+        """
+        boxes = []
+        pad = self.trackOffset
         for fid in self.trackedFaces.keys():
             t_x, t_y, t_w, t_h = self.trackedFaces[fid].getPosition()
-            pad = self.trackOffset
             color = self.boxColor
             if self.trackedFaces[fid].quality < self.trackQualityBar:
                 color = self.lowBarBoxColor
-            cv2.rectangle(img, (t_x+pad, t_y+pad), (t_x+t_w-pad, t_y+t_h-pad), color, 1)
-
+            label = None
             if self.debugMode:
-                msg = self.trackedFaces[fid].name + '  ' + str(self.trackedFaces[fid].quality)
-                cv2.putText(img, msg, (int(t_x), int(t_y)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-        self.imageShape = img.shape
+                label = self.trackedFaces[fid].name + '  ' + str(self.trackedFaces[fid].quality)
+            boxes.append((label, (t_x+pad, t_y+pad, t_x+t_w-pad, t_y+t_h-pad), color))
+        return boxes
+
+    def drawTrackedFaces(self, img):
+        """ draw the rectangle around the tracked faces onto img, returns img """
+        for label, (x, y, x2, y2), color in self.trackedBoxes():
+            cv2.rectangle(img, (x, y), (x2, y2), color, 1)
+            if label:
+                cv2.putText(img, label, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         return img
 
-    def detectFaces(self, img):
+    def costPerFrame(self):
+        """ get the cost counters (milliseconds per frame) of detection, tracking and the whole detectOrTrack """
+        return {'total': self.costStats.values(), 'detect': self.detectStats.values(), 'track': self.trackStats.values(),
+                'associate': self.associationStats.values(),
+                'detectedFaces': self.detectedFaces, 'trackedFaces': len(self.trackedFaces), 'lostFaces': len(self.lostFaces),
+                'staleDetections': self.staleDetections,
+                'detectionScale': self.detectionScale, 'trackingScale': self.trackingScale, 'trackingWorkers': self.trackingWorkers,
+                'motion': self.motionStats(),
+                'scheduler': self.detectionScheduler.values() if self.detectionScheduler is not None else None}
+
+    def motionStats(self):
+        """ get the counters of the motion gating - skipped frames, skip ratio and the estimated cpu time saved
+        the saving is the average cost of a processed frame times the skipped frames less the time of the motion checks
+        """
+        if self.motionDetector is None:
+            return None
+        frames = self.skippedFrames + self._processedFrames
+        motionValues = self.motionDetector.values()
+        avgProcessed = self._processedSeconds / self._processedFrames if self._processedFrames > 0 else 0.0
+        return {'skippedFrames': self.skippedFrames, 'skipRatio': round(self.skippedFrames / float(frames), 3) if frames > 0 else 0.0,
+                'savedCpuMs': round((avgProcessed * self.skippedFrames - self.motionDetector.seconds) * 1000.0, 1),
+                'detector': motionValues}
+
+    def _matchOrAddFaces(self, trackImg, faces, age=0):
+        """ associate detected faces (in frame coordinates) with the tracked and lost faces, start tracking the faces without a match
+        trackImg - the image scaled by trackingScale for the trackers
+        age - number of frames since the frame the faces were detected in (detectorPool). a detection older than
+              staleDetectionFrames only adds or confirms tracks: matched tracks are not corrected and lost faces are not
+              revived since the faces may have moved (backends following the detections are still corrected, they
+              move the detection forward by its age)
+        """
+        startTime = time.time()
+        fids = list(self.trackedFaces.keys()) + list(self.lostFaces.keys())
+        pad = self.trackOffset
+        # struct of arrays of the face boxes (tracked box without the offset), one getPosition per track
+        boxes = []
+        for fid in fids:
+            face = self.trackedFaces.get(fid, None) or self.lostFaces[fid]
+            t_x, t_y, t_w, t_h = face.getPosition()
+            boxes.append((t_x + pad, t_y + pad, t_w - 2 * pad, t_h - 2 * pad))
+        trackBoxes = boxArray(boxes)
+        detectedBoxes = boxArray(faces)
+        matches, unmatchedFaces, unmatchedTracks = associate(detectedBoxes, trackBoxes, self.iouThreshold)
+        stale = age > self.staleDetectionFrames
+
+        for d, t in matches:
+            fid = fids[t]
+            if stale and fid in self.lostFaces:
+                continue
+            if fid in self.lostFaces:
+                face = self.lostFaces.pop(fid)
+                Log.info("Reviving face ID " + str(fid))
+                face.restart(trackImg, self._trackerRect(detectedBoxes[d]), self.trackingScale)
+                self.trackedFaces[fid] = face
+            elif not stale or self.trackedFaces[fid].tracker.followsDetections:
+                self.trackedFaces[fid].correct(trackImg, self._trackerRect(detectedBoxes[d]), age)
+            self.trackedFaces[fid].hit(self.confirmHits)
+
+        matchedTracks = [t for d, t in matches]
+        duplicates = set()
+        if len(unmatchedTracks) > 0 and len(matchedTracks) > 0:
+            # an unmatched track overlapping a matched track follows the same face
+            overlaps = iouMatrix(trackBoxes[unmatchedTracks], trackBoxes[matchedTracks]).max(axis=1)
+            duplicates = set(t for t, overlap in zip(unmatchedTracks, overlaps) if overlap > 0.5)
+        for t in unmatchedTracks:
+            fid = fids[t]
+            face = self.trackedFaces.get(fid, None)
+            if face is None:
+                continue    # lost face
+            if t in duplicates:
+                Log.info("Removing duplicate face ID " + str(fid))
+                self.trackedFaces.pop(fid, None)
+            else:
+                face.miss()
+                if face.state == FaceTrackingData.TrackTentative:
+                    Log.info("Removing tentative face ID " + str(fid))
+                    self.trackedFaces.pop(fid, None)
+                elif face.misses >= self.maxMisses:
+                    self._loseFace(fid, 'missed by %i detections' %face.misses)
+
+        for d in unmatchedFaces:
+            Log.info("Creating new face ID " + str(self.nextFaceID))
+            # create and store the tracker 
+            tracker = createTracker(self.trackerBackend)
+            tracker.start(trackImg, self._trackerRect(detectedBoxes[d]))
+
+            face = FaceTrackingData(self.nextFaceID, tracker, self.trackingScale)
+            if self.confirmHits <= 1:
+                face.state = FaceTrackingData.TrackConfirmed
+            self.trackedFaces[self.nextFaceID] = face
+
+            # increase nextFaceID counter
+            self.nextFaceID += 1
+        self.associationStats.record(time.time() - startTime)
+
+    def _trackerRect(self, box):
+        """ the tracker box (left, top, right, bottom) in trackImg coordinates for a face box in frame coordinates """
+        # convert to int since the trackers require int coordinates
+        x, y, w, h = [int(v) for v in box]
+        pad = self.trackOffset
+        scale = self.trackingScale
+        return (int((x-pad)*scale), int((y-pad)*scale), int((x+w+pad)*scale), int((y+h+pad)*scale))
+
+    def _loseFace(self, fid, reason):
+        """ move the tracked face to lost faces """
+        face = self.trackedFaces.pop(fid, None)
+        if face is None:
+            return
+        if face.state == FaceTrackingData.TrackTentative:
+            Log.info("Removing face ID " + str(fid) + ' ' + reason)
+            return
+        Log.info("Lost face ID " + str(fid) + ' ' + reason)
+        face.state = FaceTrackingData.TrackLost
+        face.lostFrame = self.frameCounter
+        self.lostFaces[fid] = face
+
+    def _detectAsync(self, img, trackImg, grayImg=None):
+        """ merge the finished detections from the detector pool and submit the frame if a worker is free """
+        for (frameNumber, scale), faces in self.detectorPool.results():
+            if faces is not None:
+                faces = self._scaleFaces(faces, scale, 0, 0)
+                self.detectedFaces = len(faces)
+                age = self.frameCounter - frameNumber
+                if age > self.staleDetectionFrames:
+                    self.staleDetections += 1
+                self._matchOrAddFaces(trackImg, faces, age)
+        if self.detectorPool.pending() < self.detectorPool.workers:
+            if grayImg is None:
+                grayImg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self.detectorPool.submit(self._scaleImage(grayImg, self.detectionScale), (self.frameCounter, self.detectionScale))
+
+    def detectFaces(self, img, grayImg=None):
         """ detect faces inside the image
-        returns list of faces detected
+        grayImg - optional gray version of img
+        detection runs on the image scaled by detectionScale, only inside the regions around tracked faces with roiDetection
+        returns list of faces detected in image coordinates
         """
         try:
-            grayImg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)   # need a gray image for face detection
-            faces = self.faceClassifier.detectMultiScale(grayImg, self.scaleFactor, self.minNeighbors)
-            return faces
+            if grayImg is None:
+                grayImg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)   # need a gray image for face detection
+            self.detectionCounter += 1
+            if (self.roiDetection and len(self.trackedFaces) > 0 and
+                (self.detectionCounter % self.fullDetectionInterval) != 0):
+                faces = []
+                for (x, y, x2, y2) in self._detectionRegions(grayImg.shape):
+                    roiImg = self._scaleImage(grayImg[y:y2, x:x2], self.detectionScale)
+                    roiFaces = self.faceClassifier.detectMultiScale(roiImg, self.scaleFactor, self.minNeighbors)
+                    faces.extend(self._scaleFaces(roiFaces, self.detectionScale, x, y))
+                return faces
+            scaledImg = self._scaleImage(grayImg, self.detectionScale)
+            faces = self.faceClassifier.detectMultiScale(scaledImg, self.scaleFactor, self.minNeighbors)
+            return self._scaleFaces(faces, self.detectionScale, 0, 0)
         except Exception as e:
             #Log.error('Exception detectFaces: ' + str(e))
             return None
 
+    def _detectionRegions(self, shape):
+        """ get the padded regions (x, y, x2, y2) around the tracked faces clipped to the image
+        overlapping regions are merged into their bounding region so a face inside several regions is detected once
+        """
+        height, width = shape[0], shape[1]
+        regions = []
+        for fid in self.trackedFaces.keys():
+            t_x, t_y, t_w, t_h = self.trackedFaces[fid].getPosition()
+            padX = int(t_w * self.roiPadding)
+            padY = int(t_h * self.roiPadding)
+            x = max(0, t_x - padX)
+            y = max(0, t_y - padY)
+            x2 = min(width, t_x + t_w + padX)
+            y2 = min(height, t_y + t_h + padY)
+            if x2 > x and y2 > y:
+                # merge with the overlapping regions till the region overlaps none of the others
+                merged = True
+                while merged:
+                    merged = False
+                    for region in regions:
+                        if x < region[2] and region[0] < x2 and y < region[3] and region[1] < y2:
+                            regions.remove(region)
+                            x, y, x2, y2 = min(x, region[0]), min(y, region[1]), max(x2, region[2]), max(y2, region[3])
+                            merged = True
+                            break
+                regions.append((x, y, x2, y2))
+        return regions
+
+    def _scaleImage(self, img, scale):
+        """ resize the image by scale, returns the image itself for scale 1 """
+        if scale == 1.0:
+            return img
+        return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    def _scaleFaces(self, faces, scale, offsetX, offsetY):
+        """ map face boxes detected on an image scaled by scale and offset by (offsetX, offsetY) back to image coordinates """
+        return [(int(x / scale) + offsetX, int(y / scale) + offsetY, int(w / scale), int(h / scale)) for (x, y, w, h) in faces]
+
     def getTrackedFaces(self):
         """ get the current tracking data - a dictionary of FaceTrackingData with ID as key and FaceTrackingData as value """
         return self.trackedFaces
 
+    def trackingSnapshot(self):
+        """ get the tracking data of the current frame - a dictionary of FaceSnapshot with ID as key
+        unlike getTrackedFaces the values do not change with the next frames (published with the tracked frame)
+        """
+        return dict((fid, face.snapshot()) for fid, face in list(self.trackedFaces.items()))
+
     def getImageShape(self):
         """ get the image shape for tracked faces """
         return self.imageShape
 
 class FaceTrackingData():
     """ face tracking data that contains:
-    tracker: the dlib's correlation_tracker
+    tracker: the tracker backend (see trackerBackends)
     id: face id
     name: name for the tracked data
     quality: quality of the tracking
+    state: TrackTentative (not confirmed by enough detections), TrackConfirmed or TrackLost
     """
-    def __init__(self, id, tracker):
-        """ construct a FaceTrackingData with id and correlation_tracker """
+    # constants for track states
+    TrackTentative = 0
+    TrackConfirmed = 1
+    TrackLost = 2
+
+    def __init__(self, id, tracker, scale=1.0):
+        """ construct a FaceTrackingData with id and a started tracker backend
+        scale - the scale of the images the tracker runs on, positions are mapped back to full image coordinates
+        """
         self.name = "ID " + str(id)
         self.id = id
         self.tracker = tracker
+        self.scale = scale
+        self.quality = 10
+        self.state = FaceTrackingData.TrackTentative
+        self.hits = 1           # number of detections matching the track (including the one started the track)
+        self.misses = 0         # number of detections in a row missing the track
+        self.lostFrame = 0      # the frame number the track was lost
+
+    def hit(self, confirmHits):
+        """ the track is matched by a detection, confirm it after confirmHits detections """
+        self.hits += 1
+        self.misses = 0
+        if self.state != FaceTrackingData.TrackConfirmed and self.hits >= confirmHits:
+            self.state = FaceTrackingData.TrackConfirmed
+
+    def miss(self):
+        """ the track is missed by a detection """
+        self.misses += 1
+
+    def restart(self, image, rect, scale):
+        """ restart tracking a lost face at rect """
+        self.tracker.start(image, rect)
+        self.scale = scale
         self.quality = 10
+        self.misses = 0
+        self.state = FaceTrackingData.TrackConfirmed
+
+    def correct(self, image, rect, age=0):
+        """ a detection of age frames ago matched the face at rect """
+        self.tracker.correct(image, rect, age)
 
     def update(self, image):
-        """ correlation_tracker's update() """
+        """ the tracker's update(), returns the tracking quality """
         quality = self.tracker.update(image)
         self.quality = quality
         return quality
 
     def getPosition(self):
         """ get tracked position - returns [x, y, width, height] """
-        tracked_position =  self.tracker.get_position()
-        x = int(tracked_position.left())
-        y = int(tracked_position.top())
-        w = int(tracked_position.width())
-        h = int(tracked_position.height())
+        left, top, right, bottom = self.tracker.position()
+        x = int(left / self.scale)
+        y = int(top / self.scale)
+        w = int((right - left) / self.scale)
+        h = int((bottom - top) / self.scale)
         return [x, y, w, h]
 
+    def snapshot(self):
+        """ get the FaceSnapshot of the current position, quality and state """
+        return FaceSnapshot(self.id, self.name, self.getPosition(), self.quality, self.state)
+
+class FaceSnapshot(object):
+    """ the tracking data of a face in one frame - id, name, quality, state (FaceTrackingData's track states) and the position
+    read only, getPosition() returns [x, y, width, height] like FaceTrackingData
+    """
+    __slots__ = ('id', 'name', 'position', 'quality', 'state')
+
+    def __init__(self, id, name, position, quality, state):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'position', tuple(position))
+        object.__setattr__(self, 'quality', quality)
+        object.__setattr__(self, 'state', state)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FaceSnapshot is read only')
+
+    def getPosition(self):
+        """ get tracked position - returns [x, y, width, height] """
+        return list(self.position)
+
 if __name__ == '__main__':
     # initialize face cascade with the frontal face haar cascade
     faceClassifier = cv2.CascadeClassifier('data/haarcascade_frontalface_default.xml')
@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import OrderedDict
+import cv2
+from IotLib.log import Log
+from .cameraFrame import CameraFrame
+from . import metrics
+from .frameTrace import getTracer
+
+# the scales of the stream variants, a requested scale is rounded to the nearest one
+VariantScales = (0.25, 0.5, 0.75, 1.0)
+
+def variantParams(query):
+    """ get the stream variant (quality, scale, maxFps) from the query parameters of a feed request
+    query - dictionary of the query parameters: quality (1 - 100), scale (0.1 - 1.0) and fps (max frames per second)
+    a missing parameter is None (quality, maxFps) or 1.0 (scale). raises ValueError for invalid values.
+    quality is rounded to a multiple of 10 and scale to the nearest of VariantScales so the clients share a small fixed
+    set of variants (each variant keeps its latest frame in the JpegFrameCache).
+    """
+    quality = query.get('quality', None)
+    scale = query.get('scale', None)
+    maxFps = query.get('fps', None)
+    quality = min(100, max(10, int(round(int(quality) / 10.0)) * 10)) if quality else None
+    scale = min(VariantScales, key=lambda s: abs(s - float(scale))) if scale else 1.0
+    maxFps = float(maxFps) if maxFps else None
+    if maxFps is not None and maxFps <= 0:
+        raise ValueError('fps must be positive')
+    return (quality, scale, maxFps)
+
+class JpegFrameCache(object):
+    """ cache of encoded jpeg frames shared by all streaming clients
+    the cache is keyed by the frame sequence number plus the variant (tracking, quality, scale) so each variant of a
+    frame is resized and encoded only once no matter how many clients are streaming it, and only when a client asks
+    for it. concurrent requests for the same key wait for the first encode.
+    a CameraFrame with the jpeg from the camera is cached as is (passthrough) unless a different quality is requested.
+    """
+    def __init__(self, maxEntries=16, name='camera'):
+        """ construct a JpegFrameCache
+        maxEntries - the max number of encoded frames to keep (the oldest entries are dropped first)
+        name - the camera name for the metrics
+        """
+        self.maxEntries = maxEntries
+        self.name = name
+        self._encodeSeconds = metrics.encodeSeconds.labels(name)
+        self._tracer = getTracer(name)
+        self.hits = 0               # number of requests served from the cache
+        self.misses = 0             # number of requests that caused an encode
+        self.passthrough = 0        # number of frames cached with the jpeg from the camera without encode
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> [threading.Event, jpeg bytes]
+        self._latest = {}               # key: (tracking, quality, scale), value: (seq, jpeg bytes) of the most recent encoded frame
+
+    def encode(self, seq, img, tracking=False, quality=None, scale=1.0):
+        """ get the jpeg bytes for frame seq, encode img only if the frame has not been encoded with the same parameters
+        seq - the sequence number of the frame
+        img - the frame image in bgr format or a CameraFrame
+        tracking - whether img is the face tracking frame
+        quality - jpeg quality (0 - 100) or None for opencv's default
+        scale - scale of the encoded image relative to img
+        """
+        variant = (tracking, quality, scale)
+        key = (seq,) + variant
+        owner = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                owner = True
+                entry = [threading.Event(), None]
+                self._entries[key] = entry
+                while len(self._entries) > self.maxEntries:
+                    oldKey, oldEntry = self._entries.popitem(last=False)
+                    # the latest frame of a variant goes with its entry so idle variants do not keep their frames
+                    oldVariant = oldKey[1:]
+                    latest = self._latest.get(oldVariant, None)
+                    if latest is not None and latest[0] <= oldKey[0]:
+                        del self._latest[oldVariant]
+            else:
+                self.hits += 1
+
+        if owner:
+            try:
+                if isinstance(img, CameraFrame) and img.hasJpeg() and quality is None and scale == 1.0:
+                    entry[1] = img.jpeg()
+                    self.passthrough += 1
+                else:
+                    startTime = time.time()
+                    if isinstance(img, CameraFrame):
+                        img = img.bgr()
+                    if scale != 1.0:
+                        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                    params = [] if quality is None else [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+                    entry[1] = cv2.imencode('.jpg', img, params)[1].tobytes()
+                    endTime = time.time()
+                    self._encodeSeconds.observe(endTime - startTime)
+                    self._tracer.stage(seq, 'encode', startTime, endTime)
+                with self._lock:
+                    latest = self._latest.get(variant, None)
+                    if latest is None or seq >= latest[0]:
+                        self._latest[variant] = (seq, entry[1])
+            except Exception as e:
+                Log.error('Exception encoding frame %s: %s' %(str(seq), str(e)))
+            finally:
+                entry[0].set()
+        else:
+            entry[0].wait()
+        return entry[1]
+
+    def latest(self, tracking=False, quality=None, scale=1.0):
+        """ get the most recent encoded jpeg frame of the variant as (seq, jpeg bytes) or None if nothing is encoded yet """
+        return self._latest.get((tracking, quality, scale), None)
+
+    def stats(self):
+        """ get the cache counters as a dictionary """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'passthrough': self.passthrough, 'entries': len(self._entries),
+                    'variants': len(self._latest)}
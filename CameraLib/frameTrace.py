@@ -0,0 +1,114 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+class FrameTrace(object):
+    """ metadata of one frame - sequence number, capture time and the (start, end) times of the pipeline stages """
+    __slots__ = ('seq', 'captureTime', 'publishTime', 'stages', 'sentTime')
+
+    def __init__(self, seq, captureTime, publishTime):
+        self.seq = seq
+        self.captureTime = captureTime      # time the frame was captured (sensor time when the camera provides it)
+        self.publishTime = publishTime      # time the frame was published on the frame bus
+        self.stages = {}                    # key: stage name (tracking, overlay, encode), value: (start, end)
+        self.sentTime = None                # time the frame was first sent to a client
+
+    def values(self):
+        """ get the trace as a dictionary with the stage times in milliseconds after the capture """
+        values = {'seq': self.seq, 'captureTime': self.captureTime,
+                  'publishMs': round((self.publishTime - self.captureTime) * 1000.0, 2)}
+        for name, (start, end) in list(self.stages.items()):
+            values[name] = {'startMs': round((start - self.captureTime) * 1000.0, 2), 'endMs': round((end - self.captureTime) * 1000.0, 2)}
+        if self.sentTime is not None:
+            values['sentMs'] = round((self.sentTime - self.captureTime) * 1000.0, 2)
+        return values
+
+class FrameTracer(object):
+    """ traces the frames of a camera through the pipeline and keeps the recent latency samples for percentiles
+    sampled latencies:
+    - capture: capture time to published on the frame bus
+    - queue: capture time to the start of face tracking
+    - tracking, overlay, encode: time spent in the stage
+    - endToEnd: capture time to sent to a client (one sample per client)
+    the traces of the last maxFrames frames are kept by sequence number, the last maxSamples samples per latency.
+    """
+    Latencies = ('capture', 'queue', 'tracking', 'overlay', 'encode', 'endToEnd')
+
+    def __init__(self, name, maxFrames=120, maxSamples=1000):
+        self.name = name
+        self.maxFrames = maxFrames
+        self._traces = OrderedDict()    # key: seq, value: FrameTrace
+        self._samples = dict((latency, deque(maxlen=maxSamples)) for latency in FrameTracer.Latencies)
+        self._lock = threading.Lock()
+
+    def begin(self, seq, captureTime, publishTime=None):
+        """ start the trace of a frame published on the frame bus """
+        publishTime = time.time() if publishTime is None else publishTime
+        trace = FrameTrace(seq, captureTime, publishTime)
+        with self._lock:
+            self._traces[seq] = trace
+            while len(self._traces) > self.maxFrames:
+                self._traces.popitem(last=False)
+            self._samples['capture'].append(publishTime - captureTime)
+
+    def stage(self, seq, name, start, end):
+        """ record the times a frame entered and left a stage, only the first record of a stage is kept """
+        with self._lock:
+            trace = self._traces.get(seq, None)
+            if trace is None or name in trace.stages:
+                return
+            trace.stages[name] = (start, end)
+            self._samples[name].append(end - start)
+            if name == 'tracking':
+                self._samples['queue'].append(start - trace.captureTime)
+
+    def sent(self, seq, sentTime=None):
+        """ record a frame sent to a client, returns the capture time of the frame or None if it is not traced """
+        sentTime = time.time() if sentTime is None else sentTime
+        with self._lock:
+            trace = self._traces.get(seq, None)
+            if trace is None:
+                return None
+            if trace.sentTime is None:
+                trace.sentTime = sentTime
+            self._samples['endToEnd'].append(sentTime - trace.captureTime)
+            return trace.captureTime
+
+    def captureTime(self, seq):
+        """ get the capture time of the frame, None if it is not traced """
+        trace = self._traces.get(seq, None)
+        return trace.captureTime if trace is not None else None
+
+    def traces(self, count=10):
+        """ get the traces of the last count frames as a list of dictionaries """
+        with self._lock:
+            traces = list(self._traces.values())[-count:]
+        return [trace.values() for trace in traces]
+
+    def percentiles(self):
+        """ get the count and the p50, p90, p99 and max in milliseconds of each latency as a dictionary """
+        with self._lock:
+            samples = dict((latency, sorted(values)) for latency, values in self._samples.items())
+        result = {}
+        for latency in FrameTracer.Latencies:
+            values = samples[latency]
+            if len(values) == 0:
+                continue
+            result[latency] = {'count': len(values), 'p50Ms': _percentileMs(values, 50), 'p90Ms': _percentileMs(values, 90),
+                               'p99Ms': _percentileMs(values, 99), 'maxMs': round(values[-1] * 1000.0, 2)}
+        return result
+
+def _percentileMs(values, p):
+    """ the p-th percentile in milliseconds of the sorted values """
+    return round(values[min(len(values) - 1, int(len(values) * p / 100.0))] * 1000.0, 2)
+
+_tracers = {}           # key: camera name, value: FrameTracer
+_tracersLock = threading.Lock()
+
+def getTracer(name):
+    """ get the FrameTracer of the named camera (shared by the camera, its jpeg cache and the streaming servers) """
+    tracer = _tracers.get(name, None)
+    if tracer is None:
+        with _tracersLock:
+            tracer = _tracers.setdefault(name, FrameTracer(name))
+    return tracer
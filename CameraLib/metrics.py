@@ -0,0 +1,158 @@
+import threading
+from bisect import bisect_left
+
+# default latency buckets in seconds (0.5 ms to 2.5 s)
+LatencyBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class _CounterValue(object):
+    """ the value of a counter or gauge with one set of label values """
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+class _HistogramValue(object):
+    """ the buckets of a histogram with one set of label values """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last count is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+            count = self.count
+        samples = []
+        cumulative = 0
+        for bound, bucketCount in zip(list(self.buckets) + [float('inf')], counts):
+            cumulative += bucketCount
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((name + '_bucket', labels + (('le', le),), cumulative))
+        samples.append((name + '_sum', labels, total))
+        samples.append((name + '_count', labels, count))
+        return samples
+
+class Metric(object):
+    """ a counter, gauge or histogram with optional labels
+    labels(*values) returns the value object for the label values (cache it on hot paths) that supports:
+    - counter: inc(amount)
+    - gauge: set(value), inc(amount)
+    - histogram: observe(value)
+    """
+    def __init__(self, name, help, metricType, labelNames=(), buckets=LatencyBuckets):
+        self.name = name
+        self.help = help
+        self.type = metricType
+        self.labelNames = tuple(labelNames)
+        self.buckets = tuple(buckets)
+        self._values = {}       # key: tuple of label values, value: _CounterValue or _HistogramValue
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """ get the value object for the label values """
+        value = self._values.get(values, None)
+        if value is None:
+            with self._lock:
+                value = self._values.get(values, None)
+                if value is None:
+                    value = _HistogramValue(self.buckets) if self.type == 'histogram' else _CounterValue()
+                    self._values[values] = value
+        return value
+
+    def exposition(self):
+        """ the metric in prometheus text format """
+        lines = ['# HELP %s %s' %(self.name, self.help), '# TYPE %s %s' %(self.name, self.type)]
+        for labelValues, value in sorted(list(self._values.items())):
+            labels = tuple(zip(self.labelNames, labelValues))
+            for name, sampleLabels, sample in value.samples(self.name, labels):
+                lines.append('%s%s %s' %(name, _formatLabels(sampleLabels), _formatValue(sample)))
+        return '\n'.join(lines)
+
+class MetricsRegistry(object):
+    """ registry of the metrics exposed on the /metrics endpoint in prometheus text format
+    recording is a dictionary lookup (avoided by caching labels()) plus a lock protected increment so it can stay on
+    in production.
+    """
+    def __init__(self):
+        self.metrics = {}           # key: metric name, value: Metric
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelNames=()):
+        """ get or create a counter """
+        return self._getOrAdd(name, help, 'counter', labelNames)
+
+    def gauge(self, name, help, labelNames=()):
+        """ get or create a gauge """
+        return self._getOrAdd(name, help, 'gauge', labelNames)
+
+    def histogram(self, name, help, labelNames=(), buckets=LatencyBuckets):
+        """ get or create a histogram """
+        return self._getOrAdd(name, help, 'histogram', labelNames, buckets)
+
+    def exposition(self):
+        """ all metrics in prometheus text format """
+        with self._lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics.keys())]
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+    def _getOrAdd(self, name, help, metricType, labelNames, buckets=LatencyBuckets):
+        with self._lock:
+            metric = self.metrics.get(name, None)
+            if metric is None:
+                metric = Metric(name, help, metricType, labelNames, buckets)
+                self.metrics[name] = metric
+            elif metric.type != metricType:
+                raise ValueError('Metric %s is already registered as %s' %(name, metric.type))
+            return metric
+
+def _formatLabels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('%s="%s"' %(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+def _formatValue(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+# the default registry used by the camera pipeline
+registry = MetricsRegistry()
+
+# metrics of the camera pipeline
+captureFrames = registry.counter('camera_frames_captured_total', 'Frames captured by the camera thread', ('camera',))
+captureInterval = registry.histogram('camera_capture_interval_seconds', 'Time between captured frames', ('camera',))
+detectSeconds = registry.histogram('facetracker_detect_seconds', 'Time spent in face detection per frame', ('tracker',))
+trackSeconds = registry.histogram('facetracker_track_seconds', 'Time spent updating the face trackers per frame', ('tracker',))
+trackedFaces = registry.gauge('facetracker_tracked_faces', 'Number of faces being tracked', ('tracker',))
+skippedFrames = registry.counter('facetracker_frames_skipped_total', 'Static frames skipped by the motion gating of face tracking', ('tracker',))
+detectedFaces = registry.gauge('facetracker_detected_faces', 'Number of faces found by the last detection', ('tracker',))
+detectionDecisions = registry.counter('facetracker_detection_decisions_total', 'Decisions of the adaptive detection scheduler per frame', ('tracker', 'decision'))
+detectionInterval = registry.gauge('facetracker_detection_interval', 'Frames between face detections chosen by the adaptive detection scheduler', ('tracker',))
+encodeSeconds = registry.histogram('stream_encode_seconds', 'Time to resize and encode a jpeg frame', ('camera',))
+streamFrames = registry.counter('stream_frames_sent_total', 'Frames sent to streaming clients', ('camera',))
+streamBytes = registry.counter('stream_bytes_sent_total', 'Bytes of jpeg frames sent to streaming clients', ('camera',))
+streamSkipped = registry.counter('stream_frames_skipped_total', 'Frames streaming clients never received', ('camera',))
+streamUnchanged = registry.counter('stream_frames_unchanged_total', 'Unchanged frames not sent to streaming clients', ('camera',))
+streamKeepAlive = registry.counter('stream_frames_keepalive_total', 'Unchanged frames sent to keep streaming clients alive', ('camera',))
+streamClients = registry.gauge('stream_clients', 'Number of streaming clients', ('camera',))
+recorderFrames = registry.counter('recorder_frames_total', 'Frames written by the video recorder', ('camera',))
+recorderDropped = registry.counter('recorder_frames_dropped_total', 'Frames dropped by the video recorder because its queue was full', ('camera',))
@@ -0,0 +1,118 @@
+import struct
+
+# jpeg start of image and end of image markers
+JpegSOI = b'\xff\xd8'
+JpegEOI = b'\xff\xd9'
+
+class MjpegReader(object):
+    """ splits a raw mjpeg stream (concatenated jpeg images such as a .mjpeg file) into jpeg frames
+    frames are delimited by the SOI and EOI markers, anything between frames (e.g. multipart headers) is skipped.
+    a 0xFFD9 can not appear in entropy coded jpeg data (0xFF is stuffed) but may end an embedded exif thumbnail,
+    so nested SOI markers are counted to find the EOI of the outer image.
+    """
+    def __init__(self, source, chunkSize=64 * 1024):
+        """ construct a MjpegReader
+        source - file path or a binary file object of the mjpeg stream
+        chunkSize - number of bytes to read at a time
+        """
+        self.source = source
+        self.chunkSize = chunkSize
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self):
+        """ generator that returns the bytes of each jpeg frame in the stream """
+        if isinstance(self.source, (str, bytes)):
+            with open(self.source, 'rb') as f:
+                for frame in self._split(f):
+                    yield frame
+        else:
+            for frame in self._split(self.source):
+                yield frame
+
+    def _split(self, f):
+        buffer = bytearray()
+        start = -1      # offset of the SOI of the current frame in buffer, -1 if not found yet
+        pos = 0         # offset in buffer to continue the marker scan
+        depth = 0       # number of open SOI markers
+        while True:
+            chunk = f.read(self.chunkSize)
+            if not chunk:
+                break
+            buffer += chunk
+            while True:
+                if start < 0:
+                    start = buffer.find(JpegSOI, pos)
+                    if start < 0:
+                        # drop the garbage but keep a trailing 0xFF that may begin a marker
+                        del buffer[:max(len(buffer) - 1, 0)]
+                        pos = 0
+                        break
+                    depth = 1
+                    pos = start + 2
+                marker = self._nextMarker(buffer, pos)
+                if marker < 0:
+                    pos = max(len(buffer) - 1, pos)
+                    break
+                pos = marker + 2
+                if buffer[marker + 1] == 0xd8:
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth > 0:
+                    continue
+                yield bytes(buffer[start:pos])
+                del buffer[:pos]
+                start = -1
+                pos = 0
+
+    @staticmethod
+    def _nextMarker(buffer, pos):
+        """ offset of the next SOI or EOI marker in buffer at or after pos, -1 if none """
+        soi = buffer.find(JpegSOI, pos)
+        eoi = buffer.find(JpegEOI, pos)
+        if soi < 0:
+            return eoi
+        if eoi < 0:
+            return soi
+        return min(soi, eoi)
+
+def writeMjpeg(path, frames):
+    """ write jpeg frames (bytes) to an mjpeg file that can be read by MjpegReader """
+    count = 0
+    with open(path, 'wb') as f:
+        for frame in frames:
+            f.write(frame)
+            count += 1
+    return count
+
+def mjpegToAvi(frames, width, height, fps):
+    """ mux jpeg frames (list of bytes) into an MJPG avi file without re-encoding, returns the avi bytes
+    width, height - the size of the frames
+    fps - the frame rate of the clip
+    """
+    movi = bytearray()
+    index = bytearray()
+    for frame in frames:
+        # offsets in idx1 are relative to the 'movi' fourcc
+        index += struct.pack('<4sIII', b'00dc', 0x10, len(movi) + 4, len(frame))
+        movi += struct.pack('<4sI', b'00dc', len(frame)) + frame
+        if len(frame) % 2 == 1:
+            movi += b'\0'
+    count = len(frames)
+    maxFrame = max([len(frame) for frame in frames] or [0])
+    rate = int(round(fps * 1000))
+    microSecPerFrame = int(1000000 / fps) if fps > 0 else 0
+    avih = struct.pack('<IIIIIIIIII16x', microSecPerFrame, int(maxFrame * fps), 0, 0x10, count, 0, 1, maxFrame, width, height)
+    strh = struct.pack('<4s4sIHHIIIIIIiI4h', b'vids', b'MJPG', 0, 0, 0, 0, 1000, rate, 0, count, maxFrame, -1, 0,
+                       0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    strl = b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+    hdrl = b'hdrl' + _chunk(b'avih', avih) + _chunk(b'LIST', strl)
+    body = b'AVI ' + _chunk(b'LIST', hdrl) + _chunk(b'LIST', b'movi' + bytes(movi)) + _chunk(b'idx1', bytes(index))
+    return _chunk(b'RIFF', body)
+
+def _chunk(fourcc, data):
+    """ a riff chunk padded to even size """
+    return struct.pack('<4sI', fourcc, len(data)) + data + (b'\0' if len(data) % 2 == 1 else b'')
@@ -0,0 +1,78 @@
+import time
+import cv2
+from CameraLib.stageStats import StageStats
+
+class MotionDetector(object):
+    """ cheap motion estimator to gate face detection and tracking on static scenes
+    each frame is downscaled to width pixels (gray, blurred) and differenced against the reference frame, the last frame
+    reported as motion. the scene is moving when more than minMotionRatio of the pixels changed by more than threshold.
+    keeping the reference till motion is reported lets slow changes accumulate instead of being missed frame by frame.
+    a frame is reported as motion at least every maxStaticFrames frames to refresh the detection (0 to never force it).
+    """
+    def __init__(self, width=160, threshold=15, minMotionRatio=0.002, maxStaticFrames=150):
+        """ construct a MotionDetector
+        width - width of the downscaled frames (the height keeps the aspect ratio)
+        threshold - min change of a pixel (0 - 255) to count as motion
+        minMotionRatio - min ratio of the changed pixels for the frame to count as motion
+        maxStaticFrames - max number of static frames in a row before a frame is reported as motion, 0 for no limit
+        """
+        self.width = width
+        self.threshold = threshold
+        self.minMotionRatio = minMotionRatio
+        self.maxStaticFrames = maxStaticFrames
+        self.frames = 0             # number of frames checked
+        self.staticFrames = 0       # number of frames without motion
+        self.motionRatio = 0.0      # ratio of the changed pixels of the last frame
+        self.seconds = 0.0          # total time spent in the motion check
+        self.costStats = StageStats('motion')   # time spent in the motion check
+        self._reference = None
+        self._staticRun = 0         # number of static frames in a row
+
+    def update(self, img, grayImg=None):
+        """ check the frame for motion against the reference frame, returns True if the scene moved
+        grayImg - optional gray version of img (e.g. Y plane of a yuv capture) to downscale instead of img
+        """
+        startTime = time.time()
+        small = self._downscale(img if grayImg is None else grayImg)
+        self.frames += 1
+        motion = True
+        if self._reference is not None and self._reference.shape == small.shape:
+            diff = cv2.absdiff(small, self._reference)
+            changed = cv2.countNonZero(cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1])
+            self.motionRatio = changed / float(small.size)
+            motion = self.motionRatio > self.minMotionRatio
+            if not motion and self.maxStaticFrames > 0 and self._staticRun >= self.maxStaticFrames:
+                motion = True
+        if motion:
+            self._reference = small
+            self._staticRun = 0
+        else:
+            self.staticFrames += 1
+            self._staticRun += 1
+        elapsed = time.time() - startTime
+        self.seconds += elapsed
+        self.costStats.record(elapsed)
+        return motion
+
+    def reset(self):
+        """ forget the reference frame so the next frame is reported as motion """
+        self._reference = None
+        self._staticRun = 0
+
+    def values(self):
+        """ get the counters as a dictionary """
+        return {'frames': self.frames, 'staticFrames': self.staticFrames,
+                'staticRatio': round(self.staticFrames / float(self.frames), 3) if self.frames > 0 else 0.0,
+                'motionRatio': round(self.motionRatio, 4), 'cost': self.costStats.values()}
+
+    def _downscale(self, img):
+        """ the gray, blurred image downscaled to width """
+        return downscaleGray(img, self.width)
+
+def downscaleGray(img, width):
+    """ the gray, blurred image downscaled to width pixels (the height keeps the aspect ratio) """
+    height = max(1, int(img.shape[0] * width / img.shape[1]))
+    small = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(small, (5, 5), 0)
@@ -0,0 +1,124 @@
+import time
+import threading
+from collections import OrderedDict
+import cv2
+
+class OverlayLayer(object):
+    """ base class of the overlay layers. a layer draws onto the output image of the overlay, never onto the captured frame """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def appliesTo(self, tracking):
+        """ whether the layer draws on the raw frames (tracking False) or the face tracking frames (tracking True) """
+        return True
+
+    def draw(self, img, context):
+        """ draw the layer onto img
+        context - dictionary with timestamp, fps and boxes (list of (label, (x, y, x2, y2), color) of the tracked faces)
+        """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+class CrosshairLayer(OverlayLayer):
+    """ crosshair in the center of the frame """
+    def __init__(self, enabled=True, size=16, color=(0, 255, 0)):
+        super(CrosshairLayer, self).__init__(enabled)
+        self.size = size
+        self.color = color
+
+    def draw(self, img, context):
+        h, w = img.shape[0], img.shape[1]
+        xc = (int)(w/2)
+        yc = (int)(h/2)
+        pix = self.size
+        cv2.line(img, (xc - pix, yc), (xc + pix, yc), self.color, 1)
+        cv2.line(img, (xc, yc - pix), (xc, yc + pix), self.color, 1)
+
+class TrackingLayer(OverlayLayer):
+    """ boxes around the tracked faces and their labels """
+    def __init__(self, enabled=True, labelColor=(255, 255, 255)):
+        super(TrackingLayer, self).__init__(enabled)
+        self.labelColor = labelColor
+
+    def appliesTo(self, tracking):
+        return tracking
+
+    def draw(self, img, context):
+        for label, (x, y, x2, y2), color in context.get('boxes', None) or []:
+            cv2.rectangle(img, (x, y), (x2, y2), color, 1)
+            if label:
+                cv2.putText(img, label, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.labelColor, 1)
+
+class StampLayer(OverlayLayer):
+    """ capture time and fps in the bottom left corner """
+    def __init__(self, enabled=False, color=(255, 255, 255)):
+        super(StampLayer, self).__init__(enabled)
+        self.color = color
+
+    def draw(self, img, context):
+        timestamp = context.get('timestamp', None) or time.time()
+        msg = '%s.%03i  %.1f fps' %(time.strftime('%H:%M:%S', time.localtime(timestamp)), int(timestamp * 1000) % 1000,
+                                    context.get('fps', 0.0))
+        cv2.putText(img, msg, (8, img.shape[0] - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.color, 1)
+
+class Overlay(object):
+    """ overlay compositing stage - renders the enabled layers once per frame into a separate output image
+    the rendered image is cached by frame sequence number and shared by all consumers, the captured frame stays
+    pristine for analytics. without any enabled layer the frame itself is returned (no copy).
+    """
+    def __init__(self, crosshair=False, stamp=False):
+        """ construct an Overlay with the crosshair, tracking and stamp layers
+        crosshair - whether to draw the crosshair
+        stamp - whether to draw the capture time and fps
+        """
+        self.layers = OrderedDict()
+        self.layers['crosshair'] = CrosshairLayer(enabled=crosshair)
+        self.layers['tracking'] = TrackingLayer()
+        self.layers['stamp'] = StampLayer(enabled=stamp)
+        self.rendered = 0           # number of frames rendered
+        self._lock = threading.Lock()
+        self._cache = {}            # key: tracking, value: [seq, threading.Event, rendered image]
+
+    def add(self, name, layer):
+        """ add (or replace) a named layer, layers are drawn in the order they are added """
+        self.layers[name] = layer
+
+    def setEnabled(self, name, enabled):
+        """ enable or disable the named layer """
+        self.layers[name].enabled = enabled
+
+    def active(self, tracking=False):
+        """ whether any layer draws on the raw (tracking False) or the face tracking frames """
+        return any(layer.enabled and layer.appliesTo(tracking) for layer in list(self.layers.values()))
+
+    def render(self, seq, img, tracking=False, context=None):
+        """ get the frame seq with the overlay, render it only once per frame
+        img - the pristine frame image
+        context - dictionary for the layers (timestamp, fps, boxes)
+        """
+        if not self.active(tracking):
+            return img
+        owner = False
+        with self._lock:
+            entry = self._cache.get(tracking, None)
+            if entry is None or entry[0] != seq:
+                # an older frame requested by a slow consumer is rendered without replacing the cached frame
+                if entry is None or entry[0] < seq:
+                    self._cache[tracking] = [seq, threading.Event(), None]
+                    entry = self._cache[tracking]
+                else:
+                    entry = [seq, threading.Event(), None]
+                owner = True
+        if owner:
+            try:
+                output = img.copy()
+                context = context or {}
+                for layer in list(self.layers.values()):
+                    if layer.enabled and layer.appliesTo(tracking):
+                        layer.draw(output, context)
+                entry[2] = output
+                self.rendered += 1
+            finally:
+                entry[1].set()
+        else:
+            entry[1].wait()
+        return entry[2] if entry[2] is not None else img
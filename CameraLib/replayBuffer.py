@@ -0,0 +1,150 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+import cv2
+from IotLib.log import Log
+from .mjpegReader import mjpegToAvi
+
+class ReplayBuffer(object):
+    """ in-memory instant replay - a ring of the most recent encoded frames of a camera bounded by bytes
+    a background thread takes every frame from the camera's frame bus, encodes it through the jpeg cache (shared with the
+    streaming clients so a streamed frame is not encoded twice, a camera jpeg is passed through) and appends it to the
+    ring with its capture time and tracked faces. the oldest frames are dropped when the ring exceeds maxBytes.
+    freeze() stops the ring (e.g. on an emergency stop) so the clip leading to the event is kept till unfreeze().
+    """
+    def __init__(self, camera, maxBytes=32 * 1024 * 1024, tracking=False, jpegCache=None, quality=None):
+        """ construct a ReplayBuffer
+        camera - the camera (derived from BaseCamera)
+        maxBytes - max bytes of the jpeg frames in the ring
+        tracking - whether to keep the face tracking frames instead of the raw frames
+        jpegCache - the JpegFrameCache shared with the streaming clients or None for the camera's jpegCache
+        quality - jpeg quality or None for opencv's default
+        """
+        self.camera = camera
+        self.maxBytes = maxBytes
+        self.tracking = tracking
+        self.jpegCache = jpegCache if jpegCache is not None else camera.jpegCache
+        self.quality = quality
+        self.frozen = False         # whether the ring is frozen
+        self.freezeReason = None
+        self.bytes = 0              # bytes of the frames in the ring
+        self._ring = deque()        # (seq, timestamp, jpeg, faces)
+        self._freezeAt = None       # capture time after which frames are not added
+        self._lock = threading.Lock()
+        self._running = False
+        self._subscription = None   # subscription to the recorded stream of the camera
+        self._thread = None
+
+    def start(self):
+        """ start filling the ring """
+        if self._running:
+            return
+        self._running = True
+        self._subscription = self.camera.streams.subscribe('tracked' if self.tracking else 'raw')
+        self._thread = threading.Thread(target=self._fill, name='Replay-%s' %self.camera.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ stop filling the ring """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+
+    def freeze(self, reason=None, postSeconds=0):
+        """ freeze the ring keeping the frames captured till postSeconds from now """
+        with self._lock:
+            if self.frozen:
+                return
+            self.frozen = True
+            self.freezeReason = reason
+            self._freezeAt = time.time() + postSeconds
+        Log.info('Replay %s frozen: %s' %(self.camera.name, str(reason)))
+
+    def unfreeze(self):
+        """ resume filling the ring """
+        with self._lock:
+            self.frozen = False
+            self.freezeReason = None
+            self._freezeAt = None
+
+    def frames(self, seconds=None):
+        """ get the frames in the ring as a list of (seq, timestamp, jpeg, faces)
+        seconds - only the last seconds of the ring, None for all frames
+        """
+        with self._lock:
+            frames = list(self._ring)
+        if seconds is not None and len(frames) > 0:
+            start = frames[-1][1] - seconds
+            frames = [frame for frame in frames if frame[1] >= start]
+        return frames
+
+    def clip(self, format='avi', seconds=None):
+        """ get the ring as a clip - format 'avi' (MJPG avi) or 'mjpeg' (concatenated jpeg) bytes, None if empty """
+        frames = self.frames(seconds)
+        if len(frames) == 0:
+            return None
+        jpegs = [frame[2] for frame in frames]
+        if format == 'mjpeg':
+            return b''.join(jpegs)
+        duration = frames[-1][1] - frames[0][1]
+        fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+        # the actual size of the frames for the avi header
+        width, height = self.camera.resolution()
+        img = cv2.imdecode(np.frombuffer(jpegs[0], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            height, width = img.shape[0], img.shape[1]
+        return mjpegToAvi(jpegs, width, height, fps)
+
+    def metadata(self, seconds=None):
+        """ get the seq, capture time, size and tracked faces of the frames in the ring as a list of dictionaries """
+        return [{'seq': seq, 'timestamp': timestamp, 'size': len(jpeg), 'faces': faces}
+                for seq, timestamp, jpeg, faces in self.frames(seconds)]
+
+    def stats(self):
+        """ get the ring counters as a dictionary """
+        with self._lock:
+            frames = len(self._ring)
+            seconds = self._ring[-1][1] - self._ring[0][1] if frames > 1 else 0.0
+            return {'frames': frames, 'bytes': self.bytes, 'seconds': round(seconds, 2), 'frozen': self.frozen,
+                    'freezeReason': self.freezeReason}
+
+    def _fill(self):
+        """ append the camera frames to the ring """
+        camera = self.camera
+        seq = 0
+        while self._running:
+            camera.last_access = time.time()    # keep the camera running for replay
+            # the raw frames till the tracking thread runs are cached as raw frames
+            tracking = self.tracking and camera.is_tracking()
+            seq, img, skipped = camera.wait_stream_frame(seq, tracking, timeout=1)
+            if img is None:
+                continue
+            # the capture time of the frame from its trace (the frame may not be the latest on the bus any more)
+            timestamp = camera.tracer.captureTime(seq)
+            faces = None
+            latestSeq, value = (camera.trackingBus if tracking else camera.bus).latest()
+            if value is not None and latestSeq == seq:
+                if tracking:
+                    timestamp = value[1]
+                    faces = [{'id': fid, 'position': face.getPosition()} for fid, face in list(value[2].items())]
+                else:
+                    timestamp = value.timestamp
+            if timestamp is None:
+                # the frame is not traced any more, skip it rather than corrupt the time window of the ring
+                continue
+            with self._lock:
+                if self._freezeAt is not None and timestamp > self._freezeAt:
+                    continue
+            jpeg = self.jpegCache.encode(seq, img, tracking, self.quality)
+            if jpeg is None:
+                continue
+            with self._lock:
+                self._ring.append((seq, timestamp, jpeg, faces))
+                self.bytes += len(jpeg)
+                while self.bytes > self.maxBytes and len(self._ring) > 1:
+                    self.bytes -= len(self._ring.popleft()[2])
@@ -0,0 +1,48 @@
+import time
+import threading
+
+class StageStats(object):
+    """ frame rate and latency counters for one stage of the camera pipeline (capture, tracking, ...)
+    fps is measured over a sliding window of windowSeconds. latencies are in milliseconds.
+    """
+    def __init__(self, name, windowSeconds=2.0):
+        self.name = name
+        self.windowSeconds = windowSeconds
+        self.frames = 0             # total frames processed by the stage
+        self.fps = 0.0              # frames per second over the last window
+        self.lastLatency = 0.0      # latency of the last frame
+        self.avgLatency = 0.0       # exponential moving average of the latency
+        self.maxLatency = 0.0       # max latency since the last reset
+        self._windowStart = time.time()
+        self._windowFrames = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """ record a frame processed by the stage with latency in seconds """
+        latency *= 1000.0
+        now = time.time()
+        with self._lock:
+            self.frames += 1
+            self._windowFrames += 1
+            self.lastLatency = latency
+            self.avgLatency = latency if self.frames == 1 else self.avgLatency * 0.9 + latency * 0.1
+            if latency > self.maxLatency:
+                self.maxLatency = latency
+            elapsed = now - self._windowStart
+            if elapsed >= self.windowSeconds:
+                self.fps = self._windowFrames / elapsed
+                self._windowStart = now
+                self._windowFrames = 0
+
+    def reset(self):
+        """ reset the max latency and the fps window """
+        with self._lock:
+            self.maxLatency = 0.0
+            self._windowStart = time.time()
+            self._windowFrames = 0
+
+    def values(self):
+        """ get the counters as a dictionary """
+        with self._lock:
+            return {'frames': self.frames, 'fps': round(self.fps, 2), 'lastLatencyMs': round(self.lastLatency, 2),
+                    'avgLatencyMs': round(self.avgLatency, 2), 'maxLatencyMs': round(self.maxLatency, 2)}
@@ -0,0 +1,145 @@
+import numpy as np
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# cost of a detection/track pair that is not allowed to match
+InvalidCost = 1e6
+
+def boxArray(boxes):
+    """ convert a list of [x, y, w, h] boxes to a float array of shape (N, 4) """
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+def pairMatrices(boxesA, boxesB):
+    """ intersection over union of every box in boxesA (N, 4) with every box in boxesB (M, 4) and whether their centers are
+    inside each other - returns ((N, M) IoU, (N, M) bool). the corners are computed once for both in a few numpy calls.
+    """
+    ax1 = boxesA[:, 0:1]
+    ay1 = boxesA[:, 1:2]
+    aw = boxesA[:, 2:3]
+    ah = boxesA[:, 3:4]
+    ax2 = ax1 + aw
+    ay2 = ay1 + ah
+    bx1 = boxesB[:, 0]
+    by1 = boxesB[:, 1]
+    bw = boxesB[:, 2]
+    bh = boxesB[:, 3]
+    bx2 = bx1 + bw
+    by2 = by1 + bh
+    inter = np.maximum(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0) * np.maximum(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0)
+    union = aw * ah + bw * bh - inter
+    iou = np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+    acx = ax1 + 0.5 * aw
+    acy = ay1 + 0.5 * ah
+    bcx = bx1 + 0.5 * bw
+    bcy = by1 + 0.5 * bh
+    centers = ((bx1 <= acx) & (acx <= bx2) & (by1 <= acy) & (acy <= by2) &
+               (ax1 <= bcx) & (bcx <= ax2) & (ay1 <= bcy) & (bcy <= ay2))
+    return (iou, centers)
+
+def iouMatrix(boxesA, boxesB):
+    """ intersection over union of every box in boxesA (N, 4) with every box in boxesB (M, 4) - returns (N, M) """
+    return pairMatrices(boxesA, boxesB)[0]
+
+def centerMatchMatrix(boxesA, boxesB):
+    """ whether the center of each box in boxesA is inside each box in boxesB and vice versa - returns (N, M) bool """
+    return pairMatrices(boxesA, boxesB)[1]
+
+def linearAssignment(cost):
+    """ minimum cost assignment of rows to columns (Hungarian algorithm)
+    returns (rowIndices, colIndices). uses scipy when available.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # shortest augmenting path with potentials, the inner loop over columns is vectorized
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)      # p[j] - row (1 based) assigned to column j, 0 if none
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            update = free & (reduced < minv[1:])
+            minv[1:][update] = reduced[update]
+            way[1:][update] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            usedColumns = np.nonzero(used)[0]
+            u[p[usedColumns]] += delta
+            v[usedColumns] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    columns = np.nonzero(p[1:])[0]
+    rows = p[1:][columns] - 1
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return (rows[order], columns[order])
+
+def associate(detections, tracks, iouThreshold=0.3):
+    """ associate detected boxes with tracked boxes in one vectorized pass with optimal (one to one) assignment
+    detections - (N, 4) array of detected [x, y, w, h]
+    tracks - (M, 4) array of tracked [x, y, w, h]
+    iouThreshold - min IoU to match. pairs whose centers are inside each other also match.
+    returns (matches, unmatchedDetections, unmatchedTracks) - matches is a list of (detection index, track index)
+    """
+    n = len(detections)
+    m = len(tracks)
+    if n == 0 or m == 0:
+        return ([], list(range(n)), list(range(m)))
+    iou, centers = pairMatrices(detections, tracks)
+    valid = (iou >= iouThreshold) | centers
+    # a detection and a track that are the only candidates of each other match without the assignment solver
+    rowCounts = valid.sum(axis=1)
+    columnCounts = valid.sum(axis=0)
+    matchedRows = np.zeros(n, dtype=bool)
+    matchedColumns = np.zeros(m, dtype=bool)
+    if rowCounts.max() <= 1 and columnCounts.max() <= 1:
+        # no contested pairs (the common case), every valid pair is a match
+        rows, columns = np.nonzero(valid)
+        matches = list(zip(rows.tolist(), columns.tolist()))
+        matchedRows[rows] = True
+        matchedColumns[columns] = True
+    else:
+        unique = valid & (rowCounts[:, None] == 1) & (columnCounts[None, :] == 1)
+        rows, columns = np.nonzero(unique)
+        matches = list(zip(rows.tolist(), columns.tolist()))
+        matchedRows[rows] = True
+        matchedColumns[columns] = True
+        # solve the optimal assignment only for the contested detections and tracks
+        contestedRows = np.nonzero((rowCounts > 0) & ~matchedRows)[0]
+        contestedColumns = np.nonzero((columnCounts > 0) & ~matchedColumns)[0]
+        if len(contestedRows) > 0 and len(contestedColumns) > 0:
+            subValid = valid[np.ix_(contestedRows, contestedColumns)]
+            cost = np.where(subValid, 1.0 - iou[np.ix_(contestedRows, contestedColumns)], InvalidCost)
+            rows, columns = linearAssignment(cost)
+            for r, c in zip(rows.tolist(), columns.tolist()):
+                if subValid[r, c]:
+                    matches.append((int(contestedRows[r]), int(contestedColumns[c])))
+                    matchedRows[contestedRows[r]] = True
+                    matchedColumns[contestedColumns[c]] = True
+    return (matches, np.nonzero(~matchedRows)[0].tolist(), np.nonzero(~matchedColumns)[0].tolist())
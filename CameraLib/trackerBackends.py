@@ -0,0 +1,166 @@
+import cv2
+
+# the quality reported by the backends without a quality measure of their own (same as a freshly started FaceTrackingData)
+TrackedQuality = 10.0
+
+class TrackerBackend(object):
+    """ interface of the single face trackers FaceTrackingData delegates to
+    boxes are (left, top, right, bottom) in the coordinates of the tracking image. update() returns the tracking quality
+    on the scale of dlib's peak to side-lobe ratio that FaceTracker compares with trackQualityBar and trackQualityLowBar.
+    """
+    name = None
+    # whether the box moves only by the detections (correct()) instead of following the image
+    # True - FaceDetectorPool detections older than FaceTracker's staleDetectionFrames still correct() the track, moved
+    #        forward by their age (the track would not move otherwise)
+    # False - the tracker follows the image, such stale detections never correct() it
+    # (stale detections revive no lost face with either)
+    followsDetections = False
+
+    def start(self, image, box):
+        """ start tracking the face at box """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+    def update(self, image):
+        """ track the face in the next image, returns the tracking quality """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+    def position(self):
+        """ get the tracked box (left, top, right, bottom) """
+        raise RuntimeError('Must be implemented by subclasses.')
+
+    def correct(self, image, box, age=0):
+        """ a detection matched the face at box, backends that only follow detections move to it
+        age - number of frames since the frame the face was detected in (detections of a FaceDetectorPool)
+        """
+        pass
+
+class DlibTracker(TrackerBackend):
+    """ dlib's correlation_tracker - accurate with a quality measure, the most expensive per face """
+    name = 'dlib'
+
+    def __init__(self):
+        import dlib
+        self._dlib = dlib
+        self._tracker = dlib.correlation_tracker()
+
+    def start(self, image, box):
+        left, top, right, bottom = [int(v) for v in box]
+        self._tracker.start_track(image, self._dlib.rectangle(left, top, right, bottom))
+
+    def update(self, image):
+        return self._tracker.update(image)
+
+    def position(self):
+        position = self._tracker.get_position()
+        return (position.left(), position.top(), position.left() + position.width(), position.top() + position.height())
+
+class OpencvTracker(TrackerBackend):
+    """ opencv's single object trackers (MOSSE, KCF, CSRT and MIL), the quality is TrackedQuality while tracking and 0 when lost
+    MOSSE, KCF and CSRT need an opencv build with the contrib modules
+    """
+    # factory function names by backend name, the legacy module is checked first
+    Factories = {'mosse': 'TrackerMOSSE_create', 'kcf': 'TrackerKCF_create', 'csrt': 'TrackerCSRT_create', 'mil': 'TrackerMIL_create'}
+
+    def __init__(self, name):
+        factory = OpencvTracker.factory(name)
+        if factory is None:
+            raise ValueError('Tracker backend %s is not available in opencv %s' %(name, cv2.__version__))
+        self.name = name
+        self._factory = factory
+        self._tracker = None
+        self._box = (0, 0, 0, 0)
+
+    @staticmethod
+    def factory(name):
+        """ get the opencv function creating the named tracker, None if it is not available """
+        functionName = OpencvTracker.Factories.get(name, None)
+        if functionName is None:
+            return None
+        for module in (getattr(cv2, 'legacy', None), cv2):
+            if module is not None and hasattr(module, functionName):
+                return getattr(module, functionName)
+        return None
+
+    def start(self, image, box):
+        left, top, right, bottom = [int(v) for v in box]
+        left = max(0, left)
+        top = max(0, top)
+        right = min(image.shape[1], right)
+        bottom = min(image.shape[0], bottom)
+        self._tracker = self._factory()
+        self._tracker.init(image, (left, top, max(1, right - left), max(1, bottom - top)))
+        self._box = (left, top, right, bottom)
+
+    def update(self, image):
+        ok, (x, y, w, h) = self._tracker.update(image)
+        if not ok:
+            return 0.0
+        self._box = (x, y, x + w, y + h)
+        return TrackedQuality
+
+    def position(self):
+        return self._box
+
+class CentroidTracker(TrackerBackend):
+    """ detection only tracking - the box moves at the velocity of its center between the last two detections
+    nearly free per frame, the faces are kept or lost by the detections (FaceTracker's maxMisses)
+    """
+    name = 'centroid'
+    followsDetections = True
+
+    def __init__(self):
+        self._box = (0.0, 0.0, 0.0, 0.0)
+        self._velocity = (0.0, 0.0)
+        self._frames = 0        # frames since the last detection
+
+    def start(self, image, box):
+        self._box = tuple(float(v) for v in box)
+        self._velocity = (0.0, 0.0)
+        self._frames = 0
+
+    def update(self, image):
+        dx, dy = self._velocity
+        left, top, right, bottom = self._box
+        self._box = (left + dx, top + dy, right + dx, bottom + dy)
+        self._frames += 1
+        return TrackedQuality
+
+    def correct(self, image, box, age=0):
+        left, top, right, bottom = [float(v) for v in box]
+        # velocity from the detected center and the center of the last detection (the box minus the moves since)
+        # (kept when the detection is not newer than the last one, e.g. the track was started from an older detection)
+        oldLeft, oldTop, oldRight, oldBottom = self._box
+        frames = self._frames - age
+        if frames > 0:
+            oldX = (oldLeft + oldRight) / 2 - self._velocity[0] * self._frames
+            oldY = (oldTop + oldBottom) / 2 - self._velocity[1] * self._frames
+            self._velocity = (((left + right) / 2 - oldX) / frames, ((top + bottom) / 2 - oldY) / frames)
+        # a detection of an older frame is moved forward to the current frame
+        dx, dy = self._velocity[0] * age, self._velocity[1] * age
+        self._box = (left + dx, top + dy, right + dx, bottom + dy)
+        self._frames = age
+
+    def position(self):
+        return self._box
+
+def createTracker(name='dlib'):
+    """ create a tracker backend by name - dlib, mosse, kcf, csrt, mil or centroid """
+    if name == 'dlib':
+        return DlibTracker()
+    if name == 'centroid':
+        return CentroidTracker()
+    if name in OpencvTracker.Factories:
+        return OpencvTracker(name)
+    raise ValueError('Unknown tracker backend: %s' %str(name))
+
+def availableTrackers():
+    """ get the names of the tracker backends available in this installation """
+    names = []
+    try:
+        import dlib
+        names.append('dlib')
+    except ImportError:
+        pass
+    names.extend(name for name in ('mosse', 'kcf', 'csrt', 'mil') if OpencvTracker.factory(name) is not None)
+    names.append('centroid')
+    return names
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import queue
+import threading
+from IotLib.log import Log
+from . import metrics
+
+class VideoRecorder(object):
+    """ records the frames of a camera into time segmented mjpeg files in background threads
+    - the reader thread takes the frames of the camera, encodes them through the jpeg cache (shared with the streaming
+      clients so a streamed frame is not encoded twice, a camera jpeg is passed through) and puts the jpeg bytes into a
+      queue bounded by bytes without ever blocking, a frame is dropped when the queue is full (e.g. the SD card stalls)
+      so capture and live viewers are never delayed and the memory stays bounded
+    - the writer thread writes the queued frames to the current segment
+    each segment <prefix>_<yyyymmdd_HHMMSS>.mjpeg gets a sidecar <segment>.idx.jsonl with one line per frame:
+    {"seq": frame sequence number, "timestamp": capture time, "offset": byte offset, "size": bytes, "faces": [...]}
+    the segments can be played with cameraSimulated.Camera or split with MjpegReader.
+    """
+    def __init__(self, camera, directory, prefix='video', segmentSeconds=60, tracking=False, maxQueueBytes=4 * 1024 * 1024, quality=None,
+                 maxSegments=0, jpegCache=None):
+        """ construct a VideoRecorder
+        camera - the camera (derived from BaseCamera) to record
+        directory - the directory for the segment files
+        prefix - the prefix of the segment file names
+        segmentSeconds - the duration of each segment
+        tracking - whether to record the face tracking frames (with face data in the index) instead of the raw frames
+                   (the raw frames are recorded while the tracking thread does not run)
+        maxQueueBytes - max bytes of the jpeg frames waiting to be written
+        quality - jpeg quality or None for opencv's default
+        maxSegments - max number of segments to keep (the oldest are deleted), 0 to keep all
+        jpegCache - the JpegFrameCache shared with the streaming clients or None for the camera's jpegCache
+        """
+        self.camera = camera
+        self.directory = directory
+        self.prefix = prefix
+        self.segmentSeconds = segmentSeconds
+        self.tracking = tracking
+        self.quality = quality
+        self.maxSegments = maxSegments
+        self.jpegCache = jpegCache if jpegCache is not None else camera.jpegCache
+        self.recordedFrames = 0     # number of frames written
+        self.droppedFrames = 0      # number of frames dropped because the queue was full
+        self.skippedFrames = 0      # number of frames published by the camera that the reader never saw
+        self.segments = []          # file paths of the segments recorded
+        self.maxQueueBytes = maxQueueBytes
+        self.queuedBytes = 0        # bytes of the jpeg frames waiting to be written
+        self._queue = queue.Queue()
+        self._queueLock = threading.Lock()
+        self._running = False
+        self._subscription = None   # subscription to the recorded stream of the camera
+        self._readerThread = None
+        self._writerThread = None
+        self._droppedMetric = metrics.recorderDropped.labels(camera.name)
+        self._recordedMetric = metrics.recorderFrames.labels(camera.name)
+
+    def start(self):
+        """ start recording """
+        if self._running:
+            return
+        if self._readerThread is not None:
+            # clean up a recording ended by a writer failure
+            self.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        self._running = True
+        self._subscription = self.camera.streams.subscribe('tracked' if self.tracking else 'raw')
+        self.camera.start(self.camera.faceTracker)
+        self._writerThread = threading.Thread(target=self._writer, name='RecorderWriter-%s' %self.camera.name, daemon=True)
+        self._writerThread.start()
+        self._readerThread = threading.Thread(target=self._reader, name='RecorderReader-%s' %self.camera.name, daemon=True)
+        self._readerThread.start()
+        Log.info('Started recording %s to %s' %(self.camera.name, self.directory))
+
+    def stop(self):
+        """ stop recording, the queued frames are written before the writer thread ends """
+        if self._readerThread is None:
+            return
+        self._running = False
+        self._readerThread.join()
+        self._queue.put(None)
+        self._writerThread.join()
+        self._readerThread = None
+        self._writerThread = None
+        self._subscription.close()
+        self._subscription = None
+        # the frames left by a writer failure
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self.queuedBytes = 0
+        Log.info('Stopped recording %s: %s' %(self.camera.name, str(self.stats())))
+
+    def isRecording(self):
+        return self._running
+
+    def stats(self):
+        """ get the recorder counters as a dictionary """
+        return {'recordedFrames': self.recordedFrames, 'droppedFrames': self.droppedFrames, 'skippedFrames': self.skippedFrames,
+                'queuedFrames': self._queue.qsize(), 'queuedBytes': self.queuedBytes, 'segments': len(self.segments)}
+
+    def _reader(self):
+        """ take frames from the camera and queue them without blocking """
+        camera = self.camera
+        seq = 0
+        while self._running:
+            # the raw frames till the tracking thread runs are recorded (and cached) as raw frames
+            tracking = self.tracking and camera.is_tracking()
+            seq, img, skipped = camera.wait_stream_frame(seq, tracking, timeout=1)
+            if img is None:
+                # the camera stopped (e.g. idle before the recording started), restart it with its face tracker
+                camera.start(camera.faceTracker)
+                continue
+            self.skippedFrames += skipped
+            if self.queuedBytes >= self.maxQueueBytes:
+                # the writer is behind, drop the frame before spending the encode
+                self._drop()
+                continue
+            # the capture time of the frame from its trace (the frame may not be the latest on the bus any more)
+            timestamp = camera.tracer.captureTime(seq)
+            faces = None
+            latestSeq, value = (camera.trackingBus if tracking else camera.bus).latest()
+            if value is not None and latestSeq == seq:
+                if tracking:
+                    timestamp = value[1]
+                    faces = _facesData(value[2])
+                else:
+                    timestamp = value.timestamp
+            if timestamp is None:
+                # the frame is not traced any more, skip it rather than break the time order of the segments
+                continue
+            jpeg = self.jpegCache.encode(seq, img, tracking, self.quality)
+            if jpeg is None:
+                continue
+            item = (seq, timestamp, jpeg, faces)
+            with self._queueLock:
+                if self.queuedBytes + len(item[2]) > self.maxQueueBytes:
+                    item = None
+                else:
+                    self.queuedBytes += len(item[2])
+            if item is None:
+                self._drop()
+            else:
+                self._queue.put(item)
+
+    def _drop(self):
+        """ count a frame dropped because the queue is full """
+        self.droppedFrames += 1
+        self._droppedMetric.inc()
+
+    def _writer(self):
+        """ write the queued frames into segments """
+        segmentFile = None
+        indexFile = None
+        segmentStart = 0
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                seq, timestamp, jpeg, faces = item
+                with self._queueLock:
+                    self.queuedBytes -= len(jpeg)
+                if segmentFile is None or timestamp - segmentStart >= self.segmentSeconds:
+                    if segmentFile is not None:
+                        segmentFile.close()
+                        indexFile.close()
+                    segmentStart = timestamp
+                    segmentFile, indexFile = self._newSegment(timestamp)
+                offset = segmentFile.tell()
+                segmentFile.write(jpeg)
+                index = {'seq': seq, 'timestamp': timestamp, 'offset': offset, 'size': len(jpeg)}
+                if faces is not None:
+                    index['faces'] = faces
+                indexFile.write(json.dumps(index) + '\n')
+                self.recordedFrames += 1
+                self._recordedMetric.inc()
+        except Exception as e:
+            Log.error('Exception in VideoRecorder %s: %s' %(self.camera.name, str(e)))
+            # stop the reader and release the recorded stream (e.g. face tracking) till stop() cleans up
+            self._running = False
+            self._subscription.close()
+        finally:
+            if segmentFile is not None:
+                segmentFile.close()
+                indexFile.close()
+
+    def _newSegment(self, timestamp):
+        """ open the files of a new segment and delete the oldest segments beyond maxSegments """
+        name = '%s_%s' %(self.prefix, time.strftime('%Y%m%d_%H%M%S', time.localtime(timestamp)))
+        path = os.path.join(self.directory, name + '.mjpeg')
+        count = 1
+        while os.path.exists(path):
+            count += 1
+            path = os.path.join(self.directory, '%s_%i.mjpeg' %(name, count))
+        self.segments.append(path)
+        while self.maxSegments > 0 and len(self.segments) > self.maxSegments:
+            oldPath = self.segments.pop(0)
+            for oldFile in (oldPath, oldPath + '.idx.jsonl'):
+                try:
+                    os.remove(oldFile)
+                except OSError:
+                    pass
+        Log.info('Recording segment %s' %path)
+        return (open(path, 'wb'), open(path + '.idx.jsonl', 'w', encoding='utf-8'))
+
+def _facesData(trackingData):
+    """ the face id, position and quality of the tracked faces as a list of dictionaries """
+    faces = []
+    for fid, face in list((trackingData or {}).items()):
+        try:
+            faces.append({'id': fid, 'position': face.getPosition(), 'quality': float(face.quality)})
+        except Exception:
+            pass
+    return faces
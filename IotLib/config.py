@@ -49,11 +49,10 @@ class Config(object):
     def getOrAddBool(self, key, defaultValue):
         """ get the bool setting by key, add a new key with defaultValue if no key """
         value = self.settings.get(key, None)
-        if value != None:
-            val = value.lower()
-            return val == '1' or val == 'true' or val == 'yes'
-        else:
-            return self.set(key, defaultValue)
+        if value == None:
+            value = self.set(key, defaultValue)
+        val = str(value).lower()
+        return val == '1' or val == 'true' or val == 'yes'
 
     def getOrAddInt(self, key, defaultValue):
         """ get the integer setting by key, add a new key with defaultValue if no key """
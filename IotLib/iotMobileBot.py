@@ -1,3 +1,4 @@
+import time
 import traceback
 from time import sleep
 from .pyUtils import startThread
@@ -62,6 +63,8 @@ class IotMobileBot(IotNode):
         self.camera = camera
         self.head = head
         self.distanceChecker = True
+        self.recorder = None        # VideoRecorder recording the camera during wander runs
+        self._trackingSubscription = None   # subscription to the tracked stream of the camera in face tracking mode
         self._stopDistance = self.config.getOrAddFloat('distanceChecker.stopDistance', 0.2)       # the distance to stop
         self._slowDistance = self.config.getOrAddFloat('distanceChecker.slowdownDistance', 1.0)       # the distance to stop forward movement
 
@@ -197,6 +200,7 @@ class IotMobileBot(IotNode):
                             Log.info('checkDistance - Emergency Stop drive at distance: %f' %distance)
                             self.drive.emergencyStop()
                             self.drive.extraSpeed(0)
+                            self._freezeReplay('emergency stop at distance %f' %distance)
                         elif distance < stopDistance:
                             Log.info('checkDistance - Stopping drive at distance: %f' %distance)
                             self.drive.stop()
@@ -244,8 +248,13 @@ class IotMobileBot(IotNode):
             self._wanderDelay = int(self.config.getOrAddFloat('wander.stateDelayInSecond', 2.0) / 0.2)
             self._wanderDelayCounter = self._wanderDelay
             self.distanceChecker = True    # make sure distance scan worker thread to stop before hitting obstacle
+            self._startRecording()
         elif mode == IotMobileBot.FaceTrackingMode:
             self._faceId = -1       # valid face ID should be >= 0
+            if self.camera is not None and self.camera.faceTracker is not None:
+                # face tracking runs only while the tracked stream is subscribed
+                self._trackingSubscription = self.camera.streams.subscribe('tracked')
+                self.camera.start(self.camera.faceTracker)
 
     def _stopMode(self, mode):
         """ initialization of the mode - will be called only when switching off the mode """
@@ -259,8 +268,40 @@ class IotMobileBot(IotNode):
             self.stop()
         elif mode == IotMobileBot.AutoWanderMode:
             self.stop()
+            self._stopRecording()
         elif mode == IotMobileBot.FaceTrackingMode:
-            pass
+            if self._trackingSubscription is not None:
+                self._trackingSubscription.close()
+                self._trackingSubscription = None
+
+    def _freezeReplay(self, reason):
+        """ freeze the instant replay of the camera to keep the video leading to the event """
+        replay = getattr(self.camera, 'replay', None) if self.camera is not None else None
+        if replay is not None:
+            replay.freeze(reason, postSeconds=self.config.getOrAddFloat('replay.postSeconds', 1.0))
+
+    def _startRecording(self):
+        """ start recording the camera if recorder.recordWander is enabled """
+        if self.camera is None or not self.config.getOrAddBool('recorder.recordWander', 'false'):
+            return
+        try:
+            if self.recorder is None:
+                from CameraLib.videoRecorder import VideoRecorder
+                directory = self.config.getOrAdd('recorder.directory', '/home/pi/recordings')
+                segmentSeconds = self.config.getOrAddInt('recorder.segmentSeconds', 60)
+                maxSegments = self.config.getOrAddInt('recorder.maxSegments', 30)
+                tracking = self.config.getOrAddBool('recorder.tracking', 'true')
+                self.recorder = VideoRecorder(self.camera, directory, prefix='wander', segmentSeconds=segmentSeconds,
+                                              tracking=tracking, maxSegments=maxSegments)
+            self.camera.start(self.camera.faceTracker)
+            self.recorder.start()
+        except Exception as e:
+            Log.error('Exception starting recorder: ' + str(e))
+
+    def _stopRecording(self):
+        """ stop recording the camera """
+        if self.recorder is not None:
+            self.recorder.stop()
 
     def _modeWorker(self, interval=0.2):
         """ internal thread for handling bot's operation modes """
@@ -443,8 +484,13 @@ class IotMobileBot(IotNode):
         if self.camera is None:
             return
         faceTracker = self.camera.faceTracker
-        trackedFaces = faceTracker.getTrackedFaces()
-        if len(trackedFaces) == 0:
+        if faceTracker is None:
+            return
+        self.camera.last_access = time.time()   # keep the camera running while tracking without streaming clients
+        # use the snapshot of the face positions published with the latest tracked frame (the values do not change
+        # with the frames tracked after it)
+        trackedFaces = self.camera.current_trackingdata()
+        if trackedFaces is None or len(trackedFaces) == 0:
             if self._faceId < 0:
                 # todo: searching faces by looking left/right
                 pass
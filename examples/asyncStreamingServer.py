@@ -0,0 +1,296 @@
+import json
+import time
+import asyncio
+import concurrent.futures
+from urllib.parse import parse_qs
+from CameraLib.frameCache import variantParams
+from CameraLib.cameraManager import CameraManager
+from CameraLib import metrics
+from IotLib.log import Log
+
+class _CameraFeed(object):
+    """ streaming state of one camera: the clients, the broadcaster task and the thread blocked on the camera """
+    def __init__(self, name, camera, tracker, jpegCache):
+        self.name = name
+        self.camera = camera
+        self.tracker = tracker
+        self.jpegCache = jpegCache
+        self.clients = set()        # set of _ClientStream, one per streaming client
+        self.broadcaster = None     # task reading frames from camera
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # the only thread blocked on the camera
+        self.seq = 0                # sequence number of the last frame read from the camera
+        self.tracked = False        # whether the last frame read is the face tracking frame
+        self.framesSent = metrics.streamFrames.labels(name)
+        self.bytesSent = metrics.streamBytes.labels(name)
+        self.framesSkipped = metrics.streamSkipped.labels(name)
+        self.clientCount = metrics.streamClients.labels(name)
+
+class _ClientStream(object):
+    """ the frame queue and stream variant of one streaming client """
+    def __init__(self, queueSize, quality=None, scale=1.0, maxFps=None):
+        self.queue = asyncio.Queue(maxsize=queueSize)
+        self.quality = quality
+        self.scale = scale
+        self.interval = 1.0 / maxFps if maxFps else 0
+        self.nextTime = 0           # time the client is due for its next frame
+
+    def variant(self):
+        return (self.quality, self.scale)
+
+class AsyncMjpegServer(object):
+    """ asyncio based mjpeg streaming server that serves all clients from one event loop
+    routes:
+    /                       - simple html page showing the video feeds
+    /video_feed             - mjpeg stream (multipart/x-mixed-replace) of the first camera
+    /video_feed/<name>      - mjpeg stream of the named camera
+    /snapshot.jpg           - the latest encoded frame of the first camera
+    /snapshot/<name>.jpg    - the latest encoded frame of the named camera
+    /pipeline_stats         - per-stage fps and latency counters per camera (json)
+    /metrics                - camera pipeline metrics in prometheus text format
+    /latency                - per-stage and end to end latency percentiles per camera (json), ?frames=N adds the last frames
+    the feeds and snapshots take query parameters quality (1 - 100, rounded to 10), scale (0.1 - 1.0, rounded to 0.25) and fps (max frames per second).
+    each frame is read from the camera once, each variant requested by the clients due for a frame is resized and
+    encoded once, then fanned out to a bounded queue per client.
+    a client that cannot keep up loses its oldest queued frames so it never holds back the other clients.
+    """
+    def __init__(self, camera, tracker=None, jpegCaches=None, queueSize=2, host='0.0.0.0', port=8000):
+        """ construct an AsyncMjpegServer
+        camera - a camera instance that is derived from baseCamera.BaseCamera or a CameraManager
+        tracker - face tracking object (FaceTracker) or None for a single camera
+        jpegCaches - dictionary of JpegFrameCache by camera name shared with other servers or None
+        queueSize - max number of frames queued for each client
+        """
+        if not isinstance(camera, CameraManager):
+            cameras = CameraManager()
+            cameras.add('default', camera, tracker)
+            camera = cameras
+        self.cameras = camera
+        self.jpegCaches = jpegCaches if jpegCaches is not None else {}
+        self.queueSize = queueSize
+        self.host = host
+        self.port = port
+        self.droppedFrames = 0      # total frames dropped for slow clients
+        self._feeds = {}
+        for name, cam in self.cameras:
+            cache = self.jpegCaches.setdefault(name, cam.jpegCache)
+            self._feeds[name] = _CameraFeed(name, cam, self.cameras.faceTracker(name), cache)
+        self._defaultFeed = self._feeds[self.cameras.names()[0]]
+        self._server = None
+
+    def run(self):
+        """ run the server till it is stopped. Should be called from a dedicated thread. """
+        Log.info('starting async video streaming on port %d' %self.port)
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """ coroutine that starts the server and serves forever """
+        self._server = await asyncio.start_server(self._handleClient, self.host, self.port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def clientCount(self):
+        """ number of clients streaming video """
+        return sum(len(feed.clients) for feed in self._feeds.values())
+
+    def _getFeed(self, path, prefix, suffix=''):
+        """ get the camera feed for path /<prefix>/<name><suffix>, None if no such camera """
+        name = path[len(prefix) + 1:]
+        if suffix:
+            if not name.endswith(suffix):
+                return None
+            name = name[:-len(suffix)]
+        return self._feeds.get(name, None)
+
+    async def _handleClient(self, reader, writer):
+        """ handle one http connection """
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            parts = request.split(b'\r\n', 1)[0].split()
+            target = parts[1].decode('ascii', 'replace').split('?', 1) if len(parts) > 1 else ['/']
+            path = target[0]
+            query = dict((key, values[0]) for key, values in parse_qs(target[1]).items()) if len(target) > 1 else {}
+            feed = None
+            if path == '/video_feed' or path == '/snapshot.jpg':
+                feed = self._defaultFeed
+            elif path.startswith('/video_feed/'):
+                feed = self._getFeed(path, '/video_feed')
+            elif path.startswith('/snapshot/'):
+                feed = self._getFeed(path, '/snapshot', '.jpg')
+
+            variant = None
+            if feed is not None:
+                try:
+                    variant = variantParams(query)
+                except ValueError:
+                    await self._sendResponse(writer, b'400 Bad Request', b'text/plain', b'Bad Request')
+                    return
+
+            if feed is not None and path.startswith('/video_feed'):
+                await self._streamVideo(feed, reader, writer, variant)
+            elif feed is not None:
+                seq, frame = await asyncio.get_running_loop().run_in_executor(None, self._snapshot, feed, variant[0], variant[1])
+                if frame is None:
+                    await self._sendResponse(writer, b'503 Service Unavailable', b'text/plain', b'No camera frame')
+                else:
+                    await self._sendResponse(writer, b'200 OK', b'image/jpeg', frame, _timestampHeader(feed.camera.tracer.captureTime(seq)))
+            elif path == '/metrics':
+                await self._sendResponse(writer, b'200 OK', b'text/plain; version=0.0.4', metrics.registry.exposition().encode('utf-8'))
+            elif path == '/latency':
+                frames = int(query.get('frames', 0) or 0)
+                result = {}
+                for name, camera in self.cameras:
+                    result[name] = {'percentiles': camera.tracer.percentiles()}
+                    if frames > 0:
+                        result[name]['frames'] = camera.tracer.traces(frames)
+                await self._sendResponse(writer, b'200 OK', b'application/json', json.dumps(result).encode('utf-8'))
+            elif path == '/pipeline_stats':
+                stats = dict((name, camera.stage_stats()) for name, camera in self.cameras)
+                await self._sendResponse(writer, b'200 OK', b'application/json', json.dumps(stats).encode('utf-8'))
+            elif path == '/':
+                images = ''
+                for name, camera in self.cameras:
+                    width, height = camera.resolution()
+                    images += '<img src="/video_feed/%s" width="%i" height="%i"> ' %(name, width, height)
+                html = '<html>  <head> <title>Video Streaming</title> </head> <body> %s</body></html>' %(images)
+                await self._sendResponse(writer, b'200 OK', b'text/html', html.encode('utf-8'))
+            else:
+                await self._sendResponse(writer, b'404 Not Found', b'text/plain', b'Not Found')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            Log.error('Exception in AsyncMjpegServer: %s' %str(e))
+        finally:
+            writer.close()
+
+    async def _sendResponse(self, writer, status, contentType, body, headers=b''):
+        """ send a complete http response
+        headers - additional header lines each ending with \\r\\n
+        """
+        writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + contentType +
+                     b'\r\nContent-Length: ' + str(len(body)).encode('ascii') + b'\r\nConnection: close\r\n' + headers + b'\r\n')
+        writer.write(body)
+        await writer.drain()
+
+    async def _streamVideo(self, feed, reader, writer, variant):
+        """ stream mjpeg of the camera feed to a client till the client disconnects
+        variant - (quality, scale, maxFps) of the stream
+        """
+        client = _ClientStream(self.queueSize, *variant)
+        queue = client.queue
+        feed.clients.add(client)
+        feed.clientCount.inc()
+        if feed.broadcaster is None or feed.broadcaster.done():
+            feed.broadcaster = asyncio.ensure_future(self._broadcast(feed))
+        # keep the transport buffer small so a slow client is detected by drain() instead of buffering frames
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        # the client never sends anything after the request so a completed read means it has gone away
+        disconnected = asyncio.ensure_future(reader.read(1))
+        Log.info('video client connected to %s (%i clients)' %(feed.name, len(feed.clients)))
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                         b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+            while True:
+                nextFrame = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait((nextFrame, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    nextFrame.cancel()
+                    break
+                seq, frame = nextFrame.result()
+                # the capture time lets client side tools measure the display latency
+                header = _timestampHeader(feed.camera.tracer.sent(seq))
+                writer.write(b'--frame\r\nContent-Type: image/jpeg\r\n' + header + b'\r\n' + frame + b'\r\n')
+                await writer.drain()
+                feed.framesSent.inc()
+                feed.bytesSent.inc(len(frame))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            disconnected.cancel()
+            feed.clients.discard(client)
+            feed.clientCount.inc(-1)
+            Log.info('video client disconnected from %s (%i clients)' %(feed.name, len(feed.clients)))
+
+    async def _broadcast(self, feed):
+        """ read frames from the camera, encode the variants of the clients due for a frame and fan them out """
+        loop = asyncio.get_running_loop()
+        # face tracking runs only while the tracked stream has subscribers
+        subscription = feed.camera.streams.subscribe('tracked' if feed.tracker != None else 'raw')
+        try:
+            await loop.run_in_executor(feed.executor, feed.camera.start, feed.tracker)
+            await self._broadcastFrames(feed, loop)
+        finally:
+            subscription.close()
+
+    async def _broadcastFrames(self, feed, loop):
+        """ the broadcast loop running while the feed has clients """
+        while len(feed.clients) > 0:
+            try:
+                seq, img = await loop.run_in_executor(feed.executor, self._nextFrame, feed)
+                if img is None:
+                    continue
+                now = time.time()
+                # clients limited by fps skip the frames in between, a variant no client is due for is never encoded
+                clients = [client for client in feed.clients if client.nextTime <= now]
+                if len(clients) == 0:
+                    continue
+                variants = set(client.variant() for client in clients)
+                frames = await loop.run_in_executor(feed.executor, self._encodeVariants, feed, seq, img, variants)
+            except Exception as e:
+                Log.error('Exception reading camera %s frame: %s' %(feed.name, str(e)))
+                await asyncio.sleep(0.1)
+                continue
+            for client in clients:
+                frame = frames.get(client.variant(), None)
+                if frame is None:
+                    continue
+                client.nextTime = max(client.nextTime + client.interval, now)
+                if client.queue.full():
+                    # drop the oldest frame for the slow client
+                    client.queue.get_nowait()
+                    self.droppedFrames += 1
+                    feed.framesSkipped.inc()
+                client.queue.put_nowait((seq, frame))
+
+    def _nextFrame(self, feed):
+        """ wait for the next camera frame and return (seq, frame), frame is None if there is no frame within a second
+        (runs in the executor thread of the feed)
+        """
+        # the raw frames till the tracking thread runs are cached as raw frames
+        feed.tracked = feed.tracker != None and feed.camera.is_tracking()
+        seq, img, skipped = feed.camera.wait_stream_frame(feed.seq, feed.tracked, timeout=1)
+        if img is None:
+            # the camera thread stopped (e.g. idle or failed), restart it and retry with the next frame
+            feed.camera.start(feed.tracker)
+            return (feed.seq, None)
+        feed.seq = seq
+        feed.framesSkipped.inc(skipped)
+        return (seq, img)
+
+    def _encodeVariants(self, feed, seq, img, variants):
+        """ encode the frame for each (quality, scale) variant, returns dictionary of jpeg bytes by variant """
+        return dict((variant, feed.jpegCache.encode(seq, img, feed.tracked, variant[0], variant[1])) for variant in variants)
+
+    def _snapshot(self, feed, quality=None, scale=1.0):
+        """ get the latest encoded frame as (seq, jpeg bytes), encode the current frame only if it is not encoded yet
+        the jpeg bytes are None if the camera has no frame within 10 seconds
+        """
+        try:
+            feed.camera.start(feed.tracker).result(timeout=10)    # a fresh frame when resuming from standby
+        except concurrent.futures.TimeoutError:
+            return (0, None)
+        # the tracked frame while the feed streams it, the raw frame otherwise
+        tracking = feed.tracker != None and feed.camera.is_tracking()
+        seq = feed.camera.current_seq(tracking)
+        latest = feed.jpegCache.latest(tracking, quality, scale)
+        if latest is not None and latest[0] == seq:
+            return latest
+        seq, img, skipped = feed.camera.wait_stream_frame(0, tracking, timeout=10)
+        if img is None:
+            return (seq, None)
+        return (seq, feed.jpegCache.encode(seq, img, tracking, quality, scale))
+
+def _timestampHeader(captureTime):
+    """ the X-Capture-Timestamp header line, empty if the capture time is unknown """
+    if captureTime is None:
+        return b''
+    return ('X-Capture-Timestamp: %.6f\r\n' %captureTime).encode('ascii')
@@ -0,0 +1,60 @@
+# benchmark of detection-to-track association with synthetic face boxes
+# compares the vectorized IoU + optimal assignment (trackAssociation.associate) with the nested python loop
+# usage: python benchAssociation.py [maxFaces] [repeats]
+
+import sys
+import time
+import numpy as np
+from CameraLib.trackAssociation import boxArray, associate
+
+def syntheticBoxes(count, rng, width=1280, height=720, size=60):
+    """ non-overlapping face boxes on a grid with random jitter """
+    columns = width // (size * 2)
+    boxes = []
+    for i in range(count):
+        x = (i % columns) * size * 2 + rng.integers(0, size // 2)
+        y = (i // columns) * size * 2 + rng.integers(0, size // 2)
+        boxes.append((int(x), int(y), size, size))
+    return boxes
+
+def nestedLoop(faces, tracks):
+    """ the original association - every face against every track in python """
+    matched = []
+    for (x, y, w, h) in faces:
+        x_center = x + 0.5 * w
+        y_center = y + 0.5 * h
+        matchedFid = None
+        for fid in range(len(tracks)):
+            t_x, t_y, t_w, t_h = list(tracks[fid])
+            t_x_center = t_x + 0.5 * t_w
+            t_y_center = t_y + 0.5 * t_h
+            if ((t_x <= x_center <= (t_x + t_w)) and
+                (t_y <= y_center <= (t_y + t_h)) and
+                (x <= t_x_center <= (x + w)) and
+                (y <= t_y_center <= (y + h))):
+                matchedFid = fid
+        matched.append(matchedFid)
+    return matched
+
+def timeIt(function, repeats):
+    start = time.perf_counter()
+    for i in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+if __name__ == '__main__':
+    maxFaces = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.default_rng(0)
+    print('%6s %14s %14s %8s' %('faces', 'vectorized us', 'nested us', 'matched'))
+    for count in [1, 2, 5, 10, 20, 30, 40, 50]:
+        if count > maxFaces:
+            break
+        tracks = syntheticBoxes(count, rng)
+        # detections are the tracks moved a few pixels in random order
+        faces = [(x + int(rng.integers(-4, 5)), y + int(rng.integers(-4, 5)), w, h) for (x, y, w, h) in tracks]
+        rng.shuffle(faces)
+        vectorized = timeIt(lambda: associate(boxArray(faces), boxArray(tracks)), repeats)
+        nested = timeIt(lambda: nestedLoop(faces, tracks), repeats)
+        matches = associate(boxArray(faces), boxArray(tracks))[0]
+        print('%6i %14.1f %14.1f %8i' %(count, vectorized, nested, len(matches)))
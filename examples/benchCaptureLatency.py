@@ -0,0 +1,59 @@
+# glass-to-glass latency of the opencv camera's read and latest capture modes with simulated slow consumers
+# the video file is played as a sensor in real time with a driver queue, so the age of a frame when the consumer gets it
+# is the latency a camera would have
+# usage: python benchCaptureLatency.py [source] [seconds] [consumerMs] [bufferSize]
+# source - a video file or synthetic (default) for a video file of synthetic frames written to the temp directory
+# consumerMs - comma separated processing times of the consumer per frame, default 0,50,150
+
+import os
+import sys
+import time
+import tempfile
+import cv2
+from CameraLib import cameraOpencv, cameraSimulated
+
+def writeSyntheticVideo(path, width=640, height=480, fps=30, seconds=5):
+    """ write the frames of the synthetic simulated camera to a MJPG avi file """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    frames = cameraSimulated.Camera(width=width, height=height, fps=0).frames()
+    for i in range(fps * seconds):
+        writer.write(next(frames))
+    frames.close()
+    writer.release()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if len(values) > 0 else 0.0
+
+def measure(source, captureMode, consumerMs, seconds, bufferSize):
+    """ consume the frames of the camera for seconds, returns (frames, ages in ms, grabbed frames) """
+    camera = cameraOpencv.Camera(width=640, height=480, source=source, captureMode=captureMode, bufferSize=bufferSize)
+    camera.name = captureMode
+    frames = camera.frames()
+    ages = []
+    end = time.time() + seconds
+    while time.time() < end:
+        frame = next(frames)
+        ages.append((time.time() - frame.timestamp) * 1000.0)
+        frame.bgr()
+        time.sleep(consumerMs / 1000.0)     # the slow consumer (e.g. face tracking)
+    frames.close()
+    return (len(ages), ages, camera.grabbedFrames)
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != 'synthetic' else None
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    consumerTimes = [float(v) for v in sys.argv[3].split(',')] if len(sys.argv) > 3 else [0, 50, 150]
+    bufferSize = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    if source is None:
+        source = os.path.join(tempfile.gettempdir(), 'benchCaptureLatency.avi')
+        if not os.path.exists(source):
+            writeSyntheticVideo(source)
+
+    print('source: %s driver buffers: %i duration: %.1fs' %(source, bufferSize, seconds))
+    print('mode    consumer ms  frames  grabbed  age avg ms  p50 ms  p95 ms  max ms')
+    for consumerMs in consumerTimes:
+        for captureMode in (cameraOpencv.Camera.CaptureRead, cameraOpencv.Camera.CaptureLatest):
+            count, ages, grabbed = measure(source, captureMode, consumerMs, seconds, bufferSize)
+            print('%-7s %11.0f %7i %8i %11.1f %7.1f %7.1f %7.1f' %(captureMode, consumerMs, count, grabbed,
+                  sum(ages) / max(1, count), percentile(ages, 50), percentile(ages, 95), max(ages) if ages else 0.0))
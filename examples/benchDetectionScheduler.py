@@ -0,0 +1,63 @@
+# benchmark of the fixed face detection cadence (framesForDetection) against the adaptive detection scheduler
+# reports the cost per frame, the detections run and the tracking coverage and face ID switches against the known
+# positions of the synthetic faces
+# usage: python benchDetectionScheduler.py [frames] [faces] [budgetMs] [backend] [width] [height]
+# budgetMs - comma separated per-frame budgets of the adaptive rows, default 0 (no budget),20,10
+
+import sys
+import time
+import cv2
+from CameraLib import cameraSimulated
+from CameraLib.faceTracking import FaceTracker
+from CameraLib.detectionScheduler import DetectionScheduler
+from CameraLib.trackerBackends import availableTrackers
+from benchTrackers import idSwitches
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if len(values) > 0 else 0.0
+
+def benchSchedule(scheduler, backend, frameCount, faces, width, height, classifierPath):
+    """ track frameCount synthetic frames with the scheduler (None for the fixed cadence), returns the counters as a dictionary """
+    camera = cameraSimulated.Camera(width=width, height=height, fps=0, faces=faces, seed=faces)
+    frames = camera.frames()
+    tracker = FaceTracker(cv2.CascadeClassifier(classifierPath), name='bench-%s' %str(id(scheduler)), trackerBackend=backend,
+                          detectionScheduler=scheduler)
+    frameMs = []
+    assigned = {}
+    switches = 0
+    matched = 0
+    truthFaces = 0
+    for i in range(frameCount):
+        img = next(frames)
+        startTime = time.perf_counter()
+        tracker.track(img)
+        frameMs.append((time.perf_counter() - startTime) * 1000.0)
+        frameSwitches, frameMatched = idSwitches(tracker, camera.groundTruth, assigned)
+        switches += frameSwitches
+        matched += frameMatched
+        truthFaces += len(camera.groundTruth)
+    frames.close()
+    tracker.close()
+    return {'avgMs': sum(frameMs) / frameCount, 'p95Ms': percentile(frameMs, 95), 'maxMs': max(frameMs),
+            'detections': tracker.detectStats.values()['frames'], 'idSwitches': switches,
+            'coverage': matched / float(truthFaces) if truthFaces > 0 else 0.0}
+
+if __name__ == '__main__':
+    frameCount = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    faces = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    budgets = [float(v) for v in sys.argv[3].split(',')] if len(sys.argv) > 3 else [0, 20, 10]
+    backend = sys.argv[4] if len(sys.argv) > 4 else availableTrackers()[0]
+    width = int(sys.argv[5]) if len(sys.argv) > 5 else 640
+    height = int(sys.argv[6]) if len(sys.argv) > 6 else 480
+    classifierPath = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+    print('backend: %s %ix%i frames: %i faces: %i' %(backend, width, height, frameCount, faces))
+    print('schedule          avg ms  p95 ms  max ms  detections  ID switches  coverage  decisions')
+    rows = [('fixed 10', None)] + [('adaptive %s' %('%gms' %budget if budget > 0 else ''), DetectionScheduler(budgetMs=budget))
+                                   for budget in budgets]
+    for label, scheduler in rows:
+        result = benchSchedule(scheduler, backend, frameCount, faces, width, height, classifierPath)
+        print('%-16s %7.2f %7.2f %7.2f %11i %12i %8.1f%%  %s' %(label, result['avgMs'], result['p95Ms'], result['maxMs'],
+              result['detections'], result['idSwitches'], 100.0 * result['coverage'],
+              str(scheduler.decisions) if scheduler is not None else ''))
@@ -0,0 +1,96 @@
+# end to end benchmark of the capture -> track -> encode -> stream path with a simulated camera (no hardware needed)
+# usage: python benchPipeline.py [source] [width] [height] [fps] [seconds] [clients] [tracking] [motion] [backend]
+# source - synthetic (default), a video file, a mjpeg file or a directory of images
+# fps - frame rate of the camera, 0 for as fast as possible
+# tracking - 1 to run face tracking with opencv's haar cascade, 0 to stream raw frames
+# motion - 1 to skip detection and tracking on static frames (a directory with one image is a static scene)
+# backend - the tracker backend (dlib, mosse, kcf, csrt, mil or centroid), default the first available
+
+import sys
+import time
+import threading
+import cv2
+from CameraLib import cameraSimulated, faceTracking, metrics
+from CameraLib.frameCache import JpegFrameCache
+from CameraLib.motionDetector import MotionDetector
+from CameraLib.trackerBackends import availableTrackers
+
+def streamClient(camera, cache, tracking, end, stats, index):
+    """ a streaming client reading and encoding frames like the flask gen() """
+    seq = 0
+    frames = 0
+    skippedFrames = 0
+    while time.time() < end:
+        tracked = tracking and camera.is_tracking()
+        seq, img, skipped = camera.wait_stream_frame(seq, tracked, timeout=1)
+        if img is None:
+            continue
+        cache.encode(seq, img, tracked)
+        frames += 1
+        skippedFrames += skipped
+    stats[index] = (frames, skippedFrames)
+
+def createFaceTracker(motion=False, backend=None):
+    """ create a FaceTracker with opencv's frontal face cascade, None if the tracker backend is not available """
+    classifierPath = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+    motionDetector = MotionDetector() if motion else None
+    try:
+        return faceTracking.FaceTracker(cv2.CascadeClassifier(classifierPath), name='bench', motionDetector=motionDetector,
+                                        trackerBackend=backend or availableTrackers()[0])
+    except (ValueError, ImportError) as e:
+        print('face tracking disabled: %s' %str(e))
+        return None
+
+def histogramMs(metric, label):
+    """ average in milliseconds of a histogram from the metrics registry """
+    value = metric.labels(label)
+    return value.sum / value.count * 1000.0 if value.count > 0 else 0.0
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 640
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 480
+    fps = int(sys.argv[4]) if len(sys.argv) > 4 else 30
+    seconds = float(sys.argv[5]) if len(sys.argv) > 5 else 10
+    clients = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+    tracking = (sys.argv[7] == '1') if len(sys.argv) > 7 else False
+    motion = (sys.argv[8] == '1') if len(sys.argv) > 8 else False
+    backend = sys.argv[9] if len(sys.argv) > 9 else None
+
+    camera = cameraSimulated.Camera(width=width, height=height, source=source, fps=fps)
+    camera.name = 'bench'
+    faceTracker = createFaceTracker(motion, backend) if tracking else None
+    tracking = faceTracker is not None
+    cache = JpegFrameCache(name='bench')
+    subscription = camera.streams.subscribe('tracked' if tracking else 'raw')
+    camera.start(faceTracker)
+
+    cpuBefore = time.process_time()
+    end = time.time() + seconds
+    stats = [(0, 0)] * clients
+    threads = [threading.Thread(target=streamClient, args=(camera, cache, tracking, end, stats, i)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu = time.process_time() - cpuBefore
+
+    stageStats = camera.stage_stats()
+    print('source: %s %ix%i camera fps: %s tracking: %s clients: %i duration: %.1fs' %(source, width, height,
+          str(fps) if fps > 0 else 'max', str(tracking), clients, seconds))
+    print('end to end fps per client: %.1f (skipped %.1f/s)' %(sum(s[0] for s in stats) / clients / seconds,
+                                                             sum(s[1] for s in stats) / clients / seconds))
+    print('capture: %.1f fps, %.2f ms per frame' %(stageStats['capture']['fps'], histogramMs(metrics.captureInterval, 'bench')))
+    if tracking:
+        print('tracking: %.1f fps, capture to tracked latency avg %.2f ms max %.2f ms' %(stageStats['tracking']['fps'],
+              stageStats['tracking']['avgLatencyMs'], stageStats['tracking']['maxLatencyMs']))
+        print('detect: %.2f ms track: %.2f ms faces: %s' %(histogramMs(metrics.detectSeconds, 'bench'),
+              histogramMs(metrics.trackSeconds, 'bench'), str(faceTracker.costPerFrame()['trackedFaces'])))
+        motionStats = faceTracker.motionStats()
+        if motionStats is not None:
+            print('motion gating: skipped %i frames (%.1f%%), cpu saved %.1f ms, motion check %.2f ms per frame' %(
+                  motionStats['skippedFrames'], 100.0 * motionStats['skipRatio'], motionStats['savedCpuMs'],
+                  motionStats['detector']['cost']['avgLatencyMs']))
+    print('encode: %.2f ms per frame, cache %s' %(histogramMs(metrics.encodeSeconds, 'bench'), str(cache.stats())))
+    print('process cpu: %.1f%%' %(100.0 * cpu / seconds))
+    camera.last_access = 0      # let the camera thread stop
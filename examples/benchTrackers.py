@@ -0,0 +1,86 @@
+# benchmark of the FaceTracker tracker backends over the frames of a simulated camera source
+# reports the per-frame cost of tracking and the face ID switches to choose a backend for each deployment
+# usage: python benchTrackers.py [source] [frames] [backends] [width] [height]
+# source - synthetic (default, ID switches are counted against the known face positions), a video file, a mjpeg file
+#          or a directory of images (only the number of face IDs created is reported)
+# backends - comma separated tracker backends (dlib, mosse, kcf, csrt, mil, centroid), default all available
+
+import sys
+import time
+import cv2
+from CameraLib import cameraSimulated, metrics
+from CameraLib.cameraFrame import CameraFrame
+from CameraLib.faceTracking import FaceTracker
+from CameraLib.trackAssociation import boxArray, associate
+from CameraLib.trackerBackends import availableTrackers
+
+def idSwitches(tracker, groundTruth, assigned):
+    """ match the tracked faces with the ground truth boxes, count the ground truth faces followed by a different face ID
+    assigned - dictionary of the last face ID by ground truth index, updated in place
+    returns (switches, matched ground truth faces)
+    """
+    fids = list(tracker.getTrackedFaces().keys())
+    boxes = [tracker.getTrackedFaces()[fid].getPosition() for fid in fids]
+    matches, unmatchedTruth, unmatchedTracks = associate(boxArray(groundTruth), boxArray(boxes), 0.2)
+    switches = 0
+    for g, t in matches:
+        previous = assigned.get(g, None)
+        if previous is not None and previous != fids[t]:
+            switches += 1
+        assigned[g] = fids[t]
+    return (switches, len(matches))
+
+def benchBackend(backend, source, frameCount, width, height, classifierPath):
+    """ track frameCount frames with the backend, returns the counters as a dictionary """
+    camera = cameraSimulated.Camera(width=width, height=height, source=source, fps=0)
+    frames = camera.frames()
+    name = 'bench-' + backend
+    tracker = FaceTracker(cv2.CascadeClassifier(classifierPath), name=name, trackerBackend=backend)
+    synthetic = source == 'synthetic'
+    assigned = {}
+    switches = 0
+    matched = 0
+    truthFaces = 0
+    seconds = 0.0
+    for i in range(frameCount):
+        img = next(frames)
+        if isinstance(img, CameraFrame):
+            img = img.bgr()
+        startTime = time.perf_counter()
+        tracker.track(img)
+        seconds += time.perf_counter() - startTime
+        if synthetic:
+            frameSwitches, frameMatched = idSwitches(tracker, camera.groundTruth, assigned)
+            switches += frameSwitches
+            matched += frameMatched
+            truthFaces += len(camera.groundTruth)
+    frames.close()
+    trackValue = metrics.trackSeconds.labels(name)
+    result = {'frameMs': seconds / frameCount * 1000.0,
+              'trackMs': trackValue.sum / trackValue.count * 1000.0 if trackValue.count > 0 else 0.0,
+              'faceIds': tracker.nextFaceID}
+    if synthetic:
+        result['idSwitches'] = switches
+        result['coverage'] = matched / float(truthFaces) if truthFaces > 0 else 0.0
+    return result
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    frameCount = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    backends = sys.argv[3].split(',') if len(sys.argv) > 3 else availableTrackers()
+    width = int(sys.argv[4]) if len(sys.argv) > 4 else 640
+    height = int(sys.argv[5]) if len(sys.argv) > 5 else 480
+    classifierPath = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+    print('source: %s %ix%i frames: %i' %(source, width, height, frameCount))
+    for backend in backends:
+        try:
+            result = benchBackend(backend, source, frameCount, width, height, classifierPath)
+        except (ValueError, ImportError) as e:
+            print('%-8s skipped: %s' %(backend, str(e)))
+            continue
+        line = '%-8s %7.2f ms per frame (tracker updates %6.3f ms) face IDs: %3i' %(backend, result['frameMs'],
+                                                                                     result['trackMs'], result['faceIds'])
+        if 'idSwitches' in result:
+            line += ' ID switches: %3i coverage: %5.1f%%' %(result['idSwitches'], 100.0 * result['coverage'])
+        print(line)
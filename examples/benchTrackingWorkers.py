@@ -0,0 +1,58 @@
+# benchmark of concurrent face tracker updates - tracked frame latency by number of faces and tracking workers
+# faces are 'detected' at their known positions in synthetic frames so every row tracks the same faces
+# usage: python benchTrackingWorkers.py [backend] [frames] [maxFaces] [maxWorkers] [width] [height]
+# backend - the tracker backend (dlib, mosse, kcf, csrt, mil or centroid), default the first available
+
+import sys
+import time
+from CameraLib import cameraSimulated, metrics
+from CameraLib.faceTracking import FaceTracker
+from CameraLib.trackerBackends import availableTrackers
+
+class GroundTruthDetector(object):
+    """ stands in for the cascade classifier, detects the synthetic faces at their known positions """
+    def __init__(self, camera):
+        self.camera = camera
+
+    def detectMultiScale(self, img, scaleFactor, minNeighbors):
+        return list(self.camera.groundTruth)
+
+def benchFaces(backend, faces, workers, frameCount, width, height):
+    """ track frameCount synthetic frames with faces, returns (avg track ms, avg tracked frame ms, tracked faces) """
+    camera = cameraSimulated.Camera(width=width, height=height, fps=0, faces=faces, seed=faces)
+    frames = camera.frames()
+    name = 'bench-%i-%i' %(faces, workers)
+    tracker = FaceTracker(GroundTruthDetector(camera), name=name, trackerBackend=backend, trackingWorkers=workers, confirmHits=1)
+    tracker.track(next(frames))     # start the trackers
+    seconds = 0.0
+    trackedFaces = 0
+    for i in range(frameCount):
+        img = next(frames)
+        startTime = time.perf_counter()
+        tracker.track(img)
+        seconds += time.perf_counter() - startTime
+        trackedFaces += len(tracker.getTrackedFaces())
+    frames.close()
+    tracker.close()
+    trackValue = metrics.trackSeconds.labels(name)
+    trackMs = trackValue.sum / trackValue.count * 1000.0 if trackValue.count > 0 else 0.0
+    return (trackMs, seconds / frameCount * 1000.0, trackedFaces / float(frameCount))
+
+if __name__ == '__main__':
+    backend = sys.argv[1] if len(sys.argv) > 1 else availableTrackers()[0]
+    frameCount = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    maxFaces = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    maxWorkers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    width = int(sys.argv[5]) if len(sys.argv) > 5 else 1280
+    height = int(sys.argv[6]) if len(sys.argv) > 6 else 720
+
+    workerCounts = [w for w in (1, 2, 4, 8, 16) if w <= maxWorkers]
+    faceCounts = [f for f in (1, 2, 4, 8, 16) if f <= maxFaces]
+    print('backend: %s %ix%i frames: %i - tracker update ms per frame (tracked frame ms) by workers' %(backend, width, height, frameCount))
+    print('faces  ' + ''.join('%20s' %('%i workers' %w) for w in workerCounts))
+    for faces in faceCounts:
+        line = '%5i  ' %faces
+        for workers in workerCounts:
+            trackMs, frameMs, tracked = benchFaces(backend, faces, workers, frameCount, width, height)
+            line += '%20s' %('%.2f (%.2f)' %(trackMs, frameMs))
+        print(line + '  tracked faces: %.1f' %tracked)
@@ -0,0 +1,130 @@
+# load test for the asyncio mjpeg server using local loopback clients
+# usage: python streamLoadTest.py [clients] [seconds] [slowClients] [cameras] [bgr|mjpeg] [query]
+# query - stream variant of every other client, e.g. "quality=50&scale=0.5&fps=10"
+# seconds - at least 10 (default 15) with slow clients, the server's socket send buffer takes a few seconds of frames
+#           of a slow client before its frames are dropped
+# mjpeg plays the pattern from a mjpeg file with passthrough (no decode and re-encode) instead of generating bgr frames
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import asyncio
+import resource
+import threading
+import numpy as np
+import cv2
+from CameraLib.baseCamera import BaseCamera
+from CameraLib.cameraManager import CameraManager
+from CameraLib import cameraOpencv
+from CameraLib.mjpegReader import writeMjpeg
+from asyncStreamingServer import AsyncMjpegServer
+
+class PatternCamera(BaseCamera):
+    """ camera that generates a moving pattern at a fixed frame rate """
+    def __init__(self, width=640, height=480, crosshair=False, fps=30):
+        super(PatternCamera, self).__init__(width, height, crosshair=crosshair)
+        self.fps = fps
+
+    def frames(self):
+        img = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        img[:, :, 1] = np.arange(self.width, dtype=np.uint32).astype(np.uint8)
+        interval = 1.0 / self.fps
+        while True:
+            time.sleep(interval)
+            img = np.roll(img, 4, axis=1)
+            yield img
+
+def patternMjpegFile(width, height, count=60):
+    """ write the frames of PatternCamera to a temporary mjpeg file """
+    frames = PatternCamera(width, height, fps=1000).frames()
+    path = os.path.join(tempfile.gettempdir(), 'pattern_%ix%i.mjpeg' %(width, height))
+    writeMjpeg(path, (cv2.imencode('.jpg', next(frames))[1].tobytes() for i in range(count)))
+    return path
+
+async def client(port, path, stats, index, seconds, slow):
+    """ a loopback client counting received frames, a slow client sleeps between reads
+    a slow client has a small receive buffer so the loopback socket buffers fill within a second instead of holding
+    megabytes of frames, the server then drops its frames like it does for a client on a slow network
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if slow:
+        # before connect so the small tcp window is advertised from the start
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SlowClientBufferBytes)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    writer.write(b'GET ' + path.encode('ascii') + b' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    await writer.drain()
+    end = time.time() + seconds
+    frames = 0
+    try:
+        while time.time() < end:
+            chunk = await asyncio.wait_for(reader.read(65536), timeout=5)
+            if not chunk:
+                break
+            frames += chunk.count(b'--frame')
+            if slow:
+                await asyncio.sleep(0.5)
+    except asyncio.TimeoutError:
+        pass
+    writer.close()
+    stats[index] = frames
+
+async def runClients(port, names, clients, seconds, slowClients, query=''):
+    stats = [0] * clients
+    paths = ['/video_feed/' + names[i % len(names)] for i in range(clients)]
+    if query:
+        paths = [path + '?' + query if i % 2 == 1 else path for i, path in enumerate(paths)]
+    await asyncio.gather(*[client(port, paths[i], stats, i, seconds, i < slowClients) for i in range(clients)])
+    return stats
+
+# receive buffer of the slow clients
+SlowClientBufferBytes = 4096
+
+def maxRssMB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 15
+    slowClients = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    cameraCount = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    captureFormat = sys.argv[5] if len(sys.argv) > 5 else 'bgr'
+    query = sys.argv[6] if len(sys.argv) > 6 else ''
+    port = 8765
+
+    cameras = CameraManager()
+    mjpegFile = patternMjpegFile(640, 480) if captureFormat == 'mjpeg' else None
+    for i in range(cameraCount):
+        if mjpegFile:
+            cameras.add('cam%i' %i, cameraOpencv.Camera(width=640, height=480, source=mjpegFile, captureFormat='mjpeg', fps=30))
+        else:
+            cameras.add('cam%i' %i, PatternCamera(width=640, height=480))
+    server = AsyncMjpegServer(cameras, port=port)
+    threading.Thread(target=server.run, daemon=True).start()
+    time.sleep(0.5)
+
+    rssBefore = maxRssMB()
+    cpuBefore = time.process_time()
+    stats = asyncio.run(runClients(port, cameras.names(), clients, seconds, slowClients, query))
+    cpu = time.process_time() - cpuBefore
+
+    fast = stats[slowClients:]
+    if query:
+        variant = [stats[i] for i in range(slowClients, clients) if i % 2 == 1]
+        fast = [stats[i] for i in range(slowClients, clients) if i % 2 == 0]
+        if len(variant) > 0:
+            print('fps per %s client: %.1f' %(query, sum(variant) / len(variant) / seconds))
+    print('cameras: %i (%s) clients: %i (slow: %i) duration: %.1fs' %(cameraCount, captureFormat, clients, slowClients, seconds))
+    if len(fast) > 0:
+        print('fps per client: min %.1f avg %.1f max %.1f' %(min(fast) / seconds, sum(fast) / len(fast) / seconds, max(fast) / seconds))
+    if slowClients > 0:
+        print('fps per slow client: %.1f' %(sum(stats[:slowClients]) / slowClients / seconds))
+    print('frames dropped for slow clients: %i' %server.droppedFrames)
+    # a slow client must lose its frames rather than hold back the other clients
+    assert slowClients == 0 or server.droppedFrames > 0, 'no frames dropped for the slow clients in %.1fs' %seconds
+    for name, cache in server.jpegCaches.items():
+        print('jpeg cache %s: %s' %(name, str(cache.stats())))
+    print('process cpu: %.1f%% max rss: %.1f MB -> %.1f MB' %(100.0 * cpu / seconds, rssBefore, maxRssMB()))
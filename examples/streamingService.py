@@ -1,5 +1,12 @@
+import time
 import cv2
-from CameraLib import baseCamera, faceTracking
+from CameraLib import baseCamera, faceTracking, metrics
+from CameraLib.frameCache import JpegFrameCache, variantParams
+from CameraLib.cameraManager import CameraManager
+from CameraLib.replayBuffer import ReplayBuffer
+from CameraLib.motionDetector import MotionDetector
+from CameraLib.changeFilter import FrameSignatures, ChangeFilter
+from CameraLib.detectionScheduler import DetectionScheduler
 from IotLib.log import Log
 from IotLib.iotNode import IotNode
 from IotLib.pyUtils import startThread
@@ -19,90 +26,383 @@ def startVideoStreamAsync(camera, config, debug=False):
     videoThread=startThread('VideoStream', target=streamer.runVideoStreaming, front=True, args=(port,))
 
 class VideoStream(IotNode):
-    """ video streaming with optional face tracking """
+    """ video streaming with optional face tracking for one camera or all cameras of a CameraManager """
     def __init__(self, name, parent, camera, config, debug=False):
-        """ construct a PiCamera """
+        """ construct a VideoStream
+        camera - a camera derived from BaseCamera or a CameraManager with multiple cameras
+        """
         super(VideoStream, self).__init__(name, parent)
-        self.camera = camera
+        self.cameras = _toCameraManager(camera)
+        self.camera = self.cameras.get()
         self.config = config
         self.debug = debug
 
     def startUp(self):
         """ override to start the components """
-        width, height = self.camera.resolution()
         # update index.html with proper width and height
         try:
             indexHtmlFile = self.config.getOrAdd('video.indexHtml', '/home/pi/src/VideoLib/templates/index.html')
             with open(indexHtmlFile, "w", encoding="utf-8") as f:
-                url = "{{ url_for('video_feed') }}"
-                html='<html>  <head> <title>Video Streaming</title> </head> <body> <img src="%s" width="%i" height="%i"> </body></html>' %(url, width, height)
+                images = ''
+                for cameraName, camera in self.cameras:
+                    width, height = camera.resolution()
+                    if len(self.cameras) == 1:
+                        url = "{{ url_for('video_feed') }}"
+                    else:
+                        url = "{{ url_for('camera_feed', name='%s') }}" %cameraName
+                    images += '<img src="%s" width="%i" height="%i"> ' %(url, width, height)
+                html='<html>  <head> <title>Video Streaming</title> </head> <body> %s</body></html>' %(images)
                 f.writelines('%s\n' %(html))
         except:
             pass
         self.faceTracker = None
         enableFaceTracking = self.config.getOrAddBool('video.enableFaceTracking', 'true')
-        if enableFaceTracking:
-            filePath = self.config.getOrAdd('video.classifier', '/home/pi/src/data/haarcascade_frontalface_alt.xml')
-            self.classifier = cv2.CascadeClassifier(filePath)
-            #self.classifier = cv2.CascadeClassifier('/home/pi/adeept_picar-b/server/data/haarcascade_frontalface_alt.xml')
-            self.faceTracker = faceTracking.FaceTracker(self.classifier, debug=self.debug)
-            Log.info('Streaming camera (%i x %i) with classifier: %s' %(width, height, filePath))
+        overlayStamp = self.config.getOrAddBool('video.overlayStamp', 'false')
+        global _skipUnchanged
+        if self.config.getOrAddBool('video.skipUnchanged', 'false'):
+            # skip the frames that did not change since the last frame sent to the client (e.g. a parked bot)
+            _skipUnchanged = (self.config.getOrAddFloat('video.unchangedThreshold', 0.001),
+                              self.config.getOrAddInt('video.unchangedPixelThreshold', 8),
+                              self.config.getOrAddFloat('video.keepAliveSeconds', 1.0))
         else:
-            self.faceTracker = None
-            Log.info('Streaming camera (%i x %i)' %(width, height))
+            _skipUnchanged = None
+        for cameraName, camera in self.cameras:
+            width, height = camera.resolution()
+            camera.overlay.setEnabled('stamp', overlayStamp)
+            replayMB = self.config.getOrAddFloat('video.replayMB', 0)
+            if replayMB > 0 and camera.replay is None:
+                # keep the last frames in memory for /replay/<name>.avi, frozen by emergency stops
+                camera.replay = ReplayBuffer(camera, maxBytes=int(replayMB * 1024 * 1024), tracking=enableFaceTracking,
+                                             jpegCache=_jpegCaches.setdefault(cameraName, camera.jpegCache))
+            if enableFaceTracking:
+                filePath = self.config.getOrAdd('video.classifier', '/home/pi/src/data/haarcascade_frontalface_alt.xml')
+                self.classifier = cv2.CascadeClassifier(filePath)
+                #self.classifier = cv2.CascadeClassifier('/home/pi/adeept_picar-b/server/data/haarcascade_frontalface_alt.xml')
+                detectorPool = None
+                detectionWorkers = self.config.getOrAddInt('video.detectionWorkers', 0)
+                if detectionWorkers > 0:
+                    from CameraLib.faceDetectorPool import FaceDetectorPool
+                    detectorPool = FaceDetectorPool(filePath, workers=detectionWorkers)
+                detectionScale = self.config.getOrAddFloat('video.detectionScale', 1.0)
+                trackingScale = self.config.getOrAddFloat('video.trackingScale', 1.0)
+                roiDetection = self.config.getOrAddBool('video.roiDetection', 'false')
+                motionDetector = None
+                if self.config.getOrAddBool('video.motionGating', 'false'):
+                    # skip detection and tracking while the scene is static (e.g. parked facing a wall)
+                    motionDetector = MotionDetector(threshold=self.config.getOrAddInt('video.motionThreshold', 15),
+                                                    minMotionRatio=self.config.getOrAddFloat('video.motionMinRatio', 0.002))
+                trackerBackend = self.config.getOrAdd('video.trackerBackend', 'dlib')
+                trackingWorkers = self.config.getOrAddInt('video.trackingWorkers', 1)
+                detectionScheduler = None
+                if self.config.getOrAddBool('video.adaptiveDetection', 'false'):
+                    # detect more often while searching or with weak tracks, less with healthy tracks, within a time budget
+                    detectionScheduler = DetectionScheduler(searchInterval=self.config.getOrAddInt('video.detectionSearchInterval', 3),
+                                                            weakInterval=self.config.getOrAddInt('video.detectionWeakInterval', 2),
+                                                            healthyInterval=self.config.getOrAddInt('video.detectionHealthyInterval', 10),
+                                                            maxInterval=self.config.getOrAddInt('video.detectionMaxInterval', 30),
+                                                            budgetMs=self.config.getOrAddFloat('video.detectionBudgetMs', 0),
+                                                            name=cameraName)
+                faceTracker = faceTracking.FaceTracker(self.classifier, debug=self.debug, detectorPool=detectorPool,
+                                                       detectionScale=detectionScale, trackingScale=trackingScale, roiDetection=roiDetection,
+                                                       name=cameraName, motionDetector=motionDetector, trackerBackend=trackerBackend,
+                                                       trackingWorkers=trackingWorkers, detectionScheduler=detectionScheduler)
+                self.cameras.setFaceTracker(cameraName, faceTracker)
+                Log.info('Streaming camera %s (%i x %i) with classifier: %s' %(cameraName, width, height, filePath))
+            else:
+                self.cameras.setFaceTracker(cameraName, None)
+                Log.info('Streaming camera %s (%i x %i)' %(cameraName, width, height))
+        self.faceTracker = self.cameras.faceTracker(self.camera.name)
+        for cameraName, camera in self.cameras:
+            if camera.replay is not None:
+                camera.start(self.cameras.faceTracker(cameraName))
+                camera.replay.start()
 
     def runVideoStreaming(self, port):
-        """ run video streaming (flask app) as a web. Should be called from a dedicated thread. """
+        """ run video streaming as a web (flask app or asyncio server per video.serverMode). Should be called from a dedicated thread. """
+        serverMode = self.config.getOrAdd('video.serverMode', 'flask')
+        if serverMode == 'asyncio':
+            self.runAsyncVideoStreaming(port)
+            return
         Log.info('starting httpVideoStreaming on port %d' %port)
-        runVideoStreaming(port, self.camera, tracker=self.faceTracker, debug=self.debug, threaded=True)
+        runVideoStreaming(port, self.cameras, debug=self.debug, threaded=True)
 
-from flask import Flask, render_template, Response
+    def runAsyncVideoStreaming(self, port):
+        """ run video streaming with the asyncio server serving all clients from one event loop. Should be called from a dedicated thread. """
+        from asyncStreamingServer import AsyncMjpegServer
+        queueSize = self.config.getOrAddInt('video.clientQueueSize', 2)
+        server = AsyncMjpegServer(self.cameras, jpegCaches=_jpegCaches, queueSize=queueSize, port=port)
+        server.run()
+
+def _toCameraManager(camera, tracker=None):
+    """ wrap a single camera into a CameraManager """
+    if isinstance(camera, CameraManager):
+        return camera
+    cameras = CameraManager()
+    cameras.add('default', camera, tracker)
+    return cameras
+
+from flask import Flask, render_template, Response, jsonify, abort, request
 
 _app = Flask(__name__)
 
-# the camera object (derived from BaseCamera) for video capture
-_streamingCamera = None
-# face tracking object (FaceTracker)
-_faceTracker = None
+# the cameras (CameraManager) for video capture
+_cameras = CameraManager()
+# encoded jpeg frames shared by all clients, key: camera name, value: JpegFrameCache
+_jpegCaches = {}
+# frame signatures shared by all clients, key: camera name (/stream), value: FrameSignatures
+_signatures = {}
+# (threshold, pixelThreshold, keepAliveSeconds) of the ChangeFilter of each client, None to send every frame
+_skipUnchanged = None
 
 def runVideoStreaming(port, camera, classifier=None, tracker=None, debug=False, threaded=True):
     """ run video streaming (flask app) as a web. calling parameters:
     port: the port number for the http web
-    camera: a camera instance that is derived from baseCamera.BaseCamera
-    classifier: face tracking with FaceTracker using the specified classifier
-    tracker: face tracking object (FaceTracker or instance of derived class)
+    camera: a camera instance that is derived from baseCamera.BaseCamera or a CameraManager
+    classifier: face tracking with FaceTracker using the specified classifier (single camera)
+    tracker: face tracking object (FaceTracker or instance of derived class) (single camera)
     debug: whether to run the flask app under debug
     threaded: whether to run flask app threaded
     """
-    global _streamingCamera, _faceTracker
-    _streamingCamera = camera
-    if tracker != None:
-        _faceTracker = tracker
-    elif classifier != None:
-        _faceTracker = FaceTracker(classifier, debug=debug)
+    global _cameras
+    if tracker == None and classifier != None:
+        tracker = faceTracking.FaceTracker(classifier, debug=debug)
+    _cameras = _toCameraManager(camera, tracker)
     _app.run(host='0.0.0.0', port=port, debug=debug, threaded=threaded, use_reloader=False)
 
+def _jpegCache(name, stream=None):
+    """ get the JpegFrameCache for the named camera (its jpegCache shared with the recorder) or one of its derived streams """
+    key = name if stream is None else '%s/%s' %(name, stream)
+    cache = _jpegCaches.get(key, None)
+    if cache is None:
+        camera = _cameras.get(name) if stream is None else None
+        cache = _jpegCaches.setdefault(key, camera.jpegCache if camera is not None else JpegFrameCache(name=name))
+    return cache
+
+def _frameSignatures(name, stream=None):
+    """ get the FrameSignatures for the named camera or one of its derived streams """
+    key = name if stream is None else '%s/%s' %(name, stream)
+    signatures = _signatures.get(key, None)
+    if signatures is None:
+        signatures = _signatures.setdefault(key, FrameSignatures())
+    return signatures
+
+def _timestampHeader(captureTime):
+    """ the X-Capture-Timestamp header line of a multipart frame, empty if the capture time is unknown """
+    if captureTime is None:
+        return b''
+    return ('X-Capture-Timestamp: %.6f\r\n' %captureTime).encode('ascii')
+
+def _variant():
+    """ get the stream variant (quality, scale, maxFps) from the query parameters or abort with 400 """
+    try:
+        return variantParams(request.args)
+    except ValueError:
+        abort(400)
+
+def _getCamera(name):
+    """ get the named camera (first camera if name is None) or abort with 404 """
+    camera = _cameras.get(name)
+    if camera is None:
+        abort(404)
+    return camera
+
 @_app.route('/')
 def index():
     """Video streaming home page."""
     return render_template('index.html')
 
-def gen(camera):
-    """Video streaming generator function."""
-    while True:
-        tracking = _faceTracker != None # and opencv_mode != 0
-        img = camera.get_frame(tracking)
+def gen(camera, tracker, quality=None, scale=1.0, maxFps=None, stream=None):
+    """Video streaming generator function.
+    quality, scale - the jpeg quality and scale of the stream variant
+    maxFps - max frames per second sent to the client, None for the camera's frame rate
+    stream - the stream of the camera (raw, tracked, gray, thumbnail or faceCrop), None for tracked with a face tracker or raw
+    the stream is subscribed while the client is connected so it is only computed while somebody watches it
+    """
+    if stream is None:
+        stream = 'tracked' if tracker != None else 'raw'
+    tracking = stream == 'tracked'
+    node = camera.streams.get(stream) if stream not in ('raw', 'tracked') else None
+    cache = _jpegCache(camera.name, None if node is None else stream)
+    changeFilter = None
+    if _skipUnchanged is not None:
+        threshold, pixelThreshold, keepAliveSeconds = _skipUnchanged
+        changeFilter = ChangeFilter(_frameSignatures(camera.name, None if node is None else stream), threshold=threshold,
+                                    pixelThreshold=pixelThreshold, keepAliveSeconds=keepAliveSeconds)
+    tracer = camera.tracer
+    framesSent = metrics.streamFrames.labels(camera.name)
+    bytesSent = metrics.streamBytes.labels(camera.name)
+    framesSkipped = metrics.streamSkipped.labels(camera.name)
+    framesUnchanged = metrics.streamUnchanged.labels(camera.name)
+    framesKeepAlive = metrics.streamKeepAlive.labels(camera.name)
+    clients = metrics.streamClients.labels(camera.name)
+    clients.inc()
+    subscription = camera.streams.subscribe(stream)
+    seq = 0
+    nextTime = 0
+    try:
+        while True:
+            if maxFps:
+                # wait for the next interval, the frames in between are skipped without encode
+                delay = nextTime - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                nextTime = max(nextTime + 1.0 / maxFps, time.time())
+            # the tracked stream gets raw frames till the tracking thread runs, cache them as raw frames
+            tracked = tracking and camera.is_tracking()
+            if node is None:
+                seq, img, skipped = camera.wait_stream_frame(seq, tracked)
+            else:
+                seq, img, skipped = node.wait_frame(seq)
+            framesSkipped.inc(skipped)
+            if changeFilter is not None:
+                # skip the frame before encoding it if it looks the same as the last frame sent to this client
+                change = changeFilter.check(seq, img)
+                if change == ChangeFilter.Unchanged:
+                    framesUnchanged.inc()
+                    continue
+                if change == ChangeFilter.KeepAlive:
+                    framesKeepAlive.inc()
 
-        # encode as a jpeg image and return it
-        frame = cv2.imencode('.jpg', img)[1].tobytes()
+            # encode the variant as a jpeg image (once per frame for all clients, passthrough for mjpeg cameras) and return it
+            frame = cache.encode(seq, img, tracked, quality, scale)
+            if frame is None:
+                continue
 
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            framesSent.inc()
+            bytesSent.inc(len(frame))
+            # the capture time lets client side tools measure the display latency
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n' + _timestampHeader(tracer.sent(seq)) + b'\r\n' + frame + b'\r\n')
+    finally:
+        subscription.close()
+        clients.inc(-1)
 
 @_app.route('/video_feed')
 def video_feed():
-    """ Video streaming route. """
-    _streamingCamera.start(_faceTracker)
-    return Response(gen(_streamingCamera), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """ Video streaming route for the first camera. """
+    return camera_feed(None)
+
+@_app.route('/video_feed/<name>')
+def camera_feed(name):
+    """ Video streaming route for the named camera.
+    query parameters: quality (jpeg quality 1 - 100, rounded to 10), scale (0.1 - 1.0, rounded to 0.25) and fps (max frames per second)
+    e.g. /video_feed?quality=50&scale=0.5&fps=10 for a phone on wifi
+    """
+    camera = _getCamera(name)
+    quality, scale, maxFps = _variant()
+    tracker = _cameras.faceTracker(camera.name)
+    camera.start(tracker)
+    return Response(gen(camera, tracker, quality, scale, maxFps), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@_app.route('/stream/<stream>')
+def stream_feed(stream):
+    """ Video streaming route for a stream of the first camera. """
+    return camera_stream(None, stream)
+
+@_app.route('/stream/<name>/<stream>')
+def camera_stream(name, stream):
+    """ Video streaming route for a stream of the named camera - raw, tracked, gray, thumbnail or faceCrop
+    query parameters: quality, scale and fps as for the video feed
+    """
+    camera = _getCamera(name)
+    if camera.streams.get(stream) is None:
+        abort(404)
+    quality, scale, maxFps = _variant()
+    tracker = _cameras.faceTracker(camera.name)
+    camera.start(tracker)
+    return Response(gen(camera, tracker, quality, scale, maxFps, stream), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@_app.route('/snapshot.jpg')
+def snapshot():
+    """ return the latest encoded frame of the first camera. """
+    return camera_snapshot(None)
+
+@_app.route('/snapshot/<name>.jpg')
+def camera_snapshot(name):
+    """ return the latest encoded frame. encode the current frame only if it is not encoded yet (no client is streaming).
+    query parameters: quality and scale as for the video feed
+    """
+    camera = _getCamera(name)
+    quality, scale, maxFps = _variant()
+    tracker = _cameras.faceTracker(camera.name)
+    cache = _jpegCache(camera.name)
+    camera.start(tracker).result(timeout=10)    # a fresh frame when resuming from standby
+    # the tracked frame while a client streams it, the raw frame otherwise
+    tracking = tracker != None and camera.is_tracking()
+    seq = camera.current_seq(tracking)
+    latest = cache.latest(tracking, quality, scale)
+    if latest is not None and latest[0] == seq:
+        frame = latest[1]
+    else:
+        seq, img, skipped = camera.wait_stream_frame(0, tracking)
+        frame = cache.encode(seq, img, tracking, quality, scale)
+    captureTime = camera.tracer.captureTime(seq)
+    headers = {'X-Capture-Timestamp': '%.6f' %captureTime} if captureTime is not None else None
+    return Response(frame, mimetype='image/jpeg', headers=headers)
+
+@_app.route('/cache_stats')
+def cache_stats():
+    """ return the jpeg cache hit/miss counters per camera """
+    return jsonify(dict((name, cache.stats()) for name, cache in list(_jpegCaches.items())))
+
+@_app.route('/unchanged_stats')
+def unchanged_stats():
+    """ return the counters of the frames skipped as unchanged per camera (video.skipUnchanged) """
+    return jsonify(dict((name, signatures.values()) for name, signatures in list(_signatures.items())))
 
+@_app.route('/replay.<format>')
+def replay(format):
+    """ download the instant replay of the first camera """
+    return camera_replay(None, format)
+
+@_app.route('/replay/<name>.<format>')
+def camera_replay(name, format):
+    """ download the instant replay of the named camera as avi (MJPG), mjpeg or json (frame metadata)
+    query parameter: seconds - only the last seconds of the replay
+    """
+    camera = _getCamera(name)
+    if camera.replay is None or format not in ('avi', 'mjpeg', 'json'):
+        abort(404)
+    seconds = request.args.get('seconds', None, type=float)
+    if format == 'json':
+        return jsonify({'stats': camera.replay.stats(), 'frames': camera.replay.metadata(seconds)})
+    clip = camera.replay.clip(format, seconds)
+    if clip is None:
+        abort(404)
+    mimetype = 'video/x-msvideo' if format == 'avi' else 'video/x-motion-jpeg'
+    return Response(clip, mimetype=mimetype, headers={'Content-Disposition': 'attachment; filename=replay_%s.%s' %(camera.name, format)})
+
+@_app.route('/replay/<name>/<action>', methods=['GET', 'POST'])
+def camera_replay_action(name, action):
+    """ freeze or unfreeze the instant replay of the named camera """
+    camera = _getCamera(name)
+    if camera.replay is None or action not in ('freeze', 'unfreeze'):
+        abort(404)
+    if action == 'freeze':
+        camera.replay.freeze(request.args.get('reason', 'api'), postSeconds=request.args.get('postSeconds', 0, type=float))
+    else:
+        camera.replay.unfreeze()
+    return jsonify(camera.replay.stats())
+
+@_app.route('/metrics')
+def metrics_endpoint():
+    """ return the camera pipeline metrics in prometheus text format """
+    return Response(metrics.registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+@_app.route('/latency')
+def latency():
+    """ return the per-stage and end to end latency percentiles per camera
+    query parameter: frames - include the stage times of the last frames
+    """
+    frames = request.args.get('frames', 0, type=int)
+    result = {}
+    for name, camera in _cameras:
+        result[name] = {'percentiles': camera.tracer.percentiles()}
+        if frames > 0:
+            result[name]['frames'] = camera.tracer.traces(frames)
+    return jsonify(result)
 
+@_app.route('/pipeline_stats')
+def pipeline_stats():
+    """ return the per-stage fps and latency counters per camera """
+    return jsonify(dict((name, camera.stage_stats()) for name, camera in _cameras))
@@ -0,0 +1,48 @@
+import numpy as np
+import cv2
+from CameraLib.faceTracking import FaceTracker
+
+class SquareClassifier(object):
+    """ detects the white squares fully inside the image in place of a cascade classifier """
+    def detectMultiScale(self, img, scaleFactor, minNeighbors):
+        height, width = img.shape[0], img.shape[1]
+        contours = cv2.findContours(cv2.threshold(img, 200, 255, cv2.THRESH_BINARY)[1], cv2.RETR_EXTERNAL,
+                                    cv2.CHAIN_APPROX_SIMPLE)[-2]
+        faces = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if x > 0 and y > 0 and x + w < width and y + h < height:
+                faces.append((x, y, w, h))
+        return faces
+
+def squaresImage(boxes, width=640, height=480):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    for (x, y, w, h) in boxes:
+        img[y:y + h, x:x + w] = 255
+    return img
+
+def test_overlapping_detection_regions_do_not_duplicate_faces():
+    # two nearby faces, the padded regions around their tracks overlap and both contain both faces
+    img = squaresImage([(200, 200, 60, 60), (280, 200, 60, 60)])
+    tracker = FaceTracker(SquareClassifier(), framesForDetection=1, roiDetection=True, roiPadding=1.0,
+                          fullDetectionInterval=3, trackerBackend='centroid')
+    tracker.track(img)
+    assert sorted(tracker.trackedFaces.keys()) == [0, 1]
+    for i in range(12):
+        tracker.track(img)
+        assert sorted(tracker.trackedFaces.keys()) == [0, 1]
+    assert tracker.nextFaceID == 2
+
+def test_tracking_snapshot_keeps_the_positions_of_its_frame():
+    tracker = FaceTracker(SquareClassifier(), framesForDetection=1, trackerBackend='centroid', confirmHits=1)
+    tracker.track(squaresImage([(200, 200, 60, 60)]))
+    snapshot = tracker.trackingSnapshot()
+    position = snapshot[0].getPosition()
+    tracker.track(squaresImage([(220, 210, 60, 60)]))
+    assert tracker.getTrackedFaces()[0].getPosition() != position
+    assert snapshot[0].getPosition() == position
+    try:
+        snapshot[0].quality = 0
+        assert False, 'FaceSnapshot should be read only'
+    except AttributeError:
+        pass
@@ -0,0 +1,78 @@
+import itertools
+import numpy as np
+import pytest
+from CameraLib import trackAssociation
+from CameraLib.trackAssociation import boxArray, pairMatrices, iouMatrix, associate, linearAssignment
+
+@pytest.fixture(params=['scipy', 'numpy'])
+def solver(request, monkeypatch):
+    """ run with scipy's linear_sum_assignment (when installed) and with the numpy implementation """
+    if request.param == 'numpy':
+        monkeypatch.setattr(trackAssociation, 'linear_sum_assignment', None)
+    elif trackAssociation.linear_sum_assignment is None:
+        pytest.skip('scipy is not installed')
+    return request.param
+
+def pairReference(a, b):
+    """ IoU and center match of two [x, y, w, h] boxes in plain python """
+    x, y, w, h = a
+    t_x, t_y, t_w, t_h = b
+    iw = max(0, min(x + w, t_x + t_w) - max(x, t_x))
+    ih = max(0, min(y + h, t_y + t_h) - max(y, t_y))
+    union = w * h + t_w * t_h - iw * ih
+    iou = iw * ih / union if union > 0 else 0.0
+    cx, cy = x + 0.5 * w, y + 0.5 * h
+    t_cx, t_cy = t_x + 0.5 * t_w, t_y + 0.5 * t_h
+    centers = t_x <= cx <= t_x + t_w and t_y <= cy <= t_y + t_h and x <= t_cx <= x + w and y <= t_cy <= y + h
+    return (iou, centers)
+
+def validPair(a, b, iouThreshold):
+    iou, centers = pairReference(a, b)
+    return iou >= iouThreshold or centers
+
+def maxMatching(valid, n, m):
+    """ the max number of one to one matches of the valid pairs by trying every assignment """
+    if n > m:
+        return maxMatching([[valid[d][t] for d in range(n)] for t in range(m)], m, n)
+    return max([sum(1 for d, t in enumerate(columns) if valid[d][t]) for columns in itertools.permutations(range(m), n)] + [0])
+
+def randomBoxes(rng, count):
+    return boxArray([(rng.integers(0, 200), rng.integers(0, 200), rng.integers(0, 80), rng.integers(0, 80)) for i in range(count)])
+
+def test_pair_matrices_match_the_scalar_reference():
+    rng = np.random.default_rng(0)
+    for k in range(200):
+        boxesA = randomBoxes(rng, rng.integers(1, 6))
+        boxesB = randomBoxes(rng, rng.integers(1, 6))
+        iou, centers = pairMatrices(boxesA, boxesB)
+        assert iou.shape == centers.shape == (len(boxesA), len(boxesB))
+        for i, j in itertools.product(range(len(boxesA)), range(len(boxesB))):
+            refIou, refCenters = pairReference(boxesA[i].tolist(), boxesB[j].tolist())
+            assert abs(iou[i, j] - refIou) < 1e-9
+            assert centers[i, j] == refCenters
+        assert np.array_equal(iouMatrix(boxesA, boxesB), iou)
+
+def test_associate_finds_the_max_one_to_one_matches(solver):
+    rng = np.random.default_rng(1)
+    for k in range(300):
+        detections = randomBoxes(rng, rng.integers(0, 5))
+        tracks = randomBoxes(rng, rng.integers(0, 5))
+        matches, unmatchedDetections, unmatchedTracks = associate(detections, tracks, 0.3)
+        valid = [[validPair(d.tolist(), t.tolist(), 0.3) for t in tracks] for d in detections]
+        assert all(valid[d][t] for d, t in matches)
+        assert len(set(d for d, t in matches)) == len(matches) == len(set(t for d, t in matches))
+        assert sorted(unmatchedDetections + [d for d, t in matches]) == list(range(len(detections)))
+        assert sorted(unmatchedTracks + [t for d, t in matches]) == list(range(len(tracks)))
+        # as many matches as the best one to one assignment of the valid pairs
+        best = maxMatching(valid, len(detections), len(tracks))
+        assert len(matches) == best
+
+def test_linear_assignment_is_optimal(solver):
+    rng = np.random.default_rng(2)
+    for k in range(50):
+        cost = rng.uniform(0, 1, (rng.integers(1, 5), rng.integers(1, 5)))
+        rows, columns = linearAssignment(cost)
+        n, m = cost.shape
+        best = min(sum(cost[r, c] for r, c in zip(range(n), p)) if n <= m else sum(cost[r, c] for r, c in zip(p, range(m)))
+                   for p in itertools.permutations(range(max(n, m)), min(n, m)))
+        assert abs(cost[rows, columns].sum() - best) < 1e-9